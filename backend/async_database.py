@@ -0,0 +1,19 @@
+# async_database.py
+"""
+Асинхронный доступ к основной БД и БД стран (SQLAlchemy asyncio + asyncpg) для эндпоинтов чтения main.py:
+запросы выполняются в event loop без потоков Starlette, и число одновременных запросов ограничено пулом
+соединений, а не размером пула потоков. Модели и метаданные общие с database.py / country_database.py;
+запись (db_writer, загрузка, миграции) остается синхронной и идет в основную БД.
+"""
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from config import DATABASE_URL, COUNTRY_DATABASE_URL
+from connections import get_async_engine, read_url
+
+# Чтение – с реплики, если она настроена (READ_REPLICA_URL, COUNTRY_READ_REPLICA_URL); при общей БД стран
+# оба движка – один объект с одним пулом (connections.py)
+async_engine = get_async_engine(read_url(DATABASE_URL))
+country_async_engine = get_async_engine(read_url(COUNTRY_DATABASE_URL))
+# expire_on_commit=False: ORM-объекты читаются при сериализации ответа уже после закрытия сессии
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+CountryAsyncSessionLocal = async_sessionmaker(country_async_engine, autoflush=False, expire_on_commit=False)
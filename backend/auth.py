@@ -5,7 +5,8 @@ import secrets
 
 security = HTTPBasic()
 
-def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
+# async: проверка без обращения к БД выполняется прямо в event loop, не занимая поток Starlette
+async def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
     correct_username = secrets.compare_digest(credentials.username, AUTH_USERNAME)
     correct_password = secrets.compare_digest(credentials.password, AUTH_PASSWORD)
     if not (correct_username and correct_password):
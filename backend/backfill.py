@@ -2,92 +2,123 @@
 Скрипт для первичной загрузки исторических данных в базу.
 Период: с 01.01.2024 по 25.02.2025.
 Запросы по доменам выполняются параллельно (до 20 потоков) с подробным логированием и прогресс-баром.
-Используется функция fetch_gsc_data_for_domain из gsc_client.py, которая получает реальные данные для панели "Эффективность"
-(клики, показы, CTR, средняя позиция) и возвращает значения по умолчанию для панели индексации.
+Используется функция fetch_gsc_data_for_range из gsc_client.py, которая одним запросом на окно дат получает реальные данные
+для панели "Эффективность" (клики, показы, CTR, средняя позиция) и возвращает значения по умолчанию для панели индексации.
+С флагом --bulk данные пишутся через COPY во временную таблицу и одним merge в конце (bulk_loader.py).
+Окна регистрируются в журнале заданий (job_ledger.py): повторный запуск за тот же период продолжает
+загрузку с невыполненных окон.
 """
 
+import argparse
+import threading
 import time
-import logging
 from datetime import date, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import DOMAINS
-from database import SessionLocal, engine, Base
-from models import DomainSummary, DomainError
-from gsc_client import fetch_gsc_data_for_domain
-from tqdm import tqdm
+from database import engine, Base, SessionLocal
+from models import DomainSummary
+from gsc_client import fetch_gsc_data_for_range, fetch_gsc_data_batch, date_windows, get_retry_stats
+from db_writer import save_domain_data
+from bulk_loader import DomainBulkWriter
+from job_ledger import run_ledger_job, run_ledger_job_async, finish_units, hold_units, MAX_WORKERS
+from gap_planner import unit_classifier, domain_weights
+from migrations import run_migrations
 
 # Создаем таблицы в базе, если их еще нет
 Base.metadata.create_all(bind=engine)
-
-MAX_WORKERS = 20
+run_migrations()
 
 def daterange(start_date: date, end_date: date):
     for n in range((end_date - start_date).days + 1):
         yield start_date + timedelta(n)
 
-def process_domain_date(domain: str, single_date: date):
-    start = time.time()
-    data = fetch_gsc_data_for_domain(domain, single_date)
-    db = SessionLocal()
-    try:
-        summary = DomainSummary(
-            domain=domain,
-            date=single_date,
-            traffic_clicks=data.get("traffic_clicks", 0),
-            impressions=data.get("impressions", 0),
-            ctr=data.get("ctr", 0.0),
-            avg_position=data.get("avg_position", 0.0),
-            pages_indexed=data.get("pages_indexed", 0),
-            pages_not_indexed=data.get("pages_not_indexed", 0)
-        )
-        db.add(summary)
-        db.commit()
-        errors = data.get("errors", {})
-        for error_type, count in errors.items():
-            domain_error = DomainError(
-                domain=domain,
-                date=single_date,
-                error_type=error_type,
-                count=count
-            )
-            db.add(domain_error)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
-    elapsed = time.time() - start
-    return f"{domain} on {single_date} processed in {elapsed:.2f} sec"
+def process_domain_range(domain: str, start_date: date, end_date: date, save=None):
+    save = save or save_domain_range
+    return save(domain, start_date, end_date, fetch_gsc_data_for_range(domain, start_date, end_date))
+
+def process_domain_batch(pairs, save=None):
+    # {(domain, date): число строк или исключение} – ошибки отдельных запросов пакета учитываются по своим окнам
+    save = save or save_domain_range
+    results = {}
+    for (domain, single_date), result in fetch_gsc_data_batch(pairs).items():
+        if isinstance(result, Exception) or not result:
+            results[(domain, single_date)] = result or 0
+        else:
+            results[(domain, single_date)] = save(domain, single_date, single_date, {single_date: result})
+    return results
+
+def save_domain_range(domain: str, start_date: date, end_date: date, data_by_date: dict):
+    # Upsert по (domain, date) одним запросом на пачку: повторный запуск backfill не создает дубликатов
+    return save_domain_data(domain, data_by_date)
+
+def backfill_data(start_date: date, end_date: date, use_async: bool = False, bulk: bool = False):
+    bulk_writer = DomainBulkWriter() if bulk else None
+    write = bulk_writer.save_domain_range if bulk else save_domain_range
+    rows_written = 0
+    rows_lock = threading.Lock()
 
-def backfill_data(start_date: date, end_date: date):
-    total_tasks = sum(1 for _ in daterange(start_date, end_date)) * len(DOMAINS)
-    print(f"Запущено задач: {total_tasks}")
+    def save(domain: str, window_start: date, window_end: date, data_by_date: dict):
+        nonlocal rows_written
+        count = write(domain, window_start, window_end, data_by_date)
+        with rows_lock:
+            rows_written += count
+        return count
+
+    job_id = f"backfill-domain-{start_date.isoformat()}-{end_date.isoformat()}"
+    windows = list(date_windows(start_date, end_date))
+    total_tasks = len(windows) * len(DOMAINS)
+    print(f"Задание {job_id}: {total_tasks} задач (окна по доменам вместо отдельных дней)")
     start_time = time.time()
-    successes = 0
-    errors = 0
-    tasks = {}
+    units = [(domain, window_start, window_end) for window_start, window_end in windows for domain in DOMAINS]
+    # В режиме --bulk окна отмечаются выполненными только после merge: до него данные не зафиксированы
+    deferred = [] if bulk else None
+    # Недавние окна и домены с большим трафиком – первыми
+    classify = unit_classifier(SessionLocal, DomainSummary, end_date, domain_weights(SessionLocal, end_date))
+
+    # Аренды отложенных окон держатся, пока merge и finish_units не зафиксированы
+    with hold_units(job_id):
+        try:
+            if use_async:
+                # Все запросы из одного event loop с квотами GSC вместо пула потоков
+                result = run_ledger_job_async(job_id, "domain", units, save, desc="Обработка задач", deferred=deferred, classify=classify)
+            else:
+                # Однодневные окна отправляются пакетами в одном HTTP-запросе, остальные – запросами по диапазону
+                result = run_ledger_job(
+                    job_id, "domain", units,
+                    lambda domain, window_start, window_end: process_domain_range(domain, window_start, window_end, save),
+                    lambda pairs: process_domain_batch(pairs, save),
+                    workers=MAX_WORKERS, desc="Обработка задач", deferred=deferred, classify=classify
+                )
+        except Exception:
+            if bulk_writer:
+                bulk_writer.abort()
+            raise
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        for single_date in daterange(start_date, end_date):
-            for domain in DOMAINS:
-                future = executor.submit(process_domain_date, domain, single_date)
-                tasks[future] = (domain, single_date)
-        for future in tqdm(as_completed(tasks), total=total_tasks, desc="Обработка задач", unit="task"):
-            try:
-                future.result()
-                successes += 1
-            except Exception as e:
-                errors += 1
-                domain, single_date = tasks[future]
-                logging.error(f"Ошибка при обработке {domain} on {single_date}: {e}")
+        if bulk_writer:
+            merge_start = time.time()
+            merged = bulk_writer.merge()
+            finish_units(deferred)
+    if bulk_writer:
+        print(f"Перенесено из staging-таблиц: {merged} строк за {time.time() - merge_start:.2f} сек.")
+        successes = result["done"] + len(deferred)
+    else:
+        successes = result["done"]
+    errors = result["failed"]
 
     total_time = time.time() - start_time
     print(f"\nЗавершено: {successes} задач успешно, {errors} ошибок. Общее время выполнения: {total_time:.2f} секунд.")
     if successes > 0:
         print(f"Среднее время обработки одной задачи: {total_time / successes:.2f} секунд.")
+    print(f"Записано строк: {rows_written} ({'COPY' if bulk else 'ORM upsert'}), {rows_written / total_time:.0f} строк/сек.")
+    print(f"Статистика запросов GSC: {get_retry_stats()}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Первичная загрузка исторических данных по доменам")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="загружать асинхронным клиентом из одного event loop")
+    parser.add_argument("--bulk", action="store_true",
+                        help="писать через COPY в staging-таблицу и один merge в конце")
+    args = parser.parse_args()
+
     start_date = date(2024, 1, 1)
     end_date = date(2025, 2, 25)
-    backfill_data(start_date, end_date)
+    backfill_data(start_date, end_date, use_async=args.use_async, bulk=args.bulk)
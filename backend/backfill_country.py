@@ -3,79 +3,147 @@
 Скрипт для первичной загрузки исторических данных по странам в отдельную базу.
 Период: с 01.01.2024 по текущую дату (с учетом задержки GSC).
 Запросы выполняются параллельно (до 20 потоков) с логированием и прогресс-баром.
-Использует функцию fetch_country_data_for_domain из gsc_client.py.
+Использует функцию fetch_country_data_for_range из gsc_client.py (один запрос на окно дат по домену).
+С флагом --derive-domain из тех же данных вычисляются и записываются сводные данные доменов (без запроса с ["date"]).
+С флагом --bulk данные пишутся через COPY во временную таблицу и одним merge в конце (bulk_loader.py).
+Окна регистрируются в журнале заданий (job_ledger.py): повторный запуск за тот же период продолжает
+загрузку с невыполненных окон.
 """
 
+import argparse
+import threading
 import time
-import logging
 from datetime import date, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from config import DOMAINS
-from country_database import SessionLocal, engine, Base
+from config import DOMAINS, DERIVE_DOMAIN_FROM_COUNTRY
+from country_database import engine, Base, SessionLocal
 from country_models import CountrySummary
-from gsc_client import fetch_country_data_for_domain
-from tqdm import tqdm
+from database import SessionLocal as MainSessionLocal
+from gsc_client import fetch_country_data_for_range, iter_country_data_for_range, fetch_country_data_batch, derive_domain_data_by_date, date_windows, get_retry_stats
+import db_writer
+from bulk_loader import CountryBulkWriter
+from job_ledger import run_ledger_job, run_ledger_job_async, finish_units, hold_units, MAX_WORKERS
+from gap_planner import unit_classifier, domain_weights
+from migrations import run_migrations
 
 # Создаем таблицы в базе, если их еще нет
 Base.metadata.create_all(bind=engine)
-
-MAX_WORKERS = 20
+# Ключи и индексы обеих БД (журнал заданий хранится в основной)
+run_migrations()
 
 def daterange(start_date: date, end_date: date):
   for n in range((end_date - start_date).days + 1):
       yield start_date + timedelta(n)
 
-def process_country_data(domain: str, single_date: date):
-  records = fetch_country_data_for_domain(domain, single_date)
-  db = SessionLocal()
-  try:
-      for record in records:
-          summary = CountrySummary(
-              domain=record["domain"],
-              date=record["date"],
-              country=record["country"],
-              traffic_clicks=record["traffic_clicks"],
-              impressions=record["impressions"],
-              ctr=record["ctr"],
-              avg_position=record["avg_position"]
-          )
-          db.add(summary)
-      db.commit()
-  except Exception as e:
-      db.rollback()
-      raise e
-  finally:
-      db.close()
-  return f"{domain} on {single_date} processed with {len(records)} records"
-
-def backfill_country_data(start_date: date, end_date: date):
-  total_tasks = sum(1 for _ in daterange(start_date, end_date)) * len(DOMAINS)
-  print(f"Запущено задач (страны): {total_tasks}")
+def process_country_data(domain: str, start_date: date, end_date: date, save=None, save_batches=None):
+  if save is None:
+      # Страницы ответа пишутся в БД по мере получения, весь ответ в памяти не держится
+      save_batches = save_batches or save_country_batches
+      total_records = save_batches(domain, start_date, end_date, iter_country_data_for_range(domain, start_date, end_date))
+  else:
+      total_records = save(domain, start_date, end_date, fetch_country_data_for_range(domain, start_date, end_date))
+  return total_records
+
+def process_country_batch(pairs, save=None):
+  # {(domain, date): число строк или исключение} – ошибки отдельных запросов пакета учитываются по своим окнам
+  save = save or save_country_data
+  results = {}
+  for (domain, single_date), records in fetch_country_data_batch(pairs).items():
+      if isinstance(records, Exception):
+          results[(domain, single_date)] = records
+      else:
+          results[(domain, single_date)] = save(domain, single_date, single_date, {single_date: records}) if records else 0
+  return results
+
+def save_country_data(domain: str, start_date: date, end_date: date, records_by_date: dict):
+  return db_writer.save_country_data(records_by_date)
+
+def save_country_batches(domain: str, start_date: date, end_date: date, batches):
+  # Upsert по (domain, date, country) одним запросом на пачку: повторный запуск не создает дубликатов
+  return db_writer.save_country_batches(batches)
+
+def backfill_country_data(start_date: date, end_date: date, use_async: bool = False, derive_domain: bool = False, bulk: bool = False):
+  bulk_writer = CountryBulkWriter() if bulk else None
+  write_batches = bulk_writer.save_country_batches if bulk else save_country_batches
+  rows_written = 0
+  rows_lock = threading.Lock()
+
+  def save_batches(domain: str, window_start: date, window_end: date, batches):
+      nonlocal rows_written
+      count = write_batches(domain, window_start, window_end, batches)
+      with rows_lock:
+          rows_written += count
+      return count
+
+  def save(domain: str, window_start: date, window_end: date, records_by_date: dict):
+      count = save_batches(domain, window_start, window_end, (records_by_date[d] for d in sorted(records_by_date)))
+      if derive_domain:
+          # Сводные данные домена, вычисленные из тех же записей, – в основную БД
+          db_writer.save_domain_data(domain, derive_domain_data_by_date(domain, records_by_date))
+      return count
+
+  # Без --derive-domain окна пишутся потоково (постранично), с ним нужны все записи окна сразу
+  range_save = save if derive_domain else None
+  # С --derive-domain задание пишет и в domain_summaries: аренда набора derived закрывает обе таблицы
+  dataset = "derived" if derive_domain else "country"
+  job_id = f"backfill-{dataset}-{start_date.isoformat()}-{end_date.isoformat()}"
+  windows = list(date_windows(start_date, end_date))
+  total_tasks = len(windows) * len(DOMAINS)
+  print(f"Задание {job_id}: {total_tasks} задач (окна по доменам вместо отдельных дней)")
   start_time = time.time()
-  successes = 0
-  errors = 0
-  tasks = {}
-
-  with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-      for single_date in daterange(start_date, end_date):
-          for domain in DOMAINS:
-              future = executor.submit(process_country_data, domain, single_date)
-              tasks[future] = (domain, single_date)
-      for future in tqdm(as_completed(tasks), total=total_tasks, desc="Обработка задач (страны)", unit="task"):
-          try:
-              future.result()
-              successes += 1
-          except Exception as e:
-              errors += 1
-              domain, single_date = tasks[future]
-              logging.error(f"Ошибка при обработке {domain} on {single_date}: {e}")
+  units = [(domain, window_start, window_end) for window_start, window_end in windows for domain in DOMAINS]
+  # В режиме --bulk окна отмечаются выполненными только после merge: до него данные не зафиксированы
+  deferred = [] if bulk else None
+  # Недавние окна и домены с большим трафиком – первыми
+  classify = unit_classifier(SessionLocal, CountrySummary, end_date, domain_weights(MainSessionLocal, end_date))
+
+  # Аренды отложенных окон держатся, пока merge и finish_units не зафиксированы
+  with hold_units(job_id):
+    try:
+        if use_async:
+            # Все запросы из одного event loop с квотами GSC вместо пула потоков
+            result = run_ledger_job_async(job_id, dataset, units, save, "country", desc="Обработка задач (страны)", deferred=deferred, classify=classify)
+        else:
+            # Однодневные окна отправляются пакетами в одном HTTP-запросе, остальные – запросами по диапазону
+            result = run_ledger_job(
+                job_id, dataset, units,
+                lambda domain, window_start, window_end: process_country_data(domain, window_start, window_end, range_save, save_batches),
+                lambda pairs: process_country_batch(pairs, save),
+                workers=MAX_WORKERS, desc="Обработка задач (страны)", deferred=deferred, classify=classify
+            )
+    except Exception:
+        if bulk_writer:
+            bulk_writer.abort()
+        raise
+
+    if bulk_writer:
+        merge_start = time.time()
+        merged = bulk_writer.merge()
+        finish_units(deferred)
+  if bulk_writer:
+      print(f"Перенесено из staging-таблицы: {merged} строк за {time.time() - merge_start:.2f} сек.")
+      successes = result["done"] + len(deferred)
+  else:
+      successes = result["done"]
+  errors = result["failed"]
+
   total_time = time.time() - start_time
   print(f"\nСтрана. Завершено: {successes} задач успешно, {errors} ошибок. Общее время: {total_time:.2f} сек.")
   if successes > 0:
       print(f"Среднее время обработки одной задачи: {total_time / successes:.2f} сек.")
+  print(f"Записано строк: {rows_written} ({'COPY' if bulk else 'ORM upsert'}), {rows_written / total_time:.0f} строк/сек.")
+  print(f"Статистика запросов GSC: {get_retry_stats()}")
 
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Первичная загрузка исторических данных по странам")
+  parser.add_argument("--async", dest="use_async", action="store_true",
+                      help="загружать асинхронным клиентом из одного event loop")
+  parser.add_argument("--derive-domain", dest="derive_domain", action="store_true", default=DERIVE_DOMAIN_FROM_COUNTRY,
+                      help="также записывать сводные данные доменов, вычисленные из данных по странам")
+  parser.add_argument("--bulk", action="store_true",
+                      help="писать через COPY в staging-таблицу и один merge в конце")
+  args = parser.parse_args()
+
   start_date = date(2024, 1, 1)
   # Используем сегодняшнюю дату минус 2 дня (учитывая задержку GSC)
   end_date = date.today() - timedelta(days=2)
-  backfill_country_data(start_date, end_date)
+  backfill_country_data(start_date, end_date, use_async=args.use_async, derive_domain=args.derive_domain, bulk=args.bulk)
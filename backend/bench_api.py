@@ -0,0 +1,73 @@
+# bench_api.py
+"""
+Нагрузочный бенчмарк эндпоинтов чтения запущенного API: --concurrency одновременных клиентов
+отправляют по кругу запросы к эндпоинту в течение --duration секунд. Выводит запросы в секунду,
+p50 / p95 задержки и число ошибок по каждому эндпоинту – для сравнения до и после изменений
+(например, синхронные сессии в пуле потоков против асинхронных, async_database.py).
+
+Запуск: python bench_api.py [--url http://localhost:8000] [--concurrency 50] [--duration 10] [--date 2025-01-01]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import date, timedelta
+
+import httpx
+
+from config import DOMAINS, AUTH_USERNAME, AUTH_PASSWORD
+
+def endpoints(target_date: date):
+    start_date = target_date - timedelta(days=29)
+    return [
+        f"/api/summary?target_date={target_date}",
+        f"/api/domain/{DOMAINS[0]}/summary?target_date={target_date}",
+        f"/api/domain/{DOMAINS[0]}/errors?target_date={target_date}",
+        "/api/all_domains_last_dates",
+        f"/api/summary_range?start_date={start_date}&end_date={target_date}",
+        f"/api/domain_range_summary?domain_name={DOMAINS[0]}&start_date={start_date}&end_date={target_date}",
+        f"/api/country_summary?target_date={target_date}",
+    ]
+
+async def run(client, path: str, concurrency: int, duration: float):
+    """(число запросов, число ошибок, задержки в мс) за duration секунд."""
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return len(latencies), errors, latencies
+
+async def main_async(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, auth=(AUTH_USERNAME, AUTH_PASSWORD), limits=limits, timeout=60) as client:
+        for path in endpoints(args.date):
+            requests, errors, latencies = await run(client, path, args.concurrency, args.duration)
+            quantiles = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else [0.0] * 19
+            print(f"{path.split('?')[0]:<35} {requests / args.duration:>8.1f} req/s  "
+                  f"p50 {statistics.median(latencies) if latencies else 0.0:>7.1f} ms  p95 {quantiles[18]:>7.1f} ms  "
+                  f"errors {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк эндпоинтов чтения API (запросы в секунду)")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на эндпоинт")
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today() - timedelta(days=3))
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
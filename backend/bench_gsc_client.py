@@ -0,0 +1,104 @@
+# bench_gsc_client.py
+"""
+Микро-бенчмарк накладных расходов на получение сервиса GSC.
+Сравнивает прежний путь (чтение token.json + build() + новое соединение на каждый запрос)
+с пулом сервисов из gsc_client (один сервис и одно keep-alive соединение на поток).
+Запросы отправляются на локальный HTTP-сервер, поэтому реальные учетные данные и сеть не нужны.
+
+Запуск: python bench_gsc_client.py [--threads 20] [--calls 50]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+import gsc_client
+
+class _EmptyQueryHandler(BaseHTTPRequestHandler):
+    """Отвечает на любой POST пустым ответом Search Analytics, поддерживает keep-alive."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"rows": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _write_fake_token(path):
+    expiry = (datetime.utcnow() + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    with open(path, "w") as f:
+        json.dump({
+            "token": "bench-token",
+            "refresh_token": "bench-refresh-token",
+            "token_uri": "https://oauth2.googleapis.com/token",
+            "client_id": "bench",
+            "client_secret": "bench",
+            "scopes": gsc_client.SCOPES,
+            "expiry": expiry
+        }, f)
+
+def legacy_get_service():
+    """Прежний вариант get_gsc_service: файл токена и build() на каждый вызов."""
+    creds = Credentials.from_authorized_user_file(gsc_client.TOKEN_FILE, gsc_client.SCOPES)
+    return build('searchconsole', 'v1', credentials=creds, client_options={"api_endpoint": gsc_client.API_ENDPOINT})
+
+def run(get_service, threads: int, calls: int, execute: bool):
+    def worker():
+        for _ in range(calls):
+            service = get_service()
+            if execute:
+                service.searchanalytics().query(siteUrl="https://alvadi.jp/", body={}).execute()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(worker) for _ in range(threads)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    # Потоки работают параллельно, поэтому средняя длительность вызова в потоке – elapsed / calls
+    return elapsed, elapsed / calls
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пула сервисов GSC")
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EmptyQueryHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    gsc_client.API_ENDPOINT = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        gsc_client.TOKEN_FILE = os.path.join(tmp, "token.json")
+        _write_fake_token(gsc_client.TOKEN_FILE)
+
+        total = args.threads * args.calls
+        print(f"Потоков: {args.threads}, вызовов на поток: {args.calls} (всего {total})")
+        for execute in (False, True):
+            title = "получение сервиса + запрос" if execute else "только получение сервиса"
+            legacy_time, legacy_per_call = run(legacy_get_service, args.threads, args.calls, execute)
+            pooled_time, pooled_per_call = run(gsc_client.get_gsc_service, args.threads, args.calls, execute)
+            print(f"\n{title}:")
+            print(f"  прежний путь: {legacy_time:.2f} сек, {legacy_per_call * 1000:.2f} мс на вызов")
+            print(f"  пул сервисов: {pooled_time:.2f} сек, {pooled_per_call * 1000:.2f} мс на вызов")
+            print(f"  экономия на вызов: {(legacy_per_call - pooled_per_call) * 1000:.2f} мс")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# bench_ingest.py
+"""
+Бенчмарк путей загрузки данных на локальной замене API (fake_gsc_server.py), без учетных данных Google.
+Для каждого пути выводит время, число строк в секунду и число обращений к API (отдельных запросов
+searchanalytics.query и HTTP-запросов – пакет считается одним HTTP-запросом).
+
+Пути:
+  per_day     – прежний вариант: отдельный запрос на каждую пару (домен, дата)
+  range       – запрос на окно дат (date_windows) по домену в пуле потоков
+  range_batch – как range, но однодневные окна отправляются пакетами (как в cron_job)
+  async       – асинхронный клиент из одного event loop (gsc_async_client)
+  derived     – только запрос по странам, доменные данные вычисляются из него (DERIVE_DOMAIN_FROM_COUNTRY)
+
+По умолчанию строки только подсчитываются; с --db они записываются в БД (db_writer).
+
+Запуск: python bench_ingest.py [--days 30] [--domains 52] [--latency 0.05] [--quota-error-rate 0.01]
+                               [--paths per_day range range_batch async derived] [--db]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import gsc_client
+from bench_gsc_client import _write_fake_token
+from config import DOMAINS
+from fake_gsc_server import FakeGSCServer
+
+PATHS = ["per_day", "range", "range_batch", "async", "derived"]
+
+class RowSink:
+    """
+    Приемник загруженных данных: считает строки и (с --db) сохраняет их в БД (db_writer).
+    """
+
+    def __init__(self, write_db: bool = False):
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.write_db = write_db
+
+    def _count(self, count: int):
+        with self._lock:
+            self.rows += count
+
+    def save(self, dataset: str, domain: str, start_date: date, end_date: date, result: dict):
+        if dataset == "domain":
+            self._count(len(result))
+        else:
+            self._count(sum(len(records) for records in result.values()))
+        if self.write_db:
+            import db_writer
+            if dataset == "domain":
+                db_writer.save_domain_data(domain, result)
+            else:
+                db_writer.save_country_data(result)
+
+def _daterange(start_date: date, end_date: date):
+    for n in range((end_date - start_date).days + 1):
+        yield start_date + timedelta(n)
+
+def _run_threaded(jobs, workers: int):
+    errors = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(job, *args) for job, *args in jobs]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                errors += 1
+    return errors
+
+def run_path(path: str, dataset: str, domains, start_date: date, end_date: date, sink: RowSink, workers: int):
+    """
+    Загружает данные dataset ("domain" или "country") выбранным путем. Возвращает число ошибок.
+    """
+    fetch_range = gsc_client.fetch_gsc_data_for_range if dataset == "domain" else gsc_client.fetch_country_data_for_range
+    units = [(domain, window_start, window_end)
+             for domain in domains
+             for window_start, window_end in gsc_client.date_windows(start_date, end_date)]
+
+    if path == "per_day":
+        fetch_day = gsc_client.fetch_gsc_data_for_domain if dataset == "domain" else gsc_client.fetch_country_data_for_domain
+
+        def job(domain, single_date):
+            result = fetch_day(domain, single_date)
+            sink.save(dataset, domain, single_date, single_date, {single_date: result} if result else {})
+
+        return _run_threaded([(job, domain, d) for domain in domains for d in _daterange(start_date, end_date)], workers)
+
+    if path == "async":
+        from gsc_async_client import run_ingest_units
+        _, failures = run_ingest_units(units, dataset, lambda *args: sink.save(dataset, *args), desc=f"{path}/{dataset}")
+        return len(failures)
+
+    def range_job(domain, window_start, window_end):
+        sink.save(dataset, domain, window_start, window_end, fetch_range(domain, window_start, window_end))
+
+    if path == "range":
+        return _run_threaded([(range_job, *unit) for unit in units], workers)
+
+    # range_batch
+    fetch_batch = gsc_client.fetch_gsc_data_batch if dataset == "domain" else gsc_client.fetch_country_data_batch
+    single_days, range_units = gsc_client.split_single_day_units(units)
+
+    def batch_job(pairs):
+        failed = 0
+        for (domain, single_date), result in fetch_batch(pairs).items():
+            if isinstance(result, Exception):
+                failed += 1
+            elif result:
+                sink.save(dataset, domain, single_date, single_date, {single_date: result})
+        if failed:
+            raise RuntimeError(f"{failed} requests failed")
+
+    jobs = [(range_job, *unit) for unit in range_units]
+    jobs += [(batch_job, single_days[i:i + gsc_client.BATCH_SIZE]) for i in range(0, len(single_days), gsc_client.BATCH_SIZE)]
+    return _run_threaded(jobs, workers)
+
+def run_derived(domains, start_date: date, end_date: date, sink: RowSink, workers: int):
+    def job(domain, window_start, window_end):
+        records_by_date = gsc_client.fetch_country_data_for_range(domain, window_start, window_end)
+        sink.save("country", domain, window_start, window_end, records_by_date)
+        sink.save("domain", domain, window_start, window_end, gsc_client.derive_domain_data_by_date(domain, records_by_date))
+
+    units = [(domain, window_start, window_end)
+             for domain in domains
+             for window_start, window_end in gsc_client.date_windows(start_date, end_date)]
+    return _run_threaded([(job, *unit) for unit in units], workers)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк путей загрузки данных на локальной замене GSC API")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--domains", type=int, default=len(DOMAINS))
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа сервера, сек.")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--backoff-base", type=float, default=0.05, help="BACKOFF_BASE на время бенчмарка")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=PATHS)
+    parser.add_argument("--datasets", nargs="+", choices=["domain", "country"], default=["domain", "country"])
+    parser.add_argument("--db", action="store_true", help="записывать данные в БД (db_writer)")
+    args = parser.parse_args()
+
+    end_date = date.today() - timedelta(days=2)
+    start_date = end_date - timedelta(days=args.days - 1)
+    domains = DOMAINS[:args.domains]
+    gsc_client.BACKOFF_BASE = args.backoff_base
+
+    with FakeGSCServer(latency=args.latency, quota_error_rate=args.quota_error_rate) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        gsc_client.API_ENDPOINT = server.url
+        gsc_client.TOKEN_FILE = os.path.join(tmp, "token.json")
+        _write_fake_token(gsc_client.TOKEN_FILE)
+
+        print(f"Доменов: {len(domains)}, период: {start_date} - {end_date}, задержка: {args.latency} сек., "
+              f"доля 429: {args.quota_error_rate}, потоков: {args.workers}")
+        print(f"{'путь':<12} {'данные':<8} {'время, с':>9} {'строк':>9} {'строк/с':>10} {'запросов':>9} {'HTTP':>7} {'429':>5} {'ошибок':>7}")
+        for path in args.paths:
+            datasets = ["both"] if path == "derived" else args.datasets
+            for dataset in datasets:
+                sink = RowSink(args.db)
+                server.reset_stats()
+                started = time.perf_counter()
+                if path == "derived":
+                    errors = run_derived(domains, start_date, end_date, sink, args.workers)
+                else:
+                    errors = run_path(path, dataset, domains, start_date, end_date, sink, args.workers)
+                elapsed = time.perf_counter() - started
+                stats = server.stats
+                print(f"{path:<12} {dataset:<8} {elapsed:>9.2f} {sink.rows:>9} {sink.rows / elapsed:>10.0f} "
+                      f"{stats['api_calls']:>9} {stats['http_requests']:>7} {stats['quota_errors']:>5} {errors:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# bulk_loader.py
+"""
+Массовая загрузка для backfill-скриптов (режим --bulk): записи буферизуются и потоком передаются
+командой PostgreSQL COPY во временную staging-таблицу, а в конце загрузки переносятся в основную
+таблицу одним запросом INSERT ... SELECT ... ON CONFLICT DO UPDATE; в той же транзакции пересчитываются
+недельные и месячные сводки загруженных дат (rollups.py) и последние даты доменов (watermarks.py).
+По сравнению с построчной записью через ORM это убирает разбор и выполнение отдельного INSERT на каждую строку.
+"""
+
+import csv
+import io
+import logging
+import threading
+import time
+
+from db_writer import (
+    domain_summary_rows, country_summary_rows,
+    DOMAIN_SUMMARY_KEY, DOMAIN_ERROR_KEY, COUNTRY_SUMMARY_KEY
+)
+from rollups import ROLLUPS, refresh_rollups
+from dimensions import encode_rows
+from watermarks import advance_watermarks
+
+logger = logging.getLogger("gsc_stats")
+
+# Сколько строк копить в памяти перед очередным COPY
+COPY_BUFFER_ROWS = 50000
+
+class CopyLoader:
+    """
+    Загрузчик одной таблицы через COPY во временную таблицу и итоговый set-based merge.
+    Работает на отдельном соединении в одной транзакции: пока не вызван merge(), данные в основной
+    таблице не видны, а при ошибке или abort() вся загрузка откатывается. Потокобезопасен.
+    """
+
+    def __init__(self, engine, model, key_columns: tuple, buffer_rows: int = COPY_BUFFER_ROWS):
+        self.engine = engine
+        self.table = model.__tablename__
+        self.staging = f"staging_{self.table}"
+        self.columns = [column.name for column in model.__table__.columns if column.name != "id"]
+        self.key_columns = key_columns
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+        self.copy_seconds = 0.0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._conn = engine.raw_connection()
+        with self._conn.cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE {self.staging} AS SELECT {', '.join(self.columns)} FROM {self.table} WITH NO DATA")
+            # Порядок поступления: при повторе ключа в merge побеждает последняя строка
+            cursor.execute(f"ALTER TABLE {self.staging} ADD COLUMN load_seq bigserial")
+
+    def add(self, rows: list):
+        """
+        Добавляет строки (словари колонок, домены и страны – именами) в буфер; при заполнении буфера выполняет COPY.
+        """
+        # Ключи справочников выдаются в отдельной зафиксированной транзакции – до основной
+        rows = encode_rows(self.engine, self.table, rows)
+        with self._lock:
+            self._buffer.extend(rows)
+            self.rows += len(rows)
+            if len(self._buffer) >= self.buffer_rows:
+                self._flush()
+        return len(rows)
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        started = time.time()
+        data = io.StringIO()
+        writer = csv.writer(data)
+        for row in self._buffer:
+            # None -> пустое поле без кавычек, COPY в формате csv читает его как NULL
+            writer.writerow(["" if row.get(column) is None else row[column] for column in self.columns])
+        data.seek(0)
+        sql = f"COPY {self.staging} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv)"
+        with self._conn.cursor() as cursor:
+            if hasattr(cursor, "copy_expert"):
+                cursor.copy_expert(sql, data)
+            else:
+                # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(data.getvalue())
+        self._buffer = []
+        self.copy_seconds += time.time() - started
+
+    def merge(self):
+        """
+        Выгружает остаток буфера и переносит staging-таблицу в основную одним запросом, затем фиксирует
+        транзакцию и закрывает соединение. Возвращает число вставленных или обновленных строк.
+        """
+        with self._lock:
+            try:
+                self._flush()
+                key = ", ".join(self.key_columns)
+                columns = ", ".join(self.columns)
+                updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in self.columns if column not in self.key_columns)
+                with self._conn.cursor() as cursor:
+                    cursor.execute(
+                        f"INSERT INTO {self.table} ({columns}) "
+                        f"SELECT DISTINCT ON ({key}) {columns} FROM {self.staging} ORDER BY {key}, load_seq DESC "
+                        f"ON CONFLICT ({key}) DO UPDATE SET {updates}"
+                    )
+                    merged = cursor.rowcount
+                    if self.table in ROLLUPS:
+                        cursor.execute(
+                            f"SELECT d.name, min(s.date), max(s.date), (array_agg(DISTINCT s.date ORDER BY s.date DESC))[1:2] "
+                            f"FROM {self.staging} s JOIN domains d ON d.id = s.domain_id GROUP BY d.name"
+                        )
+                        rows = cursor.fetchall()
+                        refresh_rollups(cursor.execute, self.table, [(domain, start, end) for domain, start, end, _ in rows])
+                        advance_watermarks(cursor.execute, self.table, {domain: latest for domain, _, _, latest in rows})
+                self._conn.commit()
+                return merged
+            except Exception:
+                self._conn.rollback()
+                raise
+            finally:
+                self._conn.close()
+
+    def abort(self):
+        with self._lock:
+            self._conn.rollback()
+            self._conn.close()
+
+class DomainBulkWriter:
+    """
+    Массовая запись domain_summaries и domain_errors; save_domain_range совместим по сигнатуре с backfill.save_domain_range.
+    """
+
+    def __init__(self):
+        from database import engine
+        from models import DomainSummary, DomainError
+        self.summaries = CopyLoader(engine, DomainSummary, DOMAIN_SUMMARY_KEY)
+        self.errors = CopyLoader(engine, DomainError, DOMAIN_ERROR_KEY)
+
+    @property
+    def rows(self):
+        return self.summaries.rows + self.errors.rows
+
+    def save_domain_range(self, domain, start_date, end_date, data_by_date: dict):
+        summaries, errors = domain_summary_rows(domain, data_by_date)
+        self.summaries.add(summaries)
+        self.errors.add(errors)
+        return len(summaries)
+
+    def merge(self):
+        return self.summaries.merge() + self.errors.merge()
+
+    def abort(self):
+        self.summaries.abort()
+        self.errors.abort()
+
+class CountryBulkWriter:
+    """
+    Массовая запись country_summaries; методы совместимы по сигнатуре с backfill_country.save_country_data/save_country_batches.
+    """
+
+    def __init__(self):
+        from country_database import engine
+        from country_models import CountrySummary
+        self.summaries = CopyLoader(engine, CountrySummary, COUNTRY_SUMMARY_KEY)
+
+    @property
+    def rows(self):
+        return self.summaries.rows
+
+    def save_country_batches(self, domain, start_date, end_date, batches):
+        total_records = 0
+        for records in batches:
+            total_records += self.summaries.add(country_summary_rows(records))
+        return total_records
+
+    def save_country_data(self, domain, start_date, end_date, records_by_date: dict):
+        return self.save_country_batches(domain, start_date, end_date, records_by_date.values())
+
+    def merge(self):
+        return self.summaries.merge()
+
+    def abort(self):
+        self.summaries.abort()
@@ -0,0 +1,179 @@
+# check_query_plans.py
+"""
+Регрессионная проверка индексов: для запроса каждого эндпоинта main.py выполняет EXPLAIN (ANALYZE, FORMAT JSON)
+и проверяет, что таблицы сводок читаются по индексу (Index Scan, Index Only Scan, Bitmap Index Scan),
+а не последовательным сканированием. Выводит план, использованный индекс и время выполнения.
+
+По умолчанию проверяются настроенные БД (EXPLAIN ANALYZE выполняет только SELECT). С --generate пустая
+scratch-БД (--database-url) перед проверкой создается по моделям, мигрируется (migrations.py)
+и заполняется синтетическими данными реального объема: все домены × --days дней × --countries стран.
+
+Запуск: python check_query_plans.py [--database-url postgresql://.../scratch --generate] [--days 730] [--countries 200]
+                                    [--window 30]
+Код выхода 1, если хотя бы один запрос читает таблицу сводок без индекса.
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, select, func, text
+
+from config import DOMAINS, DATABASE_URL, COUNTRY_DATABASE_URL
+from database import Base
+from models import DomainSummary, DomainError
+from country_database import Base as CountryBase
+from country_models import CountrySummary
+from dimensions import domain_filter, country_filter
+from migrations import migrate, MAIN_MIGRATIONS, COUNTRY_MIGRATIONS
+from partitions import ensure_partitions
+
+CHECKED_TABLES = {"domain_summaries", "domain_errors", "country_summaries"}
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+def endpoint_queries(last_date: date, window_days: int, domain: str, country: str):
+    """
+    Запросы эндпоинтов main.py в том виде, в каком их строит ORM: [(эндпоинт, "main" | "country", select)].
+    Эндпоинты последних дат читают ingest_watermarks (watermarks.py), а не сводки, и здесь не проверяются.
+    """
+    start_date = last_date - timedelta(days=window_days - 1)
+    return [
+        ("/api/summary", "main", select(DomainSummary).where(DomainSummary.date == last_date)),
+        ("/api/domain/{domain}/summary", "main", select(DomainSummary).where(
+            domain_filter(DomainSummary, domain), DomainSummary.date == last_date).limit(1)),
+        ("/api/domain/{domain}/errors", "main", select(DomainError).where(
+            DomainError.domain == domain, DomainError.date == last_date)),
+        ("/api/summary_range", "main", select(DomainSummary).where(
+            DomainSummary.date >= start_date, DomainSummary.date <= last_date)),
+        ("/api/domain_range_summary", "main", select(DomainSummary).where(
+            domain_filter(DomainSummary, domain), DomainSummary.date >= start_date, DomainSummary.date <= last_date)),
+        ("/api/country_summary", "country", select(CountrySummary).where(CountrySummary.date == last_date)),
+        ("/api/country/{country}/summary", "country", select(CountrySummary).where(
+            country_filter(CountrySummary, country), CountrySummary.date == last_date)),
+        ("/api/country_range_summary", "country", select(CountrySummary).where(
+            CountrySummary.date >= start_date, CountrySummary.date <= last_date)),
+    ]
+
+def plan_scans(plan: dict):
+    """Узлы плана, читающие проверяемые таблицы: [(тип узла, таблица, индекс)]."""
+    scans = []
+    relation = plan.get("Relation Name")
+    # Секции country_summaries (partitions.py) проверяются как сама таблица
+    checked = relation is not None and any(relation == table or relation.startswith(f"{table}_") for table in CHECKED_TABLES)
+    if checked or (plan["Node Type"] in INDEX_NODES and plan.get("Index Name")):
+        scans.append((plan["Node Type"], relation, plan.get("Index Name")))
+    for child in plan.get("Plans", []):
+        scans.extend(plan_scans(child))
+    return scans
+
+def explain(engine, statement):
+    """EXPLAIN ANALYZE запроса: (узлы сканирования, время выполнения в мс)."""
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        result = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")).scalar()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]
+    return plan_scans(plan["Plan"]), plan["Execution Time"]
+
+def generate_data(engine, country_engine, days: int, countries: int, last_date: date):
+    """
+    Заполняет пустые таблицы синтетическими данными: строки генерируются на сервере (generate_series),
+    затем VACUUM ANALYZE – актуальная статистика и карта видимости для index-only scan.
+    """
+    for table_engine, model in ((engine, DomainSummary), (engine, DomainError), (country_engine, CountrySummary)):
+        with table_engine.connect() as conn:
+            if conn.execute(select(func.count()).select_from(model.__table__)).scalar():
+                sys.exit(f"{model.__tablename__} is not empty: --generate only fills an empty scratch database")
+    params = {"domains": list(DOMAINS), "start_date": last_date - timedelta(days=days - 1), "days": days}
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO domains (name) SELECT unnest(CAST(:domains AS varchar[])) ON CONFLICT DO NOTHING"), params)
+        conn.execute(text("""
+            INSERT INTO domain_summaries (domain_id, date, traffic_clicks, impressions, ctr, avg_position,
+                                          pages_indexed, pages_not_indexed, is_final)
+            SELECT d.id, CAST(:start_date AS date) + n, (random() * 5000)::int, (random() * 100000)::int,
+                   random() * 0.1, 1 + random() * 50, 0, 0, true
+            FROM domains d, generate_series(0, :days - 1) AS n
+            WHERE d.name = ANY(CAST(:domains AS varchar[]))
+        """), params)
+        conn.execute(text("""
+            INSERT INTO domain_errors (domain, date, error_type, count)
+            SELECT d.domain, CAST(:start_date AS date) + n, 'error_' || e, (random() * 100)::int
+            FROM unnest(CAST(:domains AS varchar[])) AS d(domain), generate_series(0, :days - 1) AS n,
+                 generate_series(1, 5) AS e
+        """), params)
+    with country_engine.begin() as conn:
+        conn.execute(text("INSERT INTO domains (name) SELECT unnest(CAST(:domains AS varchar[])) ON CONFLICT DO NOTHING"), params)
+        conn.execute(text("""
+            INSERT INTO countries (name) SELECT 'c' || lpad(c::text, 3, '0') FROM generate_series(1, :countries) AS c
+            ON CONFLICT DO NOTHING
+        """), {"countries": countries})
+        conn.execute(text("""
+            INSERT INTO country_summaries (domain_id, country_id, date, traffic_clicks, impressions, ctr, avg_position, is_final)
+            SELECT d.id, c.id, CAST(:start_date AS date) + n, (random() * 500)::int,
+                   (random() * 10000)::int, random() * 0.1, 1 + random() * 50, true
+            FROM domains d, countries c, generate_series(0, :days - 1) AS n
+            WHERE d.name = ANY(CAST(:domains AS varchar[]))
+        """), params)
+    for table_engine, table in ((engine, "domain_summaries"), (engine, "domain_errors"), (country_engine, "country_summaries")):
+        with table_engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+            conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов запросов эндпоинтов (EXPLAIN ANALYZE)")
+    parser.add_argument("--database-url", default=None, help="одна БД для основных таблиц и таблиц стран")
+    parser.add_argument("--generate", action="store_true", help="создать и заполнить пустую scratch-БД")
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--countries", type=int, default=200)
+    parser.add_argument("--window", type=int, default=30, help="длина диапазона дат в range-запросах")
+    args = parser.parse_args()
+
+    if args.generate and args.database_url in (None, DATABASE_URL, COUNTRY_DATABASE_URL):
+        sys.exit("--generate writes synthetic rows: pass --database-url of a scratch database")
+    if args.database_url:
+        engine = country_engine = create_engine(args.database_url)
+    else:
+        engine, country_engine = create_engine(DATABASE_URL), create_engine(COUNTRY_DATABASE_URL)
+
+    if args.generate:
+        Base.metadata.create_all(bind=engine)
+        CountryBase.metadata.create_all(bind=country_engine)
+        migrate(engine, "main", MAIN_MIGRATIONS)
+        migrate(country_engine, "country", COUNTRY_MIGRATIONS)
+        last_date = date.today() - timedelta(days=2)
+        # country_summaries секционирована: без секций за период генерации INSERT некуда писать
+        ensure_partitions(country_engine, start_date=last_date - timedelta(days=args.days))
+        start = time.time()
+        generate_data(engine, country_engine, args.days, args.countries, last_date)
+        print(f"Generated {len(DOMAINS)} domains x {args.days} days x {args.countries} countries "
+              f"in {time.time() - start:.1f}s")
+    else:
+        with engine.connect() as conn:
+            last_date = conn.execute(select(func.max(DomainSummary.date))).scalar()
+        if last_date is None:
+            sys.exit("domain_summaries is empty: use --generate on a scratch database")
+
+    with country_engine.connect() as conn:
+        country = conn.execute(
+            select(CountrySummary.country).where(CountrySummary.date == last_date).limit(1)
+        ).scalar() or "usa"
+
+    engines = {"main": engine, "country": country_engine}
+    failed = []
+    for endpoint, database, statement in endpoint_queries(last_date, args.window, DOMAINS[0], country):
+        scans, elapsed = explain(engines[database], statement)
+        seq_scans = [table for node, table, _ in scans if node == "Seq Scan"]
+        indexes = sorted({index for node, _, index in scans if node in INDEX_NODES})
+        ok = not seq_scans and bool(indexes)
+        print(f"{'OK  ' if ok else 'FAIL'} {endpoint:<35} {elapsed:>9.2f} ms  "
+              f"{', '.join(f'{node} ({index or table})' for node, table, index in scans)}")
+        if not ok:
+            failed.append(endpoint)
+
+    if failed:
+        print(f"Sequential scans in {len(failed)} endpoint queries: {', '.join(failed)}")
+        sys.exit(1)
+    print("All endpoint queries use indexes")
+
+if __name__ == "__main__":
+    main()
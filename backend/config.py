@@ -55,3 +55,42 @@ DOMAINS = [
 
 # --- HTTPS для API ---
 USE_HTTPS = False
+
+# --- Адрес Google Search Console API ---
+# None – стандартный адрес Google; для локальной проверки – адрес fake_gsc_server.py, например "http://127.0.0.1:8765/"
+GSC_API_ENDPOINT = None
+
+# --- Квоты Google Search Console API (асинхронный клиент) ---
+# Лимиты Search Analytics: 1200 запросов в минуту на сайт и 40000 в минуту на проект
+GSC_SITE_QPM = 1200
+GSC_PROJECT_QPM = 40000
+# Максимальное число одновременных запросов из одного event loop
+GSC_MAX_IN_FLIGHT = 200
+
+# --- Режим загрузки ---
+# Получать доменные данные из запроса по странам (сумма кликов/показов, CTR из сумм,
+# позиция, взвешенная по показам) вместо отдельного запроса с измерением ["date"] – вдвое меньше запросов к GSC
+DERIVE_DOMAIN_FROM_COUNTRY = False
+
+# --- Архив ответов GSC ---
+# Сохранять сырые ответы Search Analytics в сжатый архив (gsc_archive.py), из которого
+# таблицы можно пересобрать без запросов к API (replay_archive.py)
+GSC_ARCHIVE_ENABLED = False
+GSC_ARCHIVE_DIR = r"C:\Users\Андрей\Desktop\GSCSTATS\backend\gsc_archive"
+
+# --- Свежие данные ---
+# Раз в час загружать последние (еще неокончательные) дни с dataState=all и сверять их
+# с окончательными данными, когда те становятся доступны (fresh_ingest.py)
+FRESH_INGEST_ENABLED = False
+
+# --- Соединения с PostgreSQL (connections.py) ---
+# Сколько соединений приложение может держать на одном сервере БД всеми процессами вместе
+# (ниже max_connections сервера с запасом на psql, миграции и т.п.)
+DB_MAX_CONNECTIONS = 90
+# Воркеры uvicorn (переменная окружения WEB_CONCURRENCY имеет приоритет) и фоновые процессы
+# (cron_job, backfill), работающие одновременно с API – между ними делится DB_MAX_CONNECTIONS
+WEB_WORKERS = 1
+DB_BACKGROUND_PROCESSES = 2
+# Реплики только для чтения для GET-эндпоинтов API; None – читать с основной БД
+READ_REPLICA_URL = None
+COUNTRY_READ_REPLICA_URL = None
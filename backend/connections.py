@@ -0,0 +1,145 @@
+# connections.py
+"""
+Общий менеджер соединений с PostgreSQL.
+Движки кешируются по URL: если основная БД и БД стран – одна база (DATABASE_URL == COUNTRY_DATABASE_URL),
+database.py и country_database.py получают один движок и один пул, а не два.
+Размер пулов рассчитывается из бюджета DB_MAX_CONNECTIONS на сервер БД: бюджет делится поровну между
+пулами всех процессов – у каждого воркера API синхронный пул (запись, загрузка) и асинхронный (чтение,
+async_database.py), у фоновых процессов (cron_job, backfill) – синхронный.
+Потоки загрузки держат по несколько соединений сразу (сессия записи и соединение справочников dimensions.py),
+а забор единиц, проверка чужих аренд и heartbeat – свои: ingest_worker_limit() – сколько потоков помещается в синхронный пул процесса,
+job_ledger.py не запускает больше одновременно выполняемых единиц.
+GET-эндпоинты чтения подключаются по read_url – к реплике, если она настроена.
+pool_metrics() – занятые соединения, overflow и ожидание соединения по всем пулам процесса (/api/pool_stats).
+"""
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from config import (
+    DATABASE_URL, COUNTRY_DATABASE_URL, READ_REPLICA_URL, COUNTRY_READ_REPLICA_URL,
+    DB_MAX_CONNECTIONS, WEB_WORKERS, DB_BACKGROUND_PROCESSES
+)
+
+logger = logging.getLogger("gsc_stats")
+
+# Сколько ждать свободное соединение из пула, сек.
+POOL_TIMEOUT = 30
+# Доля overflow в пуле: соединения сверх pool_size открываются только под нагрузкой и закрываются после нее
+POOL_OVERFLOW_SHARE = 0.25
+# Соединений, которые одновременно держит один поток загрузки: сессия записи и соединение dimension_ids
+CONNECTIONS_PER_INGEST_WORKER = 2
+# Соединения процесса загрузки вне потоков: забор единиц, проверка чужих аренд, прогресс и heartbeat
+INGEST_RESERVED_CONNECTIONS = 4
+
+# {(вид, URL): движок}
+_engines = {}
+_engines_lock = threading.Lock()
+
+class _WaitTimingPool:
+    """
+    Примесь к пулу: время ожидания соединения при каждом checkout и число таймаутов
+    (счетчики без блокировки – для метрик достаточно приблизительных значений).
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.wait_timeouts = getattr(self, "wait_timeouts", 0) + 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_count = getattr(self, "wait_count", 0) + 1
+            self.wait_total = getattr(self, "wait_total", 0.0) + waited
+            self.wait_max = max(getattr(self, "wait_max", 0.0), waited)
+
+class TimedQueuePool(_WaitTimingPool, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_WaitTimingPool, AsyncAdaptedQueuePool):
+    pass
+
+def web_workers():
+    return int(os.environ.get("WEB_CONCURRENCY", WEB_WORKERS))
+
+def pool_limits():
+    """(pool_size, max_overflow) одного пула: доля бюджета DB_MAX_CONNECTIONS на пул."""
+    pools = 2 * web_workers() + DB_BACKGROUND_PROCESSES
+    per_pool = max(2, DB_MAX_CONNECTIONS // pools)
+    overflow = int(per_pool * POOL_OVERFLOW_SHARE)
+    return per_pool - overflow, overflow
+
+def ingest_worker_limit():
+    """Сколько потоков загрузки помещается в синхронный пул вместе с забором единиц и heartbeat (не меньше одного)."""
+    pool_size, max_overflow = pool_limits()
+    return max(1, (pool_size + max_overflow - INGEST_RESERVED_CONNECTIONS) // CONNECTIONS_PER_INGEST_WORKER)
+
+def _key(url: str):
+    return make_url(url).render_as_string(hide_password=False)
+
+def _create(kind: str, url: str):
+    pool_size, max_overflow = pool_limits()
+    logger.info(f"Creating {kind} engine for {make_url(url)!r}: pool_size={pool_size}, max_overflow={max_overflow}")
+    if kind == "async":
+        # Импорт здесь: синхронным процессам (cron_job, backfill) не нужны greenlet и asyncpg
+        from sqlalchemy.ext.asyncio import create_async_engine
+        async_url = make_url(url).set(drivername="postgresql+asyncpg")
+        return create_async_engine(async_url, poolclass=TimedAsyncQueuePool, pool_size=pool_size,
+                                   max_overflow=max_overflow, pool_timeout=POOL_TIMEOUT)
+    return create_engine(url, poolclass=TimedQueuePool, pool_size=pool_size,
+                         max_overflow=max_overflow, pool_timeout=POOL_TIMEOUT)
+
+def _get(kind: str, url: str):
+    key = (kind, _key(url))
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = _create(kind, url)
+        return _engines[key]
+
+def get_engine(url: str):
+    """Синхронный движок для url – один на процесс для одинаковых URL."""
+    return _get("sync", url)
+
+def get_async_engine(url: str):
+    """Асинхронный движок (asyncpg) для url – один на процесс для одинаковых URL."""
+    return _get("async", url)
+
+def read_url(url: str):
+    """URL для эндпоинтов чтения: реплика основной БД или БД стран, если настроена, иначе сам url."""
+    if _key(url) == _key(DATABASE_URL) and READ_REPLICA_URL:
+        return READ_REPLICA_URL
+    if _key(url) == _key(COUNTRY_DATABASE_URL):
+        return COUNTRY_READ_REPLICA_URL or url
+    return url
+
+def pool_metrics():
+    """Состояние пулов всех движков процесса: размер, занятые и свободные соединения, overflow, ожидание."""
+    with _engines_lock:
+        engines = list(_engines.items())
+    metrics = []
+    for (kind, _), engine in engines:
+        pool = engine.pool if kind == "sync" else engine.sync_engine.pool
+        wait_count = getattr(pool, "wait_count", 0)
+        metrics.append({
+            "engine": repr(engine.url),
+            "kind": kind,
+            "pool_size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "checkouts": wait_count,
+            "wait_avg_ms": round(getattr(pool, "wait_total", 0.0) / wait_count * 1000, 3) if wait_count else 0.0,
+            "wait_max_ms": round(getattr(pool, "wait_max", 0.0) * 1000, 3),
+            "wait_timeouts": getattr(pool, "wait_timeouts", 0),
+        })
+    return metrics
@@ -1,14 +1,10 @@
 # country_database.py
-from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import COUNTRY_DATABASE_URL
+from connections import get_engine
 
-engine = create_engine(
-    COUNTRY_DATABASE_URL,
-    pool_size=10,
-    max_overflow=5,
-    pool_timeout=30
-)
+# Движок и пул общие с database.py, если БД стран – та же база (connections.py)
+engine = get_engine(COUNTRY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -1,14 +1,73 @@
 # country_models.py
-from sqlalchemy import Column, Integer, String, Date, Float
+from sqlalchemy import (
+    Column, Integer, SmallInteger, String, Date, DateTime, Float, Boolean, Index, UniqueConstraint, ForeignKey, select, text
+)
+from sqlalchemy.orm import column_property
 from country_database import Base
 
+# Справочники доменов и стран (dimensions.py). БД стран может быть отдельной, поэтому у нее свой справочник доменов;
+# если БД общая, обе модели описывают одну и ту же таблицу domains
+class CountryDomain(Base):
+  __tablename__ = "domains"
+  id = Column(SmallInteger, primary_key=True)
+  name = Column(String, unique=True, nullable=False)
+
+class Country(Base):
+  __tablename__ = "countries"
+  id = Column(SmallInteger, primary_key=True)
+  name = Column(String, unique=True, nullable=False)   # код страны GSC (usa, deu, ...)
+
 class CountrySummary(Base):
   __tablename__ = "country_summaries"
-  id = Column(Integer, primary_key=True, index=True)
-  domain = Column(String, index=True)
-  date = Column(Date, index=True)
-  country = Column(String, index=True)
+  # Одна строка на домен, страну и дату – первичный ключ, он же ключ для upsert в db_writer; индексы под запросы main.py – migrations.py.
+  # Таблица секционирована по месяцам (partitions.py): ключи включают date
+  __table_args__ = (
+      Index("ix_country_summaries_date_domain_country", "date", "domain_id", "country_id", postgresql_include=[
+          "traffic_clicks", "impressions", "ctr", "avg_position", "is_final"
+      ]),
+      Index("ix_country_summaries_country_date", "country_id", "date", postgresql_include=[
+          "domain_id", "traffic_clicks", "impressions", "ctr", "avg_position", "is_final"
+      ]),
+      # Неокончательные строки (fresh_ingest.py) – небольшой набор последних дней для сверки
+      Index("ix_country_summaries_provisional", "date", "domain_id", postgresql_where=text("NOT is_final")),
+      {"postgresql_partition_by": "RANGE (date)"},
+  )
+  domain_id = Column(SmallInteger, ForeignKey("domains.id"), primary_key=True)
+  country_id = Column(SmallInteger, ForeignKey("countries.id"), primary_key=True)
+  date = Column(Date, primary_key=True)
   traffic_clicks = Column(Integer)
   impressions = Column(Integer)
   ctr = Column(Float)
   avg_position = Column(Float)
+  is_final = Column(Boolean, nullable=False, default=True, server_default=text("true"))  # False – данные dataState=all
+  # Имена для чтения и JSON-ответов API; фильтровать – через domain_id / country_id (dimensions.py)
+  domain = column_property(select(CountryDomain.name).where(CountryDomain.id == domain_id).scalar_subquery())
+  country = column_property(select(Country.name).where(Country.id == country_id).scalar_subquery())
+
+class CountryRollup(Base):
+  """Сводка домена по стране за неделю или месяц (rollups.py) – поддерживается вместе с country_summaries."""
+  __tablename__ = "country_rollups"
+  __table_args__ = (
+      UniqueConstraint("domain", "granularity", "period_start", "country", name="uq_country_rollups"),
+      Index("ix_country_rollups_period", "granularity", "period_start"),
+  )
+  id = Column(Integer, primary_key=True)
+  domain = Column(String)
+  country = Column(String)
+  granularity = Column(String)          # week / month
+  period_start = Column(Date)
+  period_end = Column(Date)
+  days = Column(Integer)
+  traffic_clicks = Column(Integer)
+  impressions = Column(Integer)
+  position_sum = Column(Float)          # сумма avg_position * impressions
+  is_final = Column(Boolean)
+
+class CountryIngestWatermark(Base):
+  """Последние даты доменов в country_summaries (watermarks.py); при общей БД – та же таблица, что models.IngestWatermark."""
+  __tablename__ = "ingest_watermarks"
+  dataset = Column(String, primary_key=True)   # country
+  domain = Column(String, primary_key=True)
+  last_date = Column(Date)
+  second_last_date = Column(Date)
+  updated_at = Column(DateTime)
@@ -3,155 +3,125 @@
 Планировщик, который запускается дважды в день (в 00:00 и 12:00) и обновляет недостающие данные:
 1. Для доменных данных – обновляет данные по каждому домену в основной БД.
 2. Для данных по странам – обновляет данные по каждому домену в базе данных стран.
+Оба задания выполняются одним планировщиком с приоритетами (update_missing_data).
+При FRESH_INGEST_ENABLED раз в час загружаются и сверяются свежие неокончательные данные (update_fresh_data).
+При DERIVE_DOMAIN_FROM_COUNTRY оба набора заполняются одним запросом по странам (update_missing_data_derived).
 """
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import date, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time, logging
 from database import SessionLocal, engine, Base
 from models import DomainSummary
-from gsc_client import fetch_gsc_data_for_domain
-from config import DOMAINS
+from gsc_client import get_retry_stats
+from gap_planner import HISTORY_START, find_missing_dates, plan_units, plan_missing_units, unit_classifier, domain_weights
+from config import DERIVE_DOMAIN_FROM_COUNTRY, FRESH_INGEST_ENABLED
 
-from country_database import SessionLocal as CountrySessionLocal, engine as CountryEngine, Base as CountryBase
+from country_database import SessionLocal as CountrySessionLocal
 from country_models import CountrySummary
-from gsc_client import fetch_country_data_for_domain
 
-from tqdm import tqdm
+from ingest import run_dataset_job, run_dataset_jobs
+from job_ledger import queue_depth
+from migrations import run_migrations
+from partitions import ensure_partitions
+from country_database import engine as country_engine
+from fresh_ingest import ingest_fresh_data, reconcile_provisional_data
 
 MAX_WORKERS = 20
+# Вместо пула потоков загружать данные асинхронным клиентом из одного event loop (с квотами GSC)
+USE_ASYNC_CLIENT = False
 
 def daterange(start_date: date, end_date: date):
   for n in range((end_date - start_date).days + 1):
       yield start_date + timedelta(n)
 
-# --- Обновление доменных данных ---
-def update_missing_domain_data():
-  today = date.today()
-  # Данные доступны с задержкой 2 дня
-  available_date = today - timedelta(days=2)
-  db = SessionLocal()
-  domains_to_update = {}
-  for domain in DOMAINS:
-      last_entry = db.query(DomainSummary).filter(DomainSummary.domain == domain).order_by(DomainSummary.date.desc()).first()
-      if last_entry:
-          last_date = last_entry.date
-      else:
-          last_date = date(2024, 1, 1) - timedelta(days=1)
-      if last_date < available_date:
-          start_date = last_date + timedelta(days=1)
-          domains_to_update[domain] = (start_date, available_date)
-      else:
-          logging.info(f"{domain}: данные обновлены до {last_date}")
-  db.close()
-  
-  total_tasks = sum(1 for _ in (d for d in daterange(*next(iter(domains_to_update.values()), (available_date, available_date))))) * len(domains_to_update) if domains_to_update else 0
-  if total_tasks == 0:
-      logging.info("Доменные данные актуальны.")
-      return
-  
-  tasks = {}
+def log_job_result(dataset: str, result: dict, elapsed: float):
+  logging.info(f"Обновление ({dataset}) завершено за {elapsed:.2f} сек.: "
+               f"{result['done']} задач выполнено, {result['failed']} с ошибкой, {result['rows']} строк")
+
+def run_cron_job(dataset: str, units, available_date: date, domain_dates: dict = None, classify=None):
+  """
+  Выполняет единицы работы через журнал заданий. Задание одно на набор данных и дату данных:
+  повторный запуск за ту же дату (например, в 12:00 после сбоя в 00:00) продолжает его.
+  """
   start_time = time.time()
-  with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-      for domain, (start_date, end_date) in domains_to_update.items():
-          for single_date in daterange(start_date, end_date):
-              future = executor.submit(process_domain_update, domain, single_date)
-              tasks[future] = (domain, single_date)
-      for future in tqdm(as_completed(tasks), total=len(tasks), desc="Обновление доменных данных", unit="task"):
-          try:
-              future.result()
-          except Exception as e:
-              domain, single_date = tasks[future]
-              logging.error(f"Ошибка обновления {domain} on {single_date}: {e}")
-  elapsed = time.time() - start_time
-  logging.info(f"Обновление доменных данных завершено за {elapsed:.2f} сек.")
+  result = run_dataset_job(
+      f"cron-{dataset}-{available_date.isoformat()}", dataset, units,
+      use_async=USE_ASYNC_CLIENT, domain_dates=domain_dates, workers=MAX_WORKERS, classify=classify
+  )
+  log_job_result(dataset, result, time.time() - start_time)
+  logging.info(f"Очередь загрузки: {queue_depth()}")
+  logging.info(f"Статистика запросов GSC: {get_retry_stats()}")
 
-def process_domain_update(domain: str, single_date: date):
-  data = fetch_gsc_data_for_domain(domain, single_date)
-  db = SessionLocal()
-  try:
-      summary = DomainSummary(
-          domain=domain,
-          date=single_date,
-          traffic_clicks=data.get("traffic_clicks", 0),
-          impressions=data.get("impressions", 0),
-          ctr=data.get("ctr", 0.0),
-          avg_position=data.get("avg_position", 0.0),
-          pages_indexed=data.get("pages_indexed", 0),
-          pages_not_indexed=data.get("pages_not_indexed", 0)
-      )
-      db.add(summary)
-      db.commit()
-  except Exception as e:
-      db.rollback()
-      raise e
-  finally:
-      db.close()
-  return
+def plan_cron_job(dataset: str, session_factory, model, available_date: date, weights: dict):
+  """
+  Задание для run_dataset_jobs: все пропущенные (домен, дата) таблицы model за период хранения,
+  сгруппированные в непрерывные диапазоны (один запрос к GSC на диапазон), с классами приоритета.
+  """
+  units = plan_missing_units(session_factory, model, available_date)
+  classify = unit_classifier(session_factory, model, available_date, weights)
+  return (f"cron-{dataset}-{available_date.isoformat()}", dataset, units, None, classify)
 
-# --- Обновление данных по странам ---
-def update_missing_country_data():
-  today = date.today()
-  available_date = today - timedelta(days=2)
-  db = CountrySessionLocal()
-  domains_to_update = {}
-  for domain in DOMAINS:
-      last_entry = db.query(CountrySummary).filter(CountrySummary.domain == domain).order_by(CountrySummary.date.desc()).first()
-      if last_entry:
-          last_date = last_entry.date
-      else:
-          last_date = date(2024, 1, 1) - timedelta(days=1)
-      if last_date < available_date:
-          start_date = last_date + timedelta(days=1)
-          domains_to_update[domain] = (start_date, available_date)
-      else:
-          logging.info(f"{domain} (страны): данные обновлены до {last_date}")
-  db.close()
-  
-  total_tasks = sum(1 for _ in (d for d in daterange(*next(iter(domains_to_update.values()), (available_date, available_date))))) * len(domains_to_update) if domains_to_update else 0
-  if total_tasks == 0:
-      logging.info("Данные по странам актуальны.")
+# --- Обновление доменных данных и данных по странам ---
+def update_missing_data():
+  """
+  Обновляет доменные данные и данные по странам одним планировщиком: единицы обоих заданий разбираются
+  общим пулом из MAX_WORKERS потоков – сначала свежие дни, затем пропуски, затем глубокая история,
+  внутри класса – домены с большим трафиком.
+  """
+  # Данные доступны с задержкой 2 дня
+  available_date = date.today() - timedelta(days=2)
+  weights = domain_weights(SessionLocal, available_date)
+  jobs = [
+      plan_cron_job("domain", SessionLocal, DomainSummary, available_date, weights),
+      plan_cron_job("country", CountrySessionLocal, CountrySummary, available_date, weights)
+  ]
+  jobs = [job for job in jobs if job[2]]
+  if not jobs:
+      logging.info("Доменные данные и данные по странам актуальны.")
       return
-  
-  tasks = {}
   start_time = time.time()
-  with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-      for domain, (start_date, end_date) in domains_to_update.items():
-          for single_date in daterange(start_date, end_date):
-              future = executor.submit(process_country_update, domain, single_date)
-              tasks[future] = (domain, single_date)
-      for future in tqdm(as_completed(tasks), total=len(tasks), desc="Обновление данных по странам", unit="task"):
-          try:
-              future.result()
-          except Exception as e:
-              domain, single_date = tasks[future]
-              logging.error(f"Ошибка обновления по странам {domain} on {single_date}: {e}")
-  elapsed = time.time() - start_time
-  logging.info(f"Обновление данных по странам завершено за {elapsed:.2f} сек.")
+  results = run_dataset_jobs(jobs, use_async=USE_ASYNC_CLIENT, workers=MAX_WORKERS)
+  for job_id, dataset, _, _, _ in jobs:
+      log_job_result(dataset, results[job_id], time.time() - start_time)
+  logging.info(f"Очередь загрузки: {queue_depth()}")
+  logging.info(f"Статистика запросов GSC: {get_retry_stats()}")
+
+# --- Доменные данные, вычисленные из данных по странам ---
+def update_missing_data_derived():
+  """
+  Обновляет данные по странам и доменные данные одним запросом по странам на окно дат:
+  сводка домена вычисляется из строк по странам (derive_domain_data_by_date), поэтому
+  отдельный запрос с измерением ["date"] не нужен.
+  """
+  available_date = date.today() - timedelta(days=2)
+  missing_domain_dates = find_missing_dates(SessionLocal, DomainSummary, HISTORY_START, available_date)
+  missing_country_dates = find_missing_dates(CountrySessionLocal, CountrySummary, HISTORY_START, available_date)
+  # Один запрос по странам закрывает пропуски обеих таблиц
+  missing = {
+      domain: sorted(set(missing_domain_dates.get(domain, [])) | set(missing_country_dates.get(domain, [])))
+      for domain in set(missing_domain_dates) | set(missing_country_dates)
+  }
+  units = plan_units(missing)
+  if not units:
+      logging.info("Доменные данные и данные по странам актуальны.")
+      return
+  # Данные по странам записываются upsert целиком; доменные – только за отсутствующие даты
+  domain_dates = {domain: set(dates) for domain, dates in missing_domain_dates.items()}
+  classify = unit_classifier(CountrySessionLocal, CountrySummary, available_date, domain_weights(SessionLocal, available_date))
+  run_cron_job("derived", units, available_date, domain_dates, classify)
 
-def process_country_update(domain: str, single_date: date):
-  records = fetch_country_data_for_domain(domain, single_date)
-  db = CountrySessionLocal()
-  try:
-      for record in records:
-          summary = CountrySummary(
-              domain=record["domain"],
-              date=record["date"],
-              country=record["country"],
-              traffic_clicks=record["traffic_clicks"],
-              impressions=record["impressions"],
-              ctr=record["ctr"],
-              avg_position=record["avg_position"]
-          )
-          db.add(summary)
-      db.commit()
-  except Exception as e:
-      db.rollback()
-      raise e
-  finally:
-      db.close()
-  return
+def update_fresh_data():
+  """
+  Сначала заменяет неокончательные строки, для которых уже есть окончательные данные,
+  затем загружает свежие дни с dataState=all (fresh_ingest.py).
+  """
+  start = time.time()
+  for job_id, result in reconcile_provisional_data().items():
+      log_job_result(job_id, result, time.time() - start)
+  start = time.time()
+  for job_id, result in ingest_fresh_data().items():
+      log_job_result(job_id, result, time.time() - start)
 
 def start_scheduler():
   """
@@ -160,15 +130,25 @@ def start_scheduler():
   """
   import pytz
   
+  # Таблицы основной БД (включая журнал заданий ingest_units), затем миграции схемы обеих БД
+  Base.metadata.create_all(bind=engine)
+  run_migrations()
+
   scheduler = BackgroundScheduler(timezone=pytz.UTC)
   # Планируем обновление в 00:00 и 12:00 по серверному времени
-  scheduler.add_job(update_missing_domain_data, 'cron', hour='0,12', minute=0)
-  scheduler.add_job(update_missing_country_data, 'cron', hour='0,12', minute=0)
+  if DERIVE_DOMAIN_FROM_COUNTRY:
+      scheduler.add_job(update_missing_data_derived, 'cron', hour='0,12', minute=0)
+  else:
+      scheduler.add_job(update_missing_data, 'cron', hour='0,12', minute=0)
+  # Секции country_summaries на месяцы вперед (partitions.py)
+  scheduler.add_job(ensure_partitions, 'cron', hour=0, minute=5, args=[country_engine])
+  if FRESH_INGEST_ENABLED:
+      # Свежие данные – каждый час, в стороне от обновлений в 00:00 и 12:00
+      scheduler.add_job(update_fresh_data, 'cron', minute=30)
   scheduler.start()
 
 if __name__ == "__main__":
   start_scheduler()
   # Чтобы планировщик работал, удерживаем основной поток
-  import time
   while True:
       time.sleep(60)
@@ -1,14 +1,10 @@
 # database.py
-from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import DATABASE_URL
+from connections import get_engine
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=50,
-    max_overflow=20,
-    pool_timeout=30
-)
+# Движок и пул общие с country_database.py, если БД стран – та же база (connections.py)
+engine = get_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
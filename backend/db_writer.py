@@ -0,0 +1,151 @@
+# db_writer.py
+"""
+Общая запись данных GSC в БД: пачки строк сохраняются одним многострочным
+INSERT ... ON CONFLICT (domain_id, [country_id,] date | domain, date, error_type) DO UPDATE на пачку,
+поэтому повторная загрузка тех же дат обновляет строки, а не создает дубликаты.
+Строки строятся с именами доменов и стран; перед записью в сводки имена заменяются ключами справочников (dimensions.py).
+Строки с is_final=False (свежие данные dataState=all, fresh_ingest.py) никогда не перезаписывают окончательные.
+В той же транзакции пересчитываются недельные и месячные сводки затронутых дат (rollups.py)
+и сдвигаются последние даты доменов (watermarks.py).
+Используется в main.py, cron_job.py, backfill.py и backfill_country.py.
+"""
+
+import logging
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal
+from models import DomainSummary, DomainError
+from country_database import SessionLocal as CountrySessionLocal
+from country_models import CountrySummary
+from rollups import refresh_rollups, date_ranges
+from dimensions import encode_rows
+from watermarks import advance_watermarks
+
+logger = logging.getLogger("gsc_stats")
+
+# Число строк в одном INSERT (ограничение PostgreSQL – 65535 параметров на запрос)
+UPSERT_BATCH_SIZE = 1000
+
+# Уникальные ключи таблиц (для ON CONFLICT; у сводок – первичный ключ из моделей)
+DOMAIN_SUMMARY_KEY = ("domain_id", "date")
+DOMAIN_ERROR_KEY = ("domain", "date", "error_type")
+COUNTRY_SUMMARY_KEY = ("domain_id", "country_id", "date")
+
+def upsert_rows(db, model, rows: list, key_columns: tuple):
+    """
+    Сохраняет строки (словари колонок) в таблицу model пачками по UPSERT_BATCH_SIZE.
+    Строки с одинаковым ключом внутри вызова схлопываются (побеждает последняя):
+    PostgreSQL не позволяет одному INSERT ... ON CONFLICT обновить строку дважды.
+    Для таблиц с is_final неокончательная строка не заменяет окончательную.
+    Транзакцией управляет вызывающий код. Возвращает число записанных строк.
+    """
+    table = model.__table__
+    unique_rows = list({tuple(row[column] for column in key_columns): row for row in rows}.values())
+    for chunk_start in range(0, len(unique_rows), UPSERT_BATCH_SIZE):
+        chunk = unique_rows[chunk_start:chunk_start + UPSERT_BATCH_SIZE]
+        stmt = insert(table).values(chunk)
+        update_columns = {column: stmt.excluded[column] for column in chunk[0] if column not in key_columns}
+        where = None
+        if "is_final" in table.c:
+            where = table.c.is_final.is_(False) | stmt.excluded.is_final.is_(True)
+        db.execute(stmt.on_conflict_do_update(index_elements=list(key_columns), set_=update_columns, where=where))
+    return len(unique_rows)
+
+def domain_summary_rows(domain: str, data_by_date: dict, is_final: bool = True):
+    """
+    {дата: данные домена} (формат fetch_gsc_data_for_range) -> (строки domain_summaries, строки domain_errors).
+    """
+    summaries = []
+    errors = []
+    for single_date, data in sorted(data_by_date.items()):
+        summaries.append({
+            "domain": domain,
+            "date": single_date,
+            "traffic_clicks": data.get("traffic_clicks", 0),
+            "impressions": data.get("impressions", 0),
+            "ctr": data.get("ctr", 0.0),
+            "avg_position": data.get("avg_position", 0.0),
+            "pages_indexed": data.get("pages_indexed", 0),
+            "pages_not_indexed": data.get("pages_not_indexed", 0),
+            "is_final": is_final
+        })
+        for error_type, count in data.get("errors", {}).items():
+            errors.append({"domain": domain, "date": single_date, "error_type": error_type, "count": count})
+    return summaries, errors
+
+def country_summary_rows(records: list, is_final: bool = True):
+    """
+    Записи по странам (формат fetch_country_data_for_range) -> строки country_summaries.
+    """
+    return [{
+        "domain": record["domain"],
+        "date": record["date"],
+        "country": record["country"],
+        "traffic_clicks": record["traffic_clicks"],
+        "impressions": record["impressions"],
+        "ctr": record["ctr"],
+        "avg_position": record["avg_position"],
+        "is_final": is_final
+    } for record in records]
+
+def save_domain_data(domain: str, data_by_date: dict, is_final: bool = True):
+    """
+    Сохраняет данные домена по датам (и ошибки индексации) в одной транзакции.
+    is_final=False – неокончательные данные (dataState=all). Возвращает число сохраненных дней.
+    """
+    summaries, errors = domain_summary_rows(domain, data_by_date, is_final)
+    if not summaries:
+        return 0
+    db = SessionLocal()
+    try:
+        upsert_rows(db, DomainSummary, encode_rows(db.get_bind(), DomainSummary.__tablename__, summaries), DOMAIN_SUMMARY_KEY)
+        if errors:
+            upsert_rows(db, DomainError, errors, DOMAIN_ERROR_KEY)
+        refresh_rollups(db.connection().exec_driver_sql, DomainSummary.__tablename__, date_ranges(summaries))
+        advance_watermarks(db.connection().exec_driver_sql, DomainSummary.__tablename__, {domain: [row["date"] for row in summaries]})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+    return len(summaries)
+
+def save_country_batches(batches, is_final: bool = True):
+    """
+    Сохраняет пачки записей по странам (например, страницы iter_country_data_for_range) в одной транзакции:
+    один многострочный upsert на пачку, поэтому память не растет с размером окна.
+    Возвращает число сохраненных строк.
+    """
+    total_records = 0
+    # Диапазоны дат по доменам для пересчета сводок – без хранения самих записей
+    bounds = {}
+    written = {}
+    db = CountrySessionLocal()
+    try:
+        for records in batches:
+            if records:
+                rows = encode_rows(db.get_bind(), CountrySummary.__tablename__, country_summary_rows(records, is_final))
+                total_records += upsert_rows(db, CountrySummary, rows, COUNTRY_SUMMARY_KEY)
+                for domain, start_date, end_date in date_ranges(records):
+                    previous = bounds.get(domain, (start_date, end_date))
+                    bounds[domain] = (min(previous[0], start_date), max(previous[1], end_date))
+                for record in records:
+                    written.setdefault(record["domain"], set()).add(record["date"])
+        ranges = [(domain, start_date, end_date) for domain, (start_date, end_date) in bounds.items()]
+        refresh_rollups(db.connection().exec_driver_sql, CountrySummary.__tablename__, ranges)
+        advance_watermarks(db.connection().exec_driver_sql, CountrySummary.__tablename__, written)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+    return total_records
+
+def save_country_data(records_by_date: dict, is_final: bool = True):
+    """
+    Сохраняет записи по странам в формате {дата: список записей}. Возвращает число сохраненных строк.
+    """
+    return save_country_batches((records_by_date[single_date] for single_date in sorted(records_by_date)), is_final)
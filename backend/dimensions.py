@@ -0,0 +1,96 @@
+# dimensions.py
+"""
+Справочники доменов и стран (domains, countries) для дневных сводок: domain_summaries и country_summaries
+хранят короткие ключи domain_id и country_id (smallint) вместо повторяющихся строк – строки таблиц
+и их индексы заметно меньше. API и внутренние функции по-прежнему работают с именами:
+encode_rows переводит имена в ключи перед записью (справочник пополняется автоматически),
+модели отдают имена через column_property, а фильтры строятся через domain_filter и country_filter.
+Ключи справочника кешируются в процессе: новое имя добавляется в таблицу один раз.
+
+Запуск: python dimensions.py – размеры таблиц сводок и их индексов.
+"""
+
+import threading
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from models import Domain, DomainSummary
+from country_models import CountryDomain, Country, CountrySummary
+
+# Колонки дневных сводок, хранящиеся ключами справочников: {таблица: {колонка с именем: (колонка ключа, справочник)}}
+DIMENSIONS = {
+    DomainSummary.__tablename__: {"domain": ("domain_id", Domain)},
+    CountrySummary.__tablename__: {"domain": ("domain_id", CountryDomain), "country": ("country_id", Country)},
+}
+
+# {(engine, справочник): {имя: ключ}}
+_ids = {}
+_ids_lock = threading.Lock()
+
+def dimension_ids(engine, dimension, names):
+    """{имя: ключ} справочника dimension для names; отсутствующие имена добавляются в отдельной транзакции."""
+    with _ids_lock:
+        known = _ids.setdefault((engine, dimension.__tablename__), {})
+        missing = sorted({name for name in names if name not in known})
+    if missing:
+        with engine.begin() as conn:
+            rows = conn.execute(select(dimension.name, dimension.id).where(dimension.name.in_(missing))).all()
+            new = sorted(set(missing) - {name for name, _ in rows})
+            if new:
+                # ON CONFLICT – на случай параллельной вставки того же имени другим процессом
+                conn.execute(insert(dimension).values([{"name": name} for name in new]).on_conflict_do_nothing(index_elements=["name"]))
+                rows += conn.execute(select(dimension.name, dimension.id).where(dimension.name.in_(new))).all()
+        with _ids_lock:
+            known.update(dict(rows))
+    return {name: known[name] for name in names}
+
+def encode_rows(engine, table: str, rows: list):
+    """Строки (словари) с именами domain / country -> строки таблицы table с domain_id / country_id."""
+    columns = DIMENSIONS.get(table)
+    if not columns or not rows:
+        return rows
+    encoded = [dict(row) for row in rows]
+    for name_column, (key_column, dimension) in columns.items():
+        ids = dimension_ids(engine, dimension, {row[name_column] for row in encoded})
+        for row in encoded:
+            row[key_column] = ids[row.pop(name_column)]
+    return encoded
+
+def _key(model, name_column: str, name: str):
+    key_column, dimension = DIMENSIONS[model.__tablename__][name_column]
+    return getattr(model, key_column) == select(dimension.id).where(dimension.name == name).scalar_subquery()
+
+def domain_filter(model, domain: str):
+    """Условие "строка домена domain" для модели model: по domain_id у сводок, по строке у остальных таблиц."""
+    if model.__tablename__ in DIMENSIONS:
+        return _key(model, "domain", domain)
+    return model.domain == domain
+
+def country_filter(model, country: str):
+    return _key(model, "country", country)
+
+def table_sizes(conn, table: str):
+    """
+    Размеры таблицы в байтах: {"table": данные, "indexes": индексы, "total": вместе с TOAST}.
+    Для секционированной таблицы – сумма по всем секциям.
+    """
+    row = conn.execute(text("""
+        SELECT coalesce(sum(pg_relation_size(relid)), 0), coalesce(sum(pg_indexes_size(relid)), 0),
+               coalesce(sum(pg_total_relation_size(relid)), 0)
+        FROM pg_partition_tree(CAST(:table AS regclass))
+    """), {"table": table}).first()
+    return {"table": int(row[0]), "indexes": int(row[1]), "total": int(row[2])}
+
+def format_sizes(sizes: dict):
+    return ", ".join(f"{kind} {size / 1024 / 1024:.1f} MB" for kind, size in sizes.items())
+
+def main():
+    from database import engine
+    from country_database import engine as country_engine
+    for table_engine, table in ((engine, DomainSummary.__tablename__), (country_engine, CountrySummary.__tablename__)):
+        with table_engine.connect() as conn:
+            print(f"{table}: {format_sizes(table_sizes(conn, table))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# fake_gsc_server.py
+"""
+Локальная замена Search Analytics API для проверки загрузки данных без учетных данных Google.
+Для сайтов из DOMAINS генерирует детерминированные синтетические строки (одинаковые при каждом запуске
+для одного seed), поддерживает startRow/rowLimit, пакетные запросы (/batch) и может добавлять
+задержку ответа и ошибки квот (429 rateLimitExceeded).
+Строки с измерением ["date"] – точные суммы строк ["date", "country"] (CTR из сумм, позиция взвешена по показам).
+
+Запуск: python fake_gsc_server.py [--port 8765] [--latency 0.05] [--quota-error-rate 0.01]
+и затем GSC_API_ENDPOINT = "http://127.0.0.1:8765/" в config.py.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from config import DOMAINS
+
+# Максимум строк в одном ответе, как у настоящего API
+MAX_ROW_LIMIT = 25000
+DEFAULT_ROW_LIMIT = 1000
+
+COUNTRIES = [
+    "usa", "gbr", "deu", "fra", "esp", "ita", "nld", "bel", "pol", "ukr", "rou", "bgr", "grc", "prt", "swe",
+    "nor", "dnk", "fin", "est", "lva", "ltu", "cze", "svk", "hun", "aut", "che", "svn", "hrv", "srb", "bih",
+    "mne", "mkd", "alb", "mda", "tur", "cyp", "mlt", "irl", "isl", "lux", "can", "mex", "bra", "arg", "chl",
+    "aus", "nzl", "jpn", "kor", "ind", "idn", "mys", "sgp", "tha", "vnm", "phl", "are", "isr", "zaf", "egy"
+]
+
+_QUERY_PATH = re.compile(r"/sites/([^/]+)/searchAnalytics/query")
+
+def _seed(*parts):
+    return zlib.crc32("|".join(str(part) for part in parts).encode("utf-8"))
+
+class SyntheticData:
+    """
+    Детерминированные данные "Эффективности": строки (дата, страна) для каждого сайта из DOMAINS.
+    Данные есть только до today - 2 дней (как задержка данных в GSC).
+    """
+
+    def __init__(self, seed: int = 0, domains=DOMAINS):
+        self.seed = seed
+        self.sites = {f"https://{domain}/" for domain in domains}
+
+    def country_rows(self, site_url: str, single_date: date):
+        if single_date > date.today() - timedelta(days=2):
+            return []
+        rng = random.Random(_seed(self.seed, site_url, single_date.isoformat()))
+        scale = random.Random(_seed(self.seed, site_url)).uniform(0.2, 5.0)
+        rows = []
+        for country in rng.sample(COUNTRIES, rng.randint(10, len(COUNTRIES))):
+            impressions = int(rng.paretovariate(1.5) * 50 * scale)
+            clicks = int(impressions * rng.uniform(0.0, 0.12))
+            rows.append({
+                "keys": [single_date.isoformat(), country],
+                "clicks": clicks,
+                "impressions": impressions,
+                "ctr": clicks / impressions if impressions else 0.0,
+                "position": rng.uniform(1.0, 60.0)
+            })
+        return rows
+
+    def query(self, site_url: str, body: dict):
+        """
+        Строки ответа для тела запроса searchanalytics.query (измерения date и/или country).
+        """
+        start_date = date.fromisoformat(body["startDate"])
+        end_date = date.fromisoformat(body["endDate"])
+        dimensions = body.get("dimensions", [])
+        groups = {}
+        current = start_date
+        while current <= end_date:
+            for row in self.country_rows(site_url, current):
+                key = tuple(row["keys"][["date", "country"].index(dimension)] for dimension in dimensions)
+                group = groups.setdefault(key, [0, 0, 0.0])
+                group[0] += row["clicks"]
+                group[1] += row["impressions"]
+                group[2] += row["position"] * row["impressions"]
+            current += timedelta(days=1)
+
+        rows = []
+        for key, (clicks, impressions, weighted_position) in groups.items():
+            if not impressions:
+                continue
+            rows.append({
+                "keys": list(key),
+                "clicks": clicks,
+                "impressions": impressions,
+                "ctr": clicks / impressions,
+                "position": weighted_position / impressions
+            })
+        # Как и API: по дате, затем по убыванию кликов
+        rows.sort(key=lambda row: (row["keys"][0] if "date" in dimensions else "", -row["clicks"]))
+        return rows
+
+class FakeGSCServer:
+    """
+    HTTP-сервер, отвечающий как Search Analytics API. Используется как context manager:
+
+        with FakeGSCServer(latency=0.05) as server:
+            gsc_client.API_ENDPOINT = server.url
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 quota_error_rate: float = 0.0, seed: int = 0):
+        self.data = SyntheticData(seed)
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"http_requests": 0, "api_calls": 0, "batch_requests": 0, "quota_errors": 0, "rows": 0}
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats[name] += value
+
+    def answer(self, path: str, body: dict):
+        """
+        Ответ на один запрос searchanalytics.query: (HTTP-код, тело ответа).
+        """
+        self._count("api_calls")
+        match = _QUERY_PATH.search(path)
+        if not match:
+            return 404, {"error": {"code": 404, "message": f"Unknown path {path}", "errors": [{"reason": "notFound"}]}}
+        site_url = unquote(match.group(1))
+        if site_url not in self.data.sites:
+            return 403, {"error": {"code": 403, "message": f"User does not have sufficient permission for site '{site_url}'.",
+                                   "errors": [{"reason": "forbidden"}]}}
+        with self._lock:
+            quota_error = self._rng.random() < self.quota_error_rate
+        if quota_error:
+            self._count("quota_errors")
+            return 429, {"error": {"code": 429, "message": "Quota exceeded", "errors": [{"reason": "rateLimitExceeded"}]}}
+
+        rows = self.data.query(site_url, body)
+        row_limit = min(int(body.get("rowLimit", DEFAULT_ROW_LIMIT)), MAX_ROW_LIMIT)
+        start_row = int(body.get("startRow", 0))
+        page = rows[start_row:start_row + row_limit]
+        self._count("rows", len(page))
+        response = {"responseAggregationType": "byProperty"}
+        if page:
+            response["rows"] = page
+        return 200, response
+
+    def _answer_batch(self, content_type: str, raw: bytes):
+        message = BytesParser(policy=policy.HTTP).parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + raw)
+        parts = []
+        for part in message.iter_parts():
+            content_id = part["Content-ID"].strip("<>")
+            payload = part.get_payload(decode=True).decode("utf-8")
+            separator = "\r\n\r\n" if "\r\n\r\n" in payload else "\n\n"
+            head, _, body = payload.partition(separator)
+            code, response = self.answer(head.split()[1], json.loads(body or "{}"))
+            text = json.dumps(response)
+            parts.append(
+                f"--batch_fake\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {code} {'OK' if code == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(text.encode('utf-8'))}\r\n\r\n{text}\r\n"
+            )
+        return ("".join(parts) + "--batch_fake--\r\n").encode("utf-8")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server._count("http_requests")
+                if server.latency:
+                    time.sleep(server.latency)
+                if self.path.rstrip("/").endswith("/batch"):
+                    server._count("batch_requests")
+                    out = server._answer_batch(self.headers["Content-Type"], raw)
+                    code, content_type = 200, "multipart/mixed; boundary=batch_fake"
+                else:
+                    code, response = server.answer(self.path, json.loads(raw or b"{}"))
+                    out = json.dumps(response).encode("utf-8")
+                    content_type = "application/json"
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Search Analytics API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, сек.")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="доля запросов с ответом 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeGSCServer(args.host, args.port, args.latency, args.quota_error_rate, args.seed)
+    print(f"Fake GSC API: {server.url} (Ctrl+C для остановки)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+        print(f"Статистика: {server.stats}")
+
+if __name__ == "__main__":
+    main()
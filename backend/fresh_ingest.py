@@ -0,0 +1,148 @@
+# fresh_ingest.py
+"""
+Загрузка свежих (неокончательных) данных GSC и их последующая сверка.
+Основная загрузка берет дни с задержкой 2 дня (окончательные данные). ingest_fresh_data раз в час
+запрашивает последние дни с dataState=all и пишет строки с is_final=False, поэтому дашборды отстают
+на часы, а не на двое суток. reconcile_provisional_data перезапрашивает окончательные данные только
+для неокончательных строк, которые уже вышли за окно задержки (частичный индекс по NOT is_final),
+перезаписывает их и удаляет оставшиеся неокончательные строки этих дней – историю не сканирует.
+"""
+
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from config import DOMAINS, DERIVE_DOMAIN_FROM_COUNTRY
+from database import SessionLocal
+from models import DomainSummary
+from country_database import SessionLocal as CountrySessionLocal
+from country_models import CountrySummary
+from gsc_client import (
+    fetch_gsc_data_for_range, iter_country_data_for_range, fetch_country_data_for_range,
+    derive_domain_data_by_date, DATA_STATE_ALL
+)
+from db_writer import save_domain_data, save_country_batches, save_country_data
+from rollups import refresh_rollups
+from watermarks import refresh_watermarks
+from gap_planner import plan_units, domain_weights, PRIORITY_FRESH, PRIORITY_REPAIR
+from job_ledger import run_ledger_jobs, LedgerJob, MAX_WORKERS
+from ingest_lease import PROVISIONAL_JOB_PREFIX
+
+logger = logging.getLogger("gsc_stats")
+
+# Через сколько дней данные GSC становятся окончательными (как в остальных путях загрузки)
+FINAL_LAG_DAYS = 2
+
+def fresh_window(today: date = None):
+    """Дни после последней окончательной даты до сегодняшнего включительно."""
+    today = today or date.today()
+    return today - timedelta(days=FINAL_LAG_DAYS - 1), today
+
+# --- Свежие данные ---
+def _fresh_domain(domain: str, start_date: date, end_date: date):
+    return save_domain_data(domain, fetch_gsc_data_for_range(domain, start_date, end_date, DATA_STATE_ALL), is_final=False)
+
+def _fresh_country(domain: str, start_date: date, end_date: date):
+    return save_country_batches(iter_country_data_for_range(domain, start_date, end_date, DATA_STATE_ALL), is_final=False)
+
+def _fresh_derived(domain: str, start_date: date, end_date: date):
+    records_by_date = fetch_country_data_for_range(domain, start_date, end_date, DATA_STATE_ALL)
+    rows = save_country_data(records_by_date, is_final=False)
+    return rows + save_domain_data(domain, derive_domain_data_by_date(domain, records_by_date), is_final=False)
+
+def ingest_fresh_data(today: date = None, workers: int = MAX_WORKERS):
+    """
+    Загружает неокончательные данные за fresh_window для всех доменов: одно задание на час,
+    единицы – по одной на домен с наивысшим приоритетом. Возвращает {job_id: job_progress}.
+    """
+    start_date, end_date = fresh_window(today)
+    weights = domain_weights(SessionLocal, start_date - timedelta(days=1))
+    classify = lambda domain, unit_start, unit_end: (PRIORITY_FRESH, weights.get(domain, 0.0))
+    units = [(domain, start_date, end_date) for domain in DOMAINS]
+    hour = datetime.now().strftime("%Y-%m-%dT%H")
+    if DERIVE_DOMAIN_FROM_COUNTRY:
+        processors = [("derived", _fresh_derived)]
+    else:
+        processors = [("domain", _fresh_domain), ("country", _fresh_country)]
+    jobs = [
+        LedgerJob(f"{PROVISIONAL_JOB_PREFIX}{dataset}-{hour}", dataset, units, process_range, classify=classify)
+        for dataset, process_range in processors
+    ]
+    logger.info(f"Fresh ingest (dataState=all) for {start_date} - {end_date}")
+    return run_ledger_jobs(jobs, workers=workers, desc="Свежие данные")
+
+# --- Сверка неокончательных данных ---
+def find_provisional_dates(session_factory, model, final_date: date):
+    """
+    {domain: [даты]} неокончательных строк таблицы model не позже final_date – их окончательные данные
+    уже доступны. Запрос идет по частичному индексу ix_<таблица>_provisional.
+    """
+    db = session_factory()
+    try:
+        rows = db.execute(text(f"""
+            SELECT DISTINCT d.name, t.date FROM {model.__tablename__} t JOIN domains d ON d.id = t.domain_id
+            WHERE NOT t.is_final AND t.date <= :final_date
+            ORDER BY d.name, t.date
+        """), {"final_date": final_date}).all()
+    finally:
+        db.close()
+    provisional = {}
+    for domain, provisional_date in rows:
+        provisional.setdefault(domain, []).append(provisional_date)
+    return provisional
+
+def delete_provisional_rows(session_factory, model, domain: str, start_date: date, end_date: date):
+    """
+    Удаляет неокончательные строки домена за период, оставшиеся после записи окончательных данных:
+    дни или страны, которых нет в окончательном ответе GSC. Сводки периода пересчитываются в той же транзакции.
+    """
+    db = session_factory()
+    try:
+        deleted = db.execute(text(f"""
+            DELETE FROM {model.__tablename__}
+            WHERE domain_id = (SELECT id FROM domains WHERE name = :domain) AND date BETWEEN :start_date AND :end_date AND NOT is_final
+        """), {"domain": domain, "start_date": start_date, "end_date": end_date}).rowcount
+        if deleted:
+            refresh_rollups(db.connection().exec_driver_sql, model.__tablename__, [(domain, start_date, end_date)])
+            refresh_watermarks(db.connection().exec_driver_sql, model.__tablename__, [domain])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+    return deleted
+
+def _reconcile_domain(domain: str, start_date: date, end_date: date):
+    rows = save_domain_data(domain, fetch_gsc_data_for_range(domain, start_date, end_date))
+    delete_provisional_rows(SessionLocal, DomainSummary, domain, start_date, end_date)
+    return rows
+
+def _reconcile_country(domain: str, start_date: date, end_date: date):
+    rows = save_country_batches(iter_country_data_for_range(domain, start_date, end_date))
+    delete_provisional_rows(CountrySessionLocal, CountrySummary, domain, start_date, end_date)
+    return rows
+
+def reconcile_provisional_data(today: date = None, workers: int = MAX_WORKERS):
+    """
+    Заменяет неокончательные строки, для которых уже доступны окончательные данные.
+    Возвращает {job_id: job_progress}; если сверять нечего – пустой словарь.
+    """
+    today = today or date.today()
+    final_date = today - timedelta(days=FINAL_LAG_DAYS)
+    weights = domain_weights(SessionLocal, final_date)
+    classify = lambda domain, unit_start, unit_end: (PRIORITY_REPAIR, weights.get(domain, 0.0))
+    jobs = []
+    for dataset, session_factory, model, process_range in (
+        ("domain", SessionLocal, DomainSummary, _reconcile_domain),
+        ("country", CountrySessionLocal, CountrySummary, _reconcile_country)
+    ):
+        units = plan_units(find_provisional_dates(session_factory, model, final_date))
+        if units:
+            jobs.append(LedgerJob(f"reconcile-{dataset}-{today.isoformat()}", dataset, units, process_range, classify=classify))
+    if not jobs:
+        logger.info("No provisional rows to reconcile")
+        return {}
+    logger.info(f"Reconciling provisional rows up to {final_date}: {sum(len(job.units) for job in jobs)} units")
+    return run_ledger_jobs(jobs, workers=workers, desc="Сверка свежих данных")
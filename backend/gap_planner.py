@@ -0,0 +1,179 @@
+# gap_planner.py
+"""
+Планировщик пропусков: одним SQL-запросом на таблицу находит все отсутствующие пары (домен, дата)
+за весь период хранения (generate_series по датам × домены, anti-join с таблицей данных) и
+группирует их в непрерывные диапазоны для запросов к GSC по окну дат.
+В отличие от поиска последней загруженной даты, находит и "дыры" в середине истории
+(например, дни, за которые загрузка когда-то завершилась ошибкой).
+Дни, за которые у домена в GSC нет данных, в таблицы не попадают: такие дни исключаются по журналу заданий
+(job_ledger.py) – если день входит в выполненную единицу, завершенную не раньше чем через EMPTY_SETTLE_DAYS
+дней после него, GSC уже ответил за этот день пустым результатом, и повторно он не запрашивается.
+unit_classifier назначает задачам класс приоритета (свежие дни, пропуски, глубокая история) и вес домена
+для общего планировщика в job_ledger.py.
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from config import DOMAINS
+from database import SessionLocal
+from gsc_client import RANGE_WINDOW_DAYS
+
+# Начало хранимой истории
+HISTORY_START = date(2024, 1, 1)
+
+# Классы приоритета задач: меньше – раньше
+PRIORITY_FRESH = 0      # последние FRESH_DAYS дней до доступной даты
+PRIORITY_REPAIR = 1     # пропуски внутри уже загруженной истории домена
+PRIORITY_HISTORY = 2    # дни до первой загруженной даты домена (новый домен, первичная загрузка)
+PRIORITY_NAMES = {PRIORITY_FRESH: "fresh", PRIORITY_REPAIR: "repair", PRIORITY_HISTORY: "history"}
+FRESH_DAYS = 3
+# За сколько дней считать трафик домена для его веса
+WEIGHT_DAYS = 28
+# Через сколько дней после даты пустой ответ GSC за нее считается окончательным (данные появляются с задержкой)
+EMPTY_SETTLE_DAYS = 3
+# Наборы данных журнала, единицы которых пишут в таблицу: {таблица: наборы}
+TABLE_DATASETS = {"domain_summaries": ("domain", "derived"), "country_summaries": ("country", "derived")}
+
+def find_missing_dates(session_factory, model, start_date: date, end_date: date, domains=DOMAINS):
+    """
+    Возвращает {domain: [отсутствующие даты по возрастанию]} для таблицы model за [start_date, end_date].
+    Домены без пропусков в результат не попадают; дни, уже полученные из GSC пустыми, – тоже.
+    """
+    table = model.__tablename__
+    query = text(f"""
+        SELECT d.domain, g.day::date AS date
+        FROM unnest(CAST(:domains AS text[])) AS d(domain)
+        LEFT JOIN domains dim ON dim.name = d.domain
+        CROSS JOIN generate_series(CAST(:start_date AS date), CAST(:end_date AS date), interval '1 day') AS g(day)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table} t WHERE t.domain_id = dim.id AND t.date = g.day::date
+        )
+        ORDER BY d.domain, g.day
+    """)
+    db = session_factory()
+    try:
+        rows = db.execute(query, {"domains": list(domains), "start_date": start_date, "end_date": end_date}).all()
+    finally:
+        db.close()
+    missing = {}
+    for domain, missing_date in rows:
+        missing.setdefault(domain, []).append(missing_date)
+    return exclude_fetched_empty(missing, table, start_date, end_date)
+
+def exclude_fetched_empty(missing: dict, table: str, start_date: date, end_date: date):
+    """
+    Убирает из {domain: [даты]} дни, которые уже запрашивались и пришли пустыми: они входят в выполненную
+    единицу журнала (ingest_units основной БД) набора, пишущего в table, а единица завершена не раньше
+    чем через EMPTY_SETTLE_DAYS дней после дня.
+    """
+    if not missing:
+        return missing
+    db = SessionLocal()
+    try:
+        units = db.execute(text("""
+            SELECT domain, greatest(start_date, :start_date),
+                   least(end_date, CAST(finished_at AS date) - :settle_days, :end_date)
+            FROM ingest_units
+            WHERE status = 'done' AND dataset = ANY(:datasets) AND domain = ANY(:domains)
+              AND start_date <= :end_date AND end_date >= :start_date
+              AND start_date <= CAST(finished_at AS date) - :settle_days
+        """), {
+            "datasets": list(TABLE_DATASETS[table]),
+            "domains": list(missing),
+            "start_date": start_date,
+            "end_date": end_date,
+            "settle_days": EMPTY_SETTLE_DAYS
+        }).all()
+    finally:
+        db.close()
+    fetched = {}
+    for domain, unit_start, unit_end in units:
+        dates = missing[domain]
+        fetched.setdefault(domain, set()).update(dates[bisect_left(dates, unit_start):bisect_right(dates, unit_end)])
+    result = {}
+    for domain, dates in missing.items():
+        left = [missing_date for missing_date in dates if missing_date not in fetched.get(domain, ())]
+        if left:
+            result[domain] = left
+    return result
+
+def contiguous_ranges(dates, max_days: int = RANGE_WINDOW_DAYS):
+    """
+    Группирует отсортированные даты в непрерывные диапазоны [(start, end)] длиной не больше max_days.
+    """
+    ranges = []
+    for single_date in dates:
+        if ranges:
+            range_start, range_end = ranges[-1]
+            if single_date == range_end + timedelta(days=1) and (single_date - range_start).days < max_days:
+                ranges[-1] = (range_start, single_date)
+                continue
+        ranges.append((single_date, single_date))
+    return ranges
+
+def plan_units(missing: dict):
+    """
+    {domain: [даты]} -> список задач (domain, start_date, end_date) по непрерывным диапазонам.
+    """
+    return [
+        (domain, range_start, range_end)
+        for domain in sorted(missing)
+        for range_start, range_end in contiguous_ranges(missing[domain])
+    ]
+
+def plan_missing_units(session_factory, model, end_date: date, start_date: date = HISTORY_START, domains=DOMAINS):
+    """
+    Задачи загрузки для всех пропусков таблицы model за [start_date, end_date].
+    """
+    return plan_units(find_missing_dates(session_factory, model, start_date, end_date, domains))
+
+def first_loaded_dates(session_factory, model):
+    """Первая загруженная дата каждого домена в таблице model: {domain: date}."""
+    db = session_factory()
+    try:
+        rows = db.execute(text(f"""
+            SELECT d.name, min(t.date) FROM {model.__tablename__} t JOIN domains d ON d.id = t.domain_id GROUP BY d.name
+        """)).all()
+    finally:
+        db.close()
+    return dict(rows)
+
+def domain_weights(session_factory, end_date: date, days: int = WEIGHT_DAYS):
+    """
+    Вес домена – его клики за последние days дней (domain_summaries основной БД): при равном классе
+    приоритета первыми загружаются домены с большим трафиком.
+    """
+    db = session_factory()
+    try:
+        rows = db.execute(text("""
+            SELECT d.name, coalesce(sum(s.traffic_clicks), 0) FROM domain_summaries s JOIN domains d ON d.id = s.domain_id
+            WHERE s.date > :start_date AND s.date <= :end_date GROUP BY d.name
+        """), {"start_date": end_date - timedelta(days=days), "end_date": end_date}).all()
+    finally:
+        db.close()
+    return {domain: float(clicks) for domain, clicks in rows}
+
+def unit_classifier(session_factory, model, available_date: date, weights: dict = None):
+    """
+    Функция (domain, start_date, end_date) -> (класс приоритета, вес) для задач таблицы model.
+    Свежая задача затрагивает последние FRESH_DAYS дней; пропуск начинается не раньше первой
+    загруженной даты домена; все остальное – глубокая история.
+    """
+    first_dates = first_loaded_dates(session_factory, model)
+    weights = weights or {}
+    fresh_start = available_date - timedelta(days=FRESH_DAYS - 1)
+
+    def classify(domain: str, start_date: date, end_date: date):
+        first_date = first_dates.get(domain)
+        if end_date >= fresh_start:
+            priority = PRIORITY_FRESH
+        elif first_date is not None and start_date >= first_date:
+            priority = PRIORITY_REPAIR
+        else:
+            priority = PRIORITY_HISTORY
+        return priority, weights.get(domain, 0.0)
+
+    return classify
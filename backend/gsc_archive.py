@@ -0,0 +1,76 @@
+# gsc_archive.py
+"""
+Локальный архив "сырых" ответов Search Analytics API.
+Каждый ответ дописывается строкой JSON (site_url, тело запроса, время получения, ответ) в сжатый
+gzip-файл в GSC_ARCHIVE_DIR. Файлы только дополняются: каждая запись – отдельный gzip-member,
+поэтому файл остается читаемым даже после аварийного завершения процесса.
+Из архива таблицы можно пересобрать без обращения к API (replay_archive.py).
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from config import GSC_ARCHIVE_ENABLED, GSC_ARCHIVE_DIR
+
+logger = logging.getLogger("gsc_stats")
+
+_lock = threading.Lock()
+
+def _archive_path(fetched_at: datetime):
+    # Отдельный файл на день и процесс: параллельные процессы не пишут в один файл
+    return os.path.join(GSC_ARCHIVE_DIR, f"{fetched_at:%Y-%m-%d}-{os.getpid()}.jsonl.gz")
+
+def archive_response(site_url: str, body: dict, response: dict):
+    """
+    Сохраняет ответ API в архив (если GSC_ARCHIVE_ENABLED). Ошибки записи только логируются:
+    архив не должен ломать загрузку данных.
+    """
+    if not GSC_ARCHIVE_ENABLED:
+        return
+    fetched_at = datetime.utcnow()
+    line = json.dumps({
+        "site_url": site_url,
+        "body": body,
+        "fetched_at": fetched_at.isoformat(),
+        "response": response
+    }, separators=(",", ":"), sort_keys=True) + "\n"
+    try:
+        with _lock:
+            os.makedirs(GSC_ARCHIVE_DIR, exist_ok=True)
+            with gzip.open(_archive_path(fetched_at), "ab") as f:
+                f.write(line.encode("utf-8"))
+    except Exception as e:
+        logger.error(f"Error writing GSC response for {site_url} to archive: {e}")
+
+def iter_archive(archive_dir: str = None):
+    """
+    Перебирает записи архива (словари с ключами site_url, body, fetched_at, response) в порядке файлов.
+    Поврежденные строки (например, оборванная последняя запись) пропускаются.
+    """
+    for path in sorted(glob.glob(os.path.join(archive_dir or GSC_ARCHIVE_DIR, "*.jsonl.gz"))):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping corrupted archive line in {path}")
+        except (OSError, EOFError) as e:
+            logger.warning(f"Archive file {path} is truncated: {e}")
+
+def latest_responses(archive_dir: str = None):
+    """
+    Возвращает {(site_url, тело запроса в JSON): запись} – для каждого запроса только самый свежий ответ,
+    чтобы повторная загрузка того же периода замещала прежние данные.
+    """
+    latest = {}
+    for entry in iter_archive(archive_dir):
+        key = (entry["site_url"], json.dumps(entry["body"], sort_keys=True))
+        if key not in latest or entry["fetched_at"] >= latest[key]["fetched_at"]:
+            latest[key] = entry
+    return latest
@@ -0,0 +1,242 @@
+# gsc_async_client.py
+"""
+Асинхронный клиент Google Search Console (Search Analytics API) на httpx.
+Все запросы идут через один пул keep-alive соединений, число одновременных запросов ограничено
+семафором, а темп запросов – квотами (token bucket) на сайт и на проект. Это позволяет держать
+сотни запросов "в полете" из одного event loop и при этом не выходить за квоты GSC.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date
+from urllib.parse import quote
+
+import httpx
+from tqdm import tqdm
+
+import gsc_client
+from gsc_client import (
+    ROW_LIMIT, MAX_RETRIES, RETRYABLE_ERRORS, GSCFetchError, credential_holder, retry_state,
+    classify_status, backoff_delay, _performance_row_to_result, _country_row_to_record
+)
+from gsc_archive import archive_response
+from config import GSC_SITE_QPM, GSC_PROJECT_QPM, GSC_MAX_IN_FLIGHT, GSC_ARCHIVE_ENABLED
+
+logger = logging.getLogger("gsc_stats")
+
+DEFAULT_API_ENDPOINT = "https://searchconsole.googleapis.com/"
+
+def _error_reasons(response: httpx.Response):
+    """Причины ошибки (error.errors[].reason) из тела ответа Google API."""
+    try:
+        return [item.get("reason") for item in response.json().get("error", {}).get("errors", [])]
+    except Exception:
+        return []
+
+class TokenBucket:
+    """
+    Ограничитель темпа запросов: per_minute токенов в минуту, запас не больше burst.
+    Ожидающие корутины обслуживаются по очереди.
+    """
+
+    def __init__(self, per_minute: int, burst: int = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 60)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class QuotaGovernor:
+    """
+    Квоты на запросы в минуту: отдельная корзина на каждый сайт и общая корзина на проект.
+    """
+
+    def __init__(self, site_qpm: int = GSC_SITE_QPM, project_qpm: int = GSC_PROJECT_QPM):
+        self.site_qpm = site_qpm
+        self.project_bucket = TokenBucket(project_qpm)
+        self.site_buckets = {}
+
+    async def acquire(self, site_url: str):
+        bucket = self.site_buckets.get(site_url)
+        if bucket is None:
+            bucket = self.site_buckets[site_url] = TokenBucket(self.site_qpm)
+        await bucket.acquire()
+        await self.project_bucket.acquire()
+
+class AsyncGSCClient:
+    """
+    Асинхронный клиент Search Analytics API. Используется как async context manager:
+
+        async with AsyncGSCClient() as client:
+            data_by_date = await client.fetch_gsc_data_for_range("alvadi.jp", start, end)
+    """
+
+    def __init__(self, max_in_flight: int = GSC_MAX_IN_FLIGHT, site_qpm: int = GSC_SITE_QPM,
+                 project_qpm: int = GSC_PROJECT_QPM, timeout: float = 60.0):
+        self.governor = QuotaGovernor(site_qpm, project_qpm)
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._http = httpx.AsyncClient(
+            base_url=gsc_client.API_ENDPOINT or DEFAULT_API_ENDPOINT,
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+            timeout=timeout
+        )
+        self.request_count = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def _get_token(self):
+        creds = credential_holder.peek()
+        if creds is None:
+            # Загрузка/обновление токена – блокирующая операция, выполняем ее вне event loop
+            creds = await asyncio.to_thread(credential_holder.get)
+        return creds.token
+
+    async def query(self, site_url: str, body: dict):
+        """
+        Выполняет один запрос searchAnalytics.query с учетом квот и лимита одновременных запросов.
+        Временные ошибки (429, квоты, 5xx, сеть) повторяются с экспоненциальной задержкой; общая пауза
+        после ошибок квот (gsc_client.retry_state) действует и на потоки, и на корутины.
+        Возвращает разобранный JSON-ответ; если запрос так и не удался, выбрасывает GSCFetchError.
+        """
+        path = f"webmasters/v3/sites/{quote(site_url, safe='')}/searchAnalytics/query"
+        for attempt in range(MAX_RETRIES + 1):
+            cooldown = retry_state.cooldown_remaining()
+            if cooldown > 0:
+                await asyncio.sleep(cooldown)
+            await self.governor.acquire(site_url)
+            try:
+                async with self._semaphore:
+                    token = await self._get_token()
+                    response = await self._http.post(path, json=body, headers={"Authorization": f"Bearer {token}"})
+                    self.request_count += 1
+                if response.is_success:
+                    retry_state.record("success")
+                    data = response.json()
+                    if GSC_ARCHIVE_ENABLED:
+                        # Сжатие и запись в файл – блокирующие операции
+                        await asyncio.to_thread(archive_response, site_url, body, data)
+                    return data
+                error_class = classify_status(response.status_code, _error_reasons(response))
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+            except httpx.TransportError as e:
+                error_class = "network"
+                error = str(e) or type(e).__name__
+
+            if error_class not in RETRYABLE_ERRORS or attempt == MAX_RETRIES:
+                retry_state.record(error_class)
+                retry_state.record("failed")
+                raise GSCFetchError(f"query for {site_url}: {error}", error_class)
+            delay = backoff_delay(attempt)
+            retry_state.register_retry(error_class, delay)
+            logger.warning(f"query for {site_url}: {error_class} error, retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f} sec")
+            await asyncio.sleep(delay)
+
+    async def query_all_rows(self, site_url: str, request_body: dict):
+        """
+        Забирает все строки ответа постранично (через startRow).
+        """
+        rows = []
+        start_row = 0
+        while True:
+            body = dict(request_body, rowLimit=ROW_LIMIT, startRow=start_row)
+            page = (await self.query(site_url, body)).get("rows", [])
+            rows.extend(page)
+            if len(page) < ROW_LIMIT:
+                return rows
+            start_row += len(page)
+
+    async def fetch_gsc_data_for_range(self, domain: str, start_date: date, end_date: date):
+        """
+        Асинхронный аналог gsc_client.fetch_gsc_data_for_range: {дата: данные домена}.
+        """
+        site_url = f"https://{domain}/"
+        rows = await self.query_all_rows(site_url, {
+            "startDate": start_date.strftime("%Y-%m-%d"),
+            "endDate": end_date.strftime("%Y-%m-%d"),
+            "dimensions": ["date"],
+            "searchType": "web"
+        })
+        results = {}
+        for row in rows:
+            date_str = row["keys"][0]
+            results[date.fromisoformat(date_str)] = _performance_row_to_result(site_url, row, date_str)
+        return results
+
+    async def fetch_country_data_for_range(self, domain: str, start_date: date, end_date: date):
+        """
+        Асинхронный аналог gsc_client.fetch_country_data_for_range: {дата: список записей по странам}.
+        """
+        site_url = f"https://{domain}/"
+        rows = await self.query_all_rows(site_url, {
+            "startDate": start_date.strftime("%Y-%m-%d"),
+            "endDate": end_date.strftime("%Y-%m-%d"),
+            "dimensions": ["date", "country"],
+            "searchType": "web"
+        })
+        results = {}
+        for row in rows:
+            record = _country_row_to_record(domain, row)
+            results.setdefault(record["date"], []).append(record)
+        return results
+
+async def run_ingest_units_async(units, dataset: str, save, desc: str = None, started=None, **client_kwargs):
+    """
+    Загружает задачи units – список (domain, start_date, end_date) – из одного event loop.
+    dataset: "domain" или "country". save(domain, start_date, end_date, result) – синхронная запись в БД,
+    выполняется в пуле потоков, чтобы не блокировать event loop. started(domain, start_date, end_date)
+    вызывается перед запросом задачи (время выполнения единицы в журнале заданий).
+    Возвращает (число успешных задач, список (задача, ошибка)).
+    """
+    successes = 0
+    failures = []
+
+    async with AsyncGSCClient(**client_kwargs) as client:
+        fetch = client.fetch_gsc_data_for_range if dataset == "domain" else client.fetch_country_data_for_range
+
+        async def run_unit(unit):
+            domain, start_date, end_date = unit
+            if started:
+                started(domain, start_date, end_date)
+            try:
+                result = await fetch(domain, start_date, end_date)
+                await asyncio.to_thread(save, domain, start_date, end_date, result)
+                return unit, None
+            except Exception as e:
+                return unit, e
+
+        tasks = [asyncio.create_task(run_unit(unit)) for unit in units]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=desc, unit="task"):
+            unit, error = await task
+            if error is None:
+                successes += 1
+            else:
+                failures.append((unit, error))
+                logger.error(f"Error processing {unit[0]} ({unit[1]} - {unit[2]}): {error}")
+
+        logger.info(f"Async ingest finished: {successes} units ok, {len(failures)} failed, {client.request_count} API requests")
+    return successes, failures
+
+def run_ingest_units(units, dataset: str, save, desc: str = None, started=None, **client_kwargs):
+    """
+    Синхронная обертка над run_ingest_units_async для cron- и backfill-скриптов.
+    """
+    return asyncio.run(run_ingest_units_async(units, dataset, save, desc, started, **client_kwargs))
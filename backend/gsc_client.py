@@ -1,11 +1,21 @@
 # gsc_client.py
 import os
 import logging
-from datetime import date
+import random
+import socket
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+import httplib2
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 from google.auth.transport.requests import Request
+from gsc_archive import archive_response
+from config import GSC_API_ENDPOINT
 
 # Настройка логирования
 logger = logging.getLogger("gsc_stats")
@@ -13,16 +23,40 @@ logger = logging.getLogger("gsc_stats")
 # Области доступа для чтения данных GSC
 SCOPES = ['https://www.googleapis.com/auth/webmasters.readonly']
 
+# Максимальное количество строк, которое API отдает за один запрос (дальше – постранично через startRow)
+ROW_LIMIT = 25000
+
+# Длина окна дат для одного запроса по диапазону. Окно ограничивает размер ответа
+# и объем данных, которые записываются в БД за одну задачу.
+RANGE_WINDOW_DAYS = 90
+
+# Максимальное количество запросов в одном HTTP batch-запросе (ограничение Google API – 1000)
+BATCH_SIZE = 100
+
+# Повторные попытки при ошибках квот (429/403 quotaExceeded/rateLimitExceeded), 5xx и сетевых сбоях:
+# экспоненциальная задержка BACKOFF_BASE * 2^попытка (не больше BACKOFF_MAX) со случайным разбросом
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+
 # Пути к файлам с клиентскими данными и токеном – укажите корректные пути
 CLIENT_SECRETS_FILE = r"C:\Users\Андрей\Desktop\GSCSTATS\backend\client_secret_1042267823089-rkog0ee0sdherkhkdbokl9h2iu4g6ro9.apps.googleusercontent.com.json"
 TOKEN_FILE = r"C:\Users\Андрей\Desktop\GSCSTATS\backend\token.json"
 
-def get_credentials():
+# Переопределение адреса API (например, для fake_gsc_server.py); None – стандартный адрес Google
+API_ENDPOINT = GSC_API_ENDPOINT
+
+# dataState запроса Search Analytics: "final" – только окончательные данные (по умолчанию в API),
+# "all" – включая свежие неокончательные (используется fresh_ingest.py)
+DATA_STATE_FINAL = "final"
+DATA_STATE_ALL = "all"
+
+def get_credentials(creds=None):
     """
     Получает OAuth 2.0 учетные данные: пытается загрузить сохраненные, а если их нет или они устарели – запускает flow.
+    Если передан уже загруженный объект creds, файл токена повторно не читается – токен только обновляется.
     """
-    creds = None
-    if os.path.exists(TOKEN_FILE):
+    if creds is None and os.path.exists(TOKEN_FILE):
         creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
@@ -30,84 +64,501 @@ def get_credentials():
         else:
             flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
             creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'w') as token:
-            token.write(creds.to_json())
+        save_credentials(creds)
     return creds
 
+def save_credentials(creds):
+    """Сохраняет токен в TOKEN_FILE, чтобы следующий запуск не обновлял его заново."""
+    with open(TOKEN_FILE, 'w') as token:
+        token.write(creds.to_json())
+
+class CredentialHolder:
+    """
+    Общие для всех потоков учетные данные OAuth 2.0.
+    Токен загружается один раз, а обновление выполняется только одним потоком (single-flight):
+    остальные потоки ждут на блокировке и получают уже обновленный токен, поэтому
+    файл токена не перечитывается и не перезаписывается конкурентно.
+    Токен обновляется только здесь: HTTP-транспорт сервиса (HolderHttp) берет его на каждый запрос.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._creds = None
+        self.refresh_count = 0
+
+    def peek(self):
+        """Возвращает загруженные и действующие учетные данные без блокировки или None."""
+        creds = self._creds
+        return creds if creds is not None and creds.valid else None
+
+    def get(self):
+        creds = self._creds
+        if creds is not None and creds.valid:
+            return creds
+        with self._lock:
+            # Пока поток ждал блокировку, токен мог уже обновить другой поток
+            if self._creds is None or not self._creds.valid:
+                self._creds = get_credentials(self._creds)
+                self.refresh_count += 1
+            return self._creds
+
+    def refresh(self, token: str):
+        """
+        Обновляет токен, который сервер отклонил (401), хотя по сроку он еще действует.
+        Если другой поток уже заменил token, повторно не обновляет и возвращает текущие учетные данные.
+        """
+        with self._lock:
+            if self._creds is None:
+                self._creds = get_credentials()
+                self.refresh_count += 1
+            elif self._creds.token == token:
+                self._creds.refresh(Request())
+                save_credentials(self._creds)
+                self.refresh_count += 1
+            return self._creds
+
+credential_holder = CredentialHolder()
+
+class HolderHttp:
+    """
+    HTTP-транспорт сервиса GSC: httplib2.Http, в каждый запрос которого подставляется bearer-токен
+    из credential_holder. Транспорт сам токен не обновляет: истекший обновляет holder при get(),
+    а после ответа 401 запрос повторяется один раз с токеном из credential_holder.refresh.
+    """
+
+    def __init__(self, http=None):
+        self.http = http or httplib2.Http()
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        headers = dict(headers or {})
+        token = credential_holder.get().token
+        headers["authorization"] = f"Bearer {token}"
+        response, content = self.http.request(uri, method, body=body, headers=headers, **kwargs)
+        if response.status == 401:
+            headers["authorization"] = f"Bearer {credential_holder.refresh(token).token}"
+            response, content = self.http.request(uri, method, body=body, headers=headers, **kwargs)
+        return response, content
+
+# Пул готовых объектов сервиса: по одному на поток, т.к. httplib2.Http не потокобезопасен
+_service_pool = threading.local()
+
+def build_gsc_service():
+    """
+    Создает новый объект сервиса Google Search Console со своим HTTP-соединением.
+    """
+    client_options = {"api_endpoint": API_ENDPOINT} if API_ENDPOINT else None
+    return build('searchconsole', 'v1', http=HolderHttp(), cache_discovery=False, client_options=client_options)
+
 def get_gsc_service():
     """
-    Создает объект сервиса Google Search Console (Search Analytics API) с использованием OAuth 2.0.
+    Возвращает объект сервиса Google Search Console (Search Analytics API) для текущего потока.
+    Сервис создается один раз на поток и переиспользуется вместе с его keep-alive соединением;
+    токен на каждый запрос берется из общего credential_holder.
     """
-    creds = get_credentials()
-    service = build('searchconsole', 'v1', credentials=creds)
+    service = getattr(_service_pool, "service", None)
+    if service is None:
+        service = build_gsc_service()
+        _service_pool.service = service
     return service
 
-def fetch_performance_data_for_domain(site_url: str, start_date: str, end_date: str):
+class GSCFetchError(Exception):
+    """Запрос к GSC завершился ошибкой, которую нельзя повторить, или исчерпал все повторные попытки."""
+
+    def __init__(self, message: str, error_class: str):
+        super().__init__(message)
+        self.error_class = error_class
+
+# Классы ошибок, для которых имеет смысл повторить запрос
+RETRYABLE_ERRORS = {"quota", "rate_limit", "server", "network"}
+# Причины 403-ответов, которые означают исчерпание квоты, а не отказ в доступе
+QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+def classify_status(status: int, reasons=()):
+    """
+    Определяет класс ошибки по HTTP-статусу и причинам из тела ответа Google API:
+    quota, rate_limit, server, auth или client.
     """
-    Запрашивает данные отчета "Эффективность" (Performance) из Google Search Console
-    для указанного site_url за период от start_date до end_date (формат 'YYYY-MM-DD').
+    reasons = set(reasons)
+    if status == 429 or reasons & RATE_LIMIT_REASONS:
+        return "rate_limit"
+    if reasons & QUOTA_REASONS:
+        return "quota"
+    if status >= 500:
+        return "server"
+    if status in (401, 403):
+        return "auth"
+    return "client"
+
+def classify_error(error: Exception):
+    """
+    Определяет класс ошибки для исключения googleapiclient/httplib2 (см. classify_status),
+    для сетевых сбоев – network, для остальных исключений – other.
+    """
+    if isinstance(error, GSCFetchError):
+        return error.error_class
+    if isinstance(error, HttpError):
+        details = error.error_details if isinstance(error.error_details, list) else []
+        reasons = [detail.get("reason") for detail in details if isinstance(detail, dict)]
+        return classify_status(error.resp.status, reasons)
+    if isinstance(error, (socket.timeout, TimeoutError, ConnectionError, httplib2.HttpLib2Error)):
+        return "network"
+    return "other"
+
+def backoff_delay(attempt: int):
+    """Задержка перед повторной попыткой: экспонента с "полным" случайным разбросом."""
+    return random.uniform(0.5, 1.0) * min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+
+class RetryState:
+    """
+    Общее для всех рабочих потоков состояние повторных попыток.
+    После ошибки квоты или лимита частоты все потоки ждут окончания общей паузы (cooldown),
+    поэтому пропускная способность снижается, а не расходуется на заведомо отклоняемые запросы.
+    Счетчики по классам ошибок помогают подбирать число рабочих потоков по фактическим данным.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cooldown_until = 0.0
+        self.counters = defaultdict(int)
+
+    def cooldown_remaining(self):
+        return max(0.0, self.cooldown_until - time.monotonic())
+
+    def wait_cooldown(self):
+        delay = self.cooldown_remaining()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, name: str, count: int = 1):
+        with self._lock:
+            self.counters[name] += count
+
+    def register_retry(self, error_class: str, delay: float):
+        with self._lock:
+            self.counters[error_class] += 1
+            self.counters["retries"] += 1
+            if error_class in ("quota", "rate_limit"):
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "cooldown_remaining": round(self.cooldown_remaining(), 2)
+            }
+
+retry_state = RetryState()
+
+def get_retry_stats():
+    """Возвращает счетчики запросов и ошибок по классам и оставшуюся общую паузу (для мониторинга)."""
+    return retry_state.snapshot()
+
+def execute_with_retry(request, description: str):
+    """
+    Выполняет запрос googleapiclient с повторными попытками для временных ошибок.
+    Если ошибка не временная или попытки закончились, выбрасывает GSCFetchError.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        retry_state.wait_cooldown()
+        try:
+            response = request.execute()
+            retry_state.record("success")
+            return response
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class not in RETRYABLE_ERRORS or attempt == MAX_RETRIES:
+                retry_state.record(error_class)
+                retry_state.record("failed")
+                raise GSCFetchError(f"{description}: {e}", error_class) from e
+            delay = backoff_delay(attempt)
+            retry_state.register_retry(error_class, delay)
+            logger.warning(f"{description}: {error_class} error, retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f} sec: {e}")
+            time.sleep(delay)
+
+def date_windows(start_date: date, end_date: date, window_days: int = RANGE_WINDOW_DAYS):
+    """
+    Разбивает период [start_date, end_date] на последовательные окна длиной не более window_days дней.
+    Возвращает генератор пар (начало окна, конец окна).
+    """
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        yield window_start, window_end
+        window_start = window_end + timedelta(days=1)
+
+def iter_search_analytics_pages(site_url: str, request_body: dict):
+    """
+    Выполняет запрос Search Analytics и постранично (через startRow) забирает все строки ответа.
+    Возвращает генератор страниц – списков строк в формате API.
     """
     service = get_gsc_service()
-    request_body = {
-        "startDate": start_date,
-        "endDate": end_date,
-        "dimensions": ["date"],
-        "searchType": "web",
-        "rowLimit": 10000
+    start_row = 0
+    while True:
+        body = dict(request_body, rowLimit=ROW_LIMIT, startRow=start_row)
+        response = execute_with_retry(
+            service.searchanalytics().query(siteUrl=site_url, body=body),
+            f"query for {site_url} ({request_body['startDate']} - {request_body['endDate']})"
+        )
+        archive_response(site_url, body, response)
+        rows = response.get("rows", [])
+        if rows:
+            yield rows
+        if len(rows) < ROW_LIMIT:
+            break
+        start_row += len(rows)
+
+def _performance_row_to_result(site_url: str, row: dict, date_str: str):
+    """
+    Преобразует строку отчета "Эффективность" в словарь для сохранения в БД
+    и дополняет его данными индексации.
+    """
+    indexing_data = fetch_indexing_data_for_domain(site_url, date_str)
+    return {
+        "traffic_clicks": int(row.get("clicks", 0)),
+        "impressions": int(row.get("impressions", 0)),
+        "ctr": float(row.get("ctr", 0.0)),
+        "avg_position": float(row.get("position", 0.0)),
+        "pages_indexed": indexing_data.get("pages_indexed", 0),
+        "pages_not_indexed": indexing_data.get("pages_not_indexed", 0),
+        "errors": indexing_data.get("errors", {})
+    }
+
+def _country_row_to_record(domain: str, row: dict):
+    """
+    Преобразует строку отчета с измерениями ["date", "country"] в запись для таблицы стран.
+    """
+    keys = row.get("keys", [])
+    country = keys[1] if len(keys) > 1 else "N/A"
+    return {
+        "domain": domain,
+        "date": date.fromisoformat(keys[0]),
+        "country": country,
+        "traffic_clicks": int(row.get("clicks", 0)),
+        "impressions": int(row.get("impressions", 0)),
+        "ctr": float(row.get("ctr", 0.0)),
+        "avg_position": float(row.get("position", 0.0))
+    }
+
+def _range_body(start_date: date, end_date: date, dimensions: list, data_state: str = DATA_STATE_FINAL):
+    body = {
+        "startDate": start_date.strftime("%Y-%m-%d"),
+        "endDate": end_date.strftime("%Y-%m-%d"),
+        "dimensions": dimensions,
+        "searchType": "web"
     }
-    
+    if data_state != DATA_STATE_FINAL:
+        body["dataState"] = data_state
+    return body
+
+def fetch_gsc_data_for_range(domain: str, start_date: date, end_date: date, data_state: str = DATA_STATE_FINAL):
+    """
+    Получает сводные данные домена за весь период [start_date, end_date] одним запросом
+    с измерением ["date"] (при необходимости – постранично) и раскладывает строки по дням.
+    data_state=DATA_STATE_ALL включает свежие неокончательные данные.
+    Возвращает словарь {дата: данные в формате fetch_gsc_data_for_domain}; дни без данных в словарь не попадают.
+    Временные ошибки повторяются (execute_with_retry); если запрос так и не удался, выбрасывается GSCFetchError.
+    """
+    site_url = f"https://{domain}/"
+    request_body = _range_body(start_date, end_date, ["date"], data_state)
+
     try:
-        response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body=request_body
-        ).execute()
-        return response
+        results = {}
+        for rows in iter_search_analytics_pages(site_url, request_body):
+            for row in rows:
+                date_str = row["keys"][0]
+                results[date.fromisoformat(date_str)] = _performance_row_to_result(site_url, row, date_str)
+        return results
     except Exception as e:
-        logger.error(f"Error fetching performance data for {site_url} ({start_date} to {end_date}): {e}")
-        return None
+        logger.error(f"Error fetching GSC data for {domain} ({start_date} to {end_date}): {e}")
+        if isinstance(e, GSCFetchError):
+            raise
+        raise GSCFetchError(f"{domain} ({start_date} - {end_date}): {e}", classify_error(e)) from e
 
-def fetch_country_data_for_domain(domain: str, target_date: date):
+def iter_country_data_for_range(domain: str, start_date: date, end_date: date, data_state: str = DATA_STATE_FINAL):
     """
-    Получает данные "Эффективности" по странам для указанного домена и даты.
-    Запрашивает отчет с измерениями ["date", "country"] и возвращает список записей,
-    каждая из которых содержит: domain, date, country, клики, показы, CTR и среднюю позицию.
+    Потоковый вариант fetch_country_data_for_range: постранично (через startRow) запрашивает данные
+    "Эффективности" по странам за период [start_date, end_date] и выдает пачки записей по мере
+    получения страниц, не накапливая весь ответ в памяти.
+    Если запрос так и не удался после повторных попыток, выбрасывается GSCFetchError.
     """
     site_url = f"https://{domain}/"
-    date_str = target_date.strftime("%Y-%m-%d")
+    request_body = _range_body(start_date, end_date, ["date", "country"], data_state)
+
+    try:
+        for rows in iter_search_analytics_pages(site_url, request_body):
+            yield [_country_row_to_record(domain, row) for row in rows]
+    except Exception as e:
+        logger.error(f"Error fetching country data for {domain} ({start_date} to {end_date}): {e}")
+        if isinstance(e, GSCFetchError):
+            raise
+        raise GSCFetchError(f"{domain} ({start_date} - {end_date}): {e}", classify_error(e)) from e
+
+def fetch_country_data_for_range(domain: str, start_date: date, end_date: date, data_state: str = DATA_STATE_FINAL):
+    """
+    Получает данные "Эффективности" по странам за весь период [start_date, end_date] одним запросом
+    с измерениями ["date", "country"] (при необходимости – постранично).
+    Возвращает словарь {дата: список записей в формате fetch_country_data_for_domain}.
+    Если запрос так и не удался после повторных попыток, выбрасывается GSCFetchError.
+    """
+    results = {}
+    for records in iter_country_data_for_range(domain, start_date, end_date, data_state):
+        for record in records:
+            results.setdefault(record["date"], []).append(record)
+    return results
+
+def derive_domain_summary(site_url: str, country_records: list, date_str: str):
+    """
+    Вычисляет сводные данные домена за день из записей по странам (без отдельного запроса с ["date"]):
+    клики и показы суммируются, CTR пересчитывается из сумм, средняя позиция взвешивается по показам.
+    Возвращает словарь в формате fetch_gsc_data_for_domain.
+    """
+    clicks = sum(record["traffic_clicks"] for record in country_records)
+    impressions = sum(record["impressions"] for record in country_records)
+    weighted_position = sum(record["avg_position"] * record["impressions"] for record in country_records)
+    return _performance_row_to_result(site_url, {
+        "clicks": clicks,
+        "impressions": impressions,
+        "ctr": clicks / impressions if impressions else 0.0,
+        "position": weighted_position / impressions if impressions else 0.0
+    }, date_str)
+
+def derive_domain_data_by_date(domain: str, records_by_date: dict):
+    """
+    Применяет derive_domain_summary к результату fetch_country_data_for_range:
+    {дата: записи по странам} -> {дата: данные домена}.
+    """
+    site_url = f"https://{domain}/"
+    return {
+        single_date: derive_domain_summary(site_url, records, single_date.strftime("%Y-%m-%d"))
+        for single_date, records in records_by_date.items()
+        if records
+    }
+
+def split_single_day_units(units):
+    """
+    Делит задачи (domain, start_date, end_date) на однодневные пары (domain, date), которые выгоднее
+    отправлять пакетом (fetch_*_batch), и многодневные окна для запросов по диапазону.
+    """
+    single_days = [(domain, start_date) for domain, start_date, end_date in units if start_date == end_date]
+    ranges = [unit for unit in units if unit[1] != unit[2]]
+    return single_days, ranges
+
+def _execute_batch(queries: dict):
+    """
+    Отправляет запросы searchanalytics().query пакетами по BATCH_SIZE в одном HTTP-запросе.
+    queries: {ключ: (site_url, тело запроса)}. Возвращает {ключ: ответ API или исключение}.
+    Запросы пакета, завершившиеся временной ошибкой, повторяются следующим пакетом после задержки.
+    """
     service = get_gsc_service()
-    request_body = {
+    results = {}
+    pending = list(queries)
+    for attempt in range(MAX_RETRIES + 1):
+        retry_state.wait_cooldown()
+        round_results = {}
+        for chunk_start in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[chunk_start:chunk_start + BATCH_SIZE]
+
+            def callback(request_id, response, exception, chunk=chunk):
+                round_results[chunk[int(request_id)]] = exception if exception is not None else response
+
+            if API_ENDPOINT:
+                # new_batch_http_request() не учитывает переопределенный адрес API
+                batch = BatchHttpRequest(callback=callback, batch_uri=API_ENDPOINT.rstrip("/") + "/batch")
+            else:
+                batch = service.new_batch_http_request(callback=callback)
+            for i, key in enumerate(chunk):
+                site_url, body = queries[key]
+                batch.add(service.searchanalytics().query(siteUrl=site_url, body=body), request_id=str(i))
+            try:
+                batch.execute()
+            except Exception as e:
+                # Ошибка всего пакета (сеть, авторизация) – отдаем ее каждому запросу, который не получил ответ
+                logger.error(f"Error executing GSC batch of {len(chunk)} requests: {e}")
+                for key in chunk:
+                    round_results.setdefault(key, e)
+
+        retry_keys = []
+        for key, response in round_results.items():
+            if not isinstance(response, Exception):
+                retry_state.record("success")
+                archive_response(*queries[key], response)
+                results[key] = response
+                continue
+            error_class = classify_error(response)
+            if error_class in RETRYABLE_ERRORS and attempt < MAX_RETRIES:
+                retry_keys.append((key, error_class))
+            else:
+                retry_state.record(error_class)
+                retry_state.record("failed")
+                results[key] = GSCFetchError(f"{queries[key][0]}: {response}", error_class)
+        if not retry_keys:
+            break
+        delay = backoff_delay(attempt)
+        for key, error_class in retry_keys:
+            retry_state.register_retry(error_class, delay)
+        logger.warning(f"{len(retry_keys)} of {len(pending)} batched GSC requests failed temporarily, retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f} sec")
+        pending = [key for key, _ in retry_keys]
+        time.sleep(delay)
+    return results
+
+def _single_day_body(target_date: date, dimensions: list):
+    date_str = target_date.strftime("%Y-%m-%d")
+    return {
         "startDate": date_str,
         "endDate": date_str,
-        "dimensions": ["date", "country"],
+        "dimensions": dimensions,
         "searchType": "web",
-        "rowLimit": 10000
+        "rowLimit": ROW_LIMIT
     }
-    
-    try:
-        response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body=request_body
-        ).execute()
-        records = []
-        
-        if "rows" in response:
-            for row in response["rows"]:
-                keys = row.get("keys", [])
-                country = keys[1] if len(keys) > 1 else "N/A"
-                record = {
-                    "domain": domain,
-                    "date": target_date,
-                    "country": country,
-                    "traffic_clicks": int(row.get("clicks", 0)),
-                    "impressions": int(row.get("impressions", 0)),
-                    "ctr": float(row.get("ctr", 0.0)),
-                    "avg_position": float(row.get("position", 0.0))
-                }
-                records.append(record)
-        return records
-    except Exception as e:
-        logger.error(f"Error fetching country data for {domain} on {date_str}: {e}")
-        return None
+
+def fetch_gsc_data_batch(pairs):
+    """
+    Получает сводные данные по списку пар (domain, date) пакетными HTTP-запросами.
+    Возвращает {(domain, date): результат}, где результат – словарь в формате fetch_gsc_data_for_domain,
+    None, если данных за день нет, или исключение, если запрос для этой пары завершился ошибкой.
+    """
+    queries = {
+        (domain, target_date): (f"https://{domain}/", _single_day_body(target_date, ["date"]))
+        for domain, target_date in pairs
+    }
+    results = {}
+    for (domain, target_date), response in _execute_batch(queries).items():
+        if isinstance(response, Exception):
+            logger.error(f"Error fetching GSC data for {domain} on {target_date}: {response}")
+            results[(domain, target_date)] = response
+            continue
+        rows = response.get("rows", [])
+        site_url, body = queries[(domain, target_date)]
+        results[(domain, target_date)] = _performance_row_to_result(site_url, rows[0], body["startDate"]) if rows else None
+    return results
+
+def fetch_country_data_batch(pairs):
+    """
+    Получает данные по странам по списку пар (domain, date) пакетными HTTP-запросами.
+    Возвращает {(domain, date): список записей или исключение}.
+    """
+    queries = {
+        (domain, target_date): (f"https://{domain}/", _single_day_body(target_date, ["date", "country"]))
+        for domain, target_date in pairs
+    }
+    results = {}
+    for (domain, target_date), response in _execute_batch(queries).items():
+        if isinstance(response, Exception):
+            logger.error(f"Error fetching country data for {domain} on {target_date}: {response}")
+            results[(domain, target_date)] = response
+            continue
+        results[(domain, target_date)] = [_country_row_to_record(domain, row) for row in response.get("rows", [])]
+    return results
+
+def fetch_country_data_for_domain(domain: str, target_date: date):
+    """
+    Получает данные "Эффективности" по странам для указанного домена и даты.
+    Запрашивает отчет с измерениями ["date", "country"] и возвращает список записей,
+    каждая из которых содержит: domain, date, country, клики, показы, CTR и среднюю позицию.
+    """
+    results = fetch_country_data_for_range(domain, target_date, target_date)
+    return results.get(target_date, [])
 
 def fetch_indexing_data_for_domain(site_url: str, target_date: str):
     """
@@ -127,47 +578,22 @@ def fetch_gsc_data_for_domain(domain: str, target_date: date):
       - Преобразует domain в URL (например, "https://alvadi.jp/")
       - Запрашивает данные за указанный день и извлекает клики, показы, CTR и среднюю позицию.
     Для панели индексации вызывается fetch_indexing_data_for_domain, которая возвращает значения по умолчанию.
-    Возвращает словарь с данными для сохранения в БД или None, если данных нет.
+    Возвращает словарь с данными для сохранения в БД или None, если данных нет;
+    при ошибке запроса выбрасывает GSCFetchError.
+    Для загрузки нескольких дней используйте fetch_gsc_data_for_range – это один запрос вместо запроса на каждый день.
     """
-    site_url = f"https://{domain}/"
     date_str = target_date.strftime("%Y-%m-%d")
-    
-    try:
-        performance_response = fetch_performance_data_for_domain(site_url, date_str, date_str)
-        
-        # Если ответ пустой или нет строк данных, значит данных за эту дату нет
-        if not performance_response or "rows" not in performance_response or not performance_response["rows"]:
-            logger.info(f"No data available for {domain} on {date_str}")
-            return None
-            
-        traffic_clicks = 0
-        impressions = 0
-        ctr = 0.0
-        avg_position = 0.0
-        
-        row = performance_response["rows"][0]
-        traffic_clicks = row.get("clicks", 0)
-        impressions = row.get("impressions", 0)
-        ctr = row.get("ctr", 0.0)
-        avg_position = row.get("position", 0.0)
-            
-        indexing_data = fetch_indexing_data_for_domain(site_url, date_str)
-            
-        result = {
-            "traffic_clicks": int(traffic_clicks),
-            "impressions": int(impressions),
-            "ctr": float(ctr),
-            "avg_position": float(avg_position),
-            "pages_indexed": indexing_data.get("pages_indexed", 0),
-            "pages_not_indexed": indexing_data.get("pages_not_indexed", 0),
-            "errors": indexing_data.get("errors", {})
-        }
-            
-        # Проверка на нулевые значения - если все нули, возможно данных нет
-        if traffic_clicks == 0 and impressions == 0 and ctr == 0 and avg_position == 0:
-            logger.info(f"All metrics are zero for {domain} on {date_str}, likely no data")
-            
-        return result
-    except Exception as e:
-        logger.error(f"Error fetching GSC data for {domain} on {date_str}: {e}")
+    results = fetch_gsc_data_for_range(domain, target_date, target_date)
+
+    # Если ответ пустой или нет строк данных, значит данных за эту дату нет
+    if target_date not in results:
+        logger.info(f"No data available for {domain} on {date_str}")
         return None
+
+    result = results[target_date]
+
+    # Проверка на нулевые значения - если все нули, возможно данных нет
+    if result["traffic_clicks"] == 0 and result["impressions"] == 0 and result["ctr"] == 0 and result["avg_position"] == 0:
+        logger.info(f"All metrics are zero for {domain} on {date_str}, likely no data")
+
+    return result
@@ -0,0 +1,139 @@
+# ingest.py
+"""
+Общие функции загрузки данных GSC в БД для cron_job.py и /api/update_data (main.py).
+Для каждого набора данных (domain, country, derived) есть обработчик диапазона дат и обработчик пакета
+однодневных пар (пакетный HTTP-запрос); оба возвращают число записанных строк.
+run_dataset_job выполняет набор единиц работы через журнал заданий (job_ledger.py),
+run_dataset_jobs – несколько наборов общим планировщиком с приоритетами.
+"""
+
+import logging
+from datetime import date
+
+from gsc_client import (
+    fetch_gsc_data_for_range, fetch_gsc_data_batch,
+    fetch_country_data_for_range, iter_country_data_for_range, fetch_country_data_batch,
+    derive_domain_data_by_date
+)
+from db_writer import save_domain_data, save_country_data, save_country_batches
+from job_ledger import run_ledger_job, run_ledger_jobs, run_ledger_job_async, LedgerJob, MAX_WORKERS
+
+logger = logging.getLogger("gsc_stats")
+
+DATASETS = ("domain", "country", "derived")
+
+# --- Доменные данные ---
+def process_domain_range(domain: str, start_date: date, end_date: date):
+    return save_domain_data(domain, fetch_gsc_data_for_range(domain, start_date, end_date))
+
+def process_domain_batch(pairs):
+    results = {}
+    for (domain, single_date), data in fetch_gsc_data_batch(pairs).items():
+        if isinstance(data, Exception) or data is None:
+            results[(domain, single_date)] = data or 0
+        else:
+            results[(domain, single_date)] = save_domain_data(domain, {single_date: data})
+    return results
+
+# --- Данные по странам ---
+def process_country_range(domain: str, start_date: date, end_date: date):
+    # Страницы ответа пишутся в БД по мере получения, весь ответ в памяти не держится
+    return save_country_batches(iter_country_data_for_range(domain, start_date, end_date))
+
+def process_country_batch(pairs):
+    results = {}
+    for (domain, single_date), records in fetch_country_data_batch(pairs).items():
+        if isinstance(records, Exception):
+            results[(domain, single_date)] = records
+        else:
+            results[(domain, single_date)] = save_country_data({single_date: records}) if records else 0
+    return results
+
+# --- Доменные данные, вычисленные из данных по странам ---
+def save_derived(domain: str, records_by_date: dict, domain_dates=None):
+    """
+    Сохраняет записи по странам и вычисленные из них данные домена (DERIVE_DOMAIN_FROM_COUNTRY).
+    domain_dates – даты, за которые нужно записать данные домена (None – все даты).
+    """
+    rows = save_country_data(records_by_date)
+    if domain_dates is not None:
+        records_by_date = {d: records for d, records in records_by_date.items() if d in domain_dates}
+    return rows + save_domain_data(domain, derive_domain_data_by_date(domain, records_by_date))
+
+def derived_processors(domain_dates: dict = None):
+    """
+    Обработчики диапазона и пакета для режима derived. domain_dates: {domain: множество дат}, за которые
+    нужно записать данные домена; None – за все загруженные даты.
+    """
+    def dates_for(domain):
+        return None if domain_dates is None else domain_dates.get(domain, set())
+
+    def process_range(domain: str, start_date: date, end_date: date):
+        return save_derived(domain, fetch_country_data_for_range(domain, start_date, end_date), dates_for(domain))
+
+    def process_batch(pairs):
+        results = {}
+        for (domain, single_date), records in fetch_country_data_batch(pairs).items():
+            if isinstance(records, Exception):
+                results[(domain, single_date)] = records
+            else:
+                results[(domain, single_date)] = save_derived(domain, {single_date: records}, dates_for(domain)) if records else 0
+        return results
+
+    return process_range, process_batch
+
+def _async_save(dataset: str, domain_dates: dict = None):
+    def save(domain: str, start_date: date, end_date: date, result: dict):
+        if dataset == "domain":
+            return save_domain_data(domain, result)
+        if dataset == "country":
+            return save_country_data(result)
+        return save_derived(domain, result, None if domain_dates is None else domain_dates.get(domain, set()))
+    return save
+
+def dataset_processors(dataset: str, domain_dates: dict = None):
+    """Обработчики диапазона и пакета (process_range, process_batch) для набора данных dataset."""
+    if dataset == "domain":
+        return process_domain_range, process_domain_batch
+    if dataset == "country":
+        return process_country_range, process_country_batch
+    return derived_processors(domain_dates)
+
+def run_dataset_job(job_id: str, dataset: str, units, use_async: bool = False, progress=None,
+                    domain_dates: dict = None, workers: int = MAX_WORKERS, desc: str = None, attached=None,
+                    classify=None):
+    """
+    Загружает units – (domain, start_date, end_date) – набора dataset через журнал заданий job_id.
+    Повторный вызов с тем же job_id продолжает задание с невыполненных единиц.
+    Единицы, которые уже загружает другое задание (те же таблицы, домен и даты), ждут его, вызывая attached(holder, progress).
+    classify – приоритет и вес единиц (gap_planner.unit_classifier).
+    Возвращает сводку job_ledger.job_progress.
+    """
+    if use_async:
+        # Асинхронный клиент запрашивает данные по странам и для режима derived
+        fetch_dataset = "domain" if dataset == "domain" else "country"
+        return run_ledger_job_async(job_id, dataset, units, _async_save(dataset, domain_dates), fetch_dataset,
+                                    progress=progress, desc=desc, attached=attached, classify=classify)
+    process_range, process_batch = dataset_processors(dataset, domain_dates)
+    return run_ledger_job(job_id, dataset, units, process_range, process_batch, workers=workers, progress=progress,
+                          desc=desc, attached=attached, classify=classify)
+
+def run_dataset_jobs(jobs, use_async: bool = False, domain_dates: dict = None, workers: int = MAX_WORKERS,
+                     desc: str = None, attached=None):
+    """
+    Загружает несколько наборов одним планировщиком: jobs – список (job_id, dataset, units, progress, classify).
+    Единицы всех заданий разбираются общим пулом по классу приоритета и весу домена.
+    Асинхронный клиент выполняет задания по очереди (у него свой общий лимит запросов).
+    Возвращает {job_id: job_progress}.
+    """
+    if use_async:
+        return {
+            job_id: run_dataset_job(job_id, dataset, units, True, progress, domain_dates, desc=desc,
+                                    attached=attached, classify=classify)
+            for job_id, dataset, units, progress, classify in jobs
+        }
+    ledger_jobs = [
+        LedgerJob(job_id, dataset, units, *dataset_processors(dataset, domain_dates), progress=progress, classify=classify)
+        for job_id, dataset, units, progress, classify in jobs
+    ]
+    return run_ledger_jobs(ledger_jobs, workers=workers, desc=desc, attached=attached)
@@ -0,0 +1,66 @@
+# ingest_lease.py
+"""
+Межпроцессная аренда (lease) единиц работы загрузки: cron, /api/update_data и backfill-скрипты в разных
+процессах не запрашивают одни и те же данные одновременно.
+Арендой служит сама единица журнала заданий (job_ledger.py) в состоянии running, пока исполнитель
+продлевает ее claimed_at heartbeat-ом: она закрывает таблицы своего набора данных (DATASET_TABLES),
+домен и диапазон дат. Единица другого задания, пересекающаяся с арендованной, не забирается, пока та
+не завершится; если к этому времени все ее дни уже загрузило другое задание (после начала нашего),
+она отмечается выполненной без запроса к GSC. Задания с разными доменами или датами идут параллельно.
+Забор единиц сериализован транзакционной advisory-блокировкой CLAIM_LOCK: проверка пересечений
+и взятие аренды атомарны для всех процессов. При падении исполнителя heartbeat прекращается,
+и аренда истекает через job_ledger.STALE_CLAIM_MINUTES.
+"""
+
+import hashlib
+
+# Как часто задание, единицы которого ждут чужой аренды, проверяет ее снова (сек.)
+LEASE_POLL_SECONDS = 5
+
+# Таблицы, в которые пишет каждый набор данных: derived заполняет обе
+DATASET_TABLES = {
+    "domain": ("domain_summaries",),
+    "country": ("country_summaries",),
+    "derived": ("domain_summaries", "country_summaries"),
+}
+
+# Задания свежих неокончательных данных (dataState=all, fresh_ingest.py): их дни не засчитываются
+# заданиям окончательных данных и наоборот
+PROVISIONAL_JOB_PREFIX = "fresh-"
+
+def advisory_key(name: str):
+    """64-битный ключ pg_advisory_lock для имени аренды."""
+    return int.from_bytes(hashlib.sha1(f"gsc_stats:{name}".encode()).digest()[:8], "big", signed=True)
+
+# Блокировка, под которой забираются единицы работы всех заданий
+CLAIM_LOCK = advisory_key("ingest_claim")
+
+def _pairs_sql(pairs):
+    return ", ".join(f"('{first}', '{second}')" for first, second in sorted(pairs))
+
+# Пары наборов (единица, чужая единица), которые пишут в общую таблицу
+OVERLAPPING_DATASETS = _pairs_sql(
+    (first, second) for first in DATASET_TABLES for second in DATASET_TABLES
+    if set(DATASET_TABLES[first]) & set(DATASET_TABLES[second])
+)
+# Пары, где чужая единица загружает все таблицы единицы
+COVERING_DATASETS = _pairs_sql(
+    (first, second) for first in DATASET_TABLES for second in DATASET_TABLES
+    if set(DATASET_TABLES[first]) <= set(DATASET_TABLES[second])
+)
+
+def overlap_condition(unit: str, other: str):
+    """SQL-условие: единица other другого задания пересекается с unit по таблицам, домену и датам."""
+    return f"""
+        {other}.job_id <> {unit}.job_id AND {other}.domain = {unit}.domain
+        AND {other}.start_date <= {unit}.end_date AND {other}.end_date >= {unit}.start_date
+        AND ({unit}.dataset, {other}.dataset) IN ({OVERLAPPING_DATASETS})
+    """
+
+def cover_condition(unit: str, other: str):
+    """SQL-условие: единица other другого задания загружает те же данные домена, что и unit (без условия на даты)."""
+    return f"""
+        {other}.job_id <> {unit}.job_id AND {other}.domain = {unit}.domain
+        AND ({unit}.dataset, {other}.dataset) IN ({COVERING_DATASETS})
+        AND ({other}.job_id LIKE '{PROVISIONAL_JOB_PREFIX}%') = ({unit}.job_id LIKE '{PROVISIONAL_JOB_PREFIX}%')
+    """
@@ -0,0 +1,546 @@
+# job_ledger.py
+"""
+Журнал заданий загрузки (таблица ingest_units): каждая единица работы – домен и диапазон дат – хранит
+состояние (pending / running / done / failed), число попыток, число записанных строк и время выполнения.
+Исполнители забирают единицы работы через SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько потоков
+и процессов могут разбирать одно задание, а прерванное задание (падение, перезапуск) с тем же job_id
+продолжается с невыполненных единиц, а не начинается заново.
+Забранная единица – аренда ее таблиц, домена и дат (ingest_lease.py): пересекающиеся единицы других заданий
+ждут ее завершения (задание присоединяется к прогрессу владельца), а дни, которые другое задание уже
+загрузило после начала этого, повторно не запрашиваются.
+run_ledger_jobs выполняет несколько заданий (например, доменные данные и данные по странам) одним пулом:
+единицы забираются по классу приоритета (свежие дни, пропуски, глубокая история – gap_planner.py), затем
+по весу домена, а общее число одновременно выполняемых единиц в процессе ограничено GLOBAL_MAX_WORKERS.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from tqdm import tqdm
+
+from database import SessionLocal
+from connections import ingest_worker_limit
+from models import IngestUnit
+from gsc_client import BATCH_SIZE
+from gap_planner import PRIORITY_REPAIR, PRIORITY_NAMES
+from ingest_lease import CLAIM_LOCK, LEASE_POLL_SECONDS, overlap_condition, cover_condition
+
+logger = logging.getLogger("gsc_stats")
+
+MAX_WORKERS = 20
+# Сколько единиц работы одновременно выполняется во всем процессе – на все задания вместе
+# (cron, /api/update_data), чтобы параллельные задания не умножали нагрузку на GSC;
+# не больше, чем потоков помещается в пул соединений процесса (connections.ingest_worker_limit)
+GLOBAL_MAX_WORKERS = min(20, ingest_worker_limit())
+# Сколько раз пытаться выполнить единицу работы, прежде чем оставить ее в состоянии failed
+MAX_ATTEMPTS = 3
+# Единицы в состоянии running дольше этого срока считаются брошенными (исполнитель упал) и забираются снова
+STALE_CLAIM_MINUTES = 30
+# Как часто живой исполнитель продлевает claimed_at своих единиц (сек.)
+HEARTBEAT_SECONDS = 60
+# Сколько единиц асинхронный исполнитель забирает за раз: остальные остаются в очереди для других процессов
+ASYNC_CLAIM_CHUNK = 500
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+ClaimedUnit = namedtuple("ClaimedUnit", ["id", "domain", "start_date", "end_date", "job_id", "priority"])
+
+# Задание для run_ledger_jobs: обработчики как в run_ledger_job; classify(domain, start_date, end_date) ->
+# (класс приоритета, вес) – gap_planner.unit_classifier, без него все единицы получают PRIORITY_REPAIR
+LedgerJob = namedtuple(
+    "LedgerJob",
+    ["job_id", "dataset", "units", "process_range", "process_batch", "progress", "classify", "deferred"],
+    defaults=(None, None, None, None)
+)
+
+_global_slots = threading.BoundedSemaphore(GLOBAL_MAX_WORKERS)
+
+def enqueue_units(job_id: str, dataset: str, units, classify=None):
+    """
+    Добавляет единицы работы (domain, start_date, end_date) в задание job_id с приоритетом и весом
+    от classify. Уже существующие единицы (повторный запуск того же задания) не меняются.
+    Возвращает число новых единиц.
+    """
+    rows = []
+    for domain, start_date, end_date in units:
+        priority, weight = classify(domain, start_date, end_date) if classify else (PRIORITY_REPAIR, 0.0)
+        rows.append({
+            "job_id": job_id,
+            "dataset": dataset,
+            "domain": domain,
+            "start_date": start_date,
+            "end_date": end_date,
+            "status": "pending",
+            "priority": priority,
+            "weight": weight,
+            "attempts": 0,
+            "rows": 0
+        })
+    if not rows:
+        return 0
+    inserted = 0
+    db = SessionLocal()
+    try:
+        for chunk_start in range(0, len(rows), 1000):
+            stmt = insert(IngestUnit.__table__).values(rows[chunk_start:chunk_start + 1000])
+            stmt = stmt.on_conflict_do_nothing(index_elements=["job_id", "domain", "start_date", "end_date"])
+            inserted += db.execute(stmt).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+    return inserted
+
+def claim_units(job_ids, limit: int = 1, single_day: bool = None, priority: int = None, since=None, covered: list = None):
+    """
+    Забирает до limit единиц работы заданий job_ids (одно задание или список): новые, упавшие
+    (если попытки не исчерпаны) и брошенные – по классу приоритета, затем по весу домена.
+    Единицы, пересекающиеся с арендованными (running) единицами других заданий, не забираются.
+    single_day=True – только однодневные (для пакетных запросов), False – только многодневные;
+    priority – только единицы этого класса.
+    Если передан since (время начала задания, job_start), забранные единицы, все дни которых другие задания
+    загрузили не раньше since, сразу отмечаются выполненными и добавляются в covered, а не возвращаются.
+    """
+    if isinstance(job_ids, str):
+        job_ids = [job_ids]
+    if single_day is None:
+        day_filter = ""
+    elif single_day:
+        day_filter = "AND start_date = end_date"
+    else:
+        day_filter = "AND start_date <> end_date"
+    priority_filter = "" if priority is None else "AND priority = :priority"
+    query = text(f"""
+        WITH claimable AS (
+            SELECT id FROM ingest_units u
+            WHERE job_id = ANY(:job_ids)
+              AND (status = 'pending'
+                   OR (status = 'failed' AND attempts < :max_attempts)
+                   OR (status = 'running' AND claimed_at < now() - make_interval(mins => :stale_minutes)))
+              {day_filter}
+              {priority_filter}
+              AND NOT EXISTS (
+                  SELECT 1 FROM ingest_units o
+                  WHERE o.status = 'running' AND o.claimed_at >= now() - make_interval(mins => :stale_minutes)
+                    AND {overlap_condition("u", "o")}
+              )
+            ORDER BY priority, weight DESC, id
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE ingest_units u
+        SET status = 'running', attempts = u.attempts + 1, worker = :worker, claimed_at = now()
+        FROM claimable
+        WHERE u.id = claimable.id
+        RETURNING u.id, u.domain, u.start_date, u.end_date, u.job_id, u.priority
+    """)
+    db = SessionLocal()
+    try:
+        # Проверка чужих аренд и взятие своей – атомарно для всех процессов
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CLAIM_LOCK})
+        claimed = db.execute(query, {
+            "job_ids": list(job_ids),
+            "priority": priority,
+            "max_attempts": MAX_ATTEMPTS,
+            "stale_minutes": STALE_CLAIM_MINUTES,
+            "limit": limit,
+            "worker": WORKER_ID
+        }).all()
+        done = []
+        if since is not None and claimed:
+            done = db.execute(text(f"""
+                UPDATE ingest_units u
+                SET status = 'done', rows = 0, duration = 0, last_error = NULL,
+                    finished_at = (
+                        SELECT min(o.finished_at) FROM ingest_units o
+                        WHERE o.status = 'done' AND o.finished_at >= :since
+                          AND o.start_date <= u.end_date AND o.end_date >= u.start_date AND {cover_condition("u", "o")}
+                    )
+                WHERE u.id = ANY(:ids) AND NOT EXISTS (
+                    SELECT 1 FROM generate_series(u.start_date, u.end_date, interval '1 day') AS g(day)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM ingest_units o
+                        WHERE o.status = 'done' AND o.finished_at >= :since
+                          AND g.day::date BETWEEN o.start_date AND o.end_date AND {cover_condition("u", "o")}
+                    )
+                )
+                RETURNING u.id, u.domain, u.start_date, u.end_date, u.job_id, u.priority
+            """), {"ids": [row[0] for row in claimed], "since": since}).all()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+    if done:
+        logger.info(f"{len(done)} units already loaded by other jobs, not fetching them again")
+        if covered is not None:
+            covered.extend(ClaimedUnit(*row) for row in done)
+    done_ids = {row[0] for row in done}
+    # UPDATE ... RETURNING не сохраняет порядок подзапроса
+    return sorted((ClaimedUnit(*row) for row in claimed if row[0] not in done_ids), key=lambda unit: (unit.priority, unit.id))
+
+def job_start():
+    """Время начала задания по часам БД (since для claim_units)."""
+    db = SessionLocal()
+    try:
+        return db.execute(text("SELECT localtimestamp")).scalar()
+    finally:
+        db.close()
+
+def waiting_units(job_ids):
+    """
+    (число невыполненных единиц заданий job_ids, которые еще можно забрать, {задания, чьи аренды их держат}).
+    Если единиц нет – задания выполнены; если есть, но все заняты чужими арендами, их нужно подождать.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.execute(text(f"""
+            SELECT (
+                SELECT o.job_id FROM ingest_units o
+                WHERE o.status = 'running' AND o.claimed_at >= now() - make_interval(mins => :stale_minutes)
+                  AND {overlap_condition("u", "o")}
+                LIMIT 1
+            )
+            FROM ingest_units u
+            WHERE u.job_id = ANY(:job_ids)
+              AND (u.status = 'pending'
+                   OR (u.status = 'failed' AND u.attempts < :max_attempts)
+                   OR (u.status = 'running' AND u.claimed_at < now() - make_interval(mins => :stale_minutes)))
+        """), {"job_ids": list(job_ids), "max_attempts": MAX_ATTEMPTS, "stale_minutes": STALE_CLAIM_MINUTES}).all()
+    finally:
+        db.close()
+    return len(rows), {holder for holder, in rows if holder}
+
+def _holder_notifier(job_ids, attached=None):
+    """
+    Функция notify(holders) для ожидающих исполнителей: не чаще раза в LEASE_POLL_SECONDS пишет в лог,
+    чьих аренд ждут задания, и вызывает attached(holder, progress) для каждого владельца.
+    """
+    lock = threading.Lock()
+    last = [0.0]
+
+    def notify(holders):
+        with lock:
+            if time.time() - last[0] < LEASE_POLL_SECONDS:
+                return
+            last[0] = time.time()
+        logger.info(f"Jobs {', '.join(job_ids)}: waiting for units leased by {', '.join(sorted(holders)) or '?'}")
+        for holder in sorted(holders) if attached else ():
+            attached({"job_id": holder}, job_progress(holder))
+
+    return notify
+
+def finish_unit(unit_id: int, rows: int = 0, duration: float = None, error: Exception = None):
+    """Отмечает единицу работы выполненной (done) или упавшей (failed, с текстом ошибки)."""
+    db = SessionLocal()
+    try:
+        db.execute(text("""
+            UPDATE ingest_units
+            SET status = :status, rows = :rows, duration = :duration, finished_at = now(), last_error = :error
+            WHERE id = :id
+        """), {
+            "id": unit_id,
+            "status": "failed" if error is not None else "done",
+            "rows": rows or 0,
+            "duration": duration,
+            "error": str(error)[:2000] if error is not None else None
+        })
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error updating ingest unit {unit_id}: {e}")
+    finally:
+        db.close()
+
+def finish_units(completed):
+    """
+    Отмечает выполненными единицы, завершение которых было отложено (deferred в run_ledger_job):
+    completed – список (unit_id, rows, duration).
+    """
+    for unit_id, rows, duration in completed:
+        finish_unit(unit_id, rows, duration)
+
+def heartbeat_units(job_id: str):
+    """Продлевает claimed_at единиц задания, которые выполняет этот процесс, чтобы их не забрали как брошенные."""
+    db = SessionLocal()
+    try:
+        db.execute(text("""
+            UPDATE ingest_units SET claimed_at = now()
+            WHERE job_id = :job_id AND worker = :worker AND status = 'running'
+        """), {"job_id": job_id, "worker": WORKER_ID})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error updating heartbeat for job {job_id}: {e}")
+    finally:
+        db.close()
+
+def _start_heartbeat(job_id: str):
+    """Запускает поток heartbeat_units; возвращает Event для его остановки."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_SECONDS):
+            heartbeat_units(job_id)
+
+    threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True).start()
+    return stop
+
+@contextmanager
+def hold_units(job_id: str):
+    """
+    Держит аренды единиц задания, выполненных этим процессом, но еще не отмеченных (deferred в run_ledger_job):
+    heartbeat продолжается до выхода из блока, поэтому другие задания не забирают те же данные до фиксации
+    (merge в режиме --bulk) и finish_units. Если процесс упадет внутри блока, аренды истекут как брошенные.
+    """
+    stop = _start_heartbeat(job_id)
+    try:
+        yield
+    finally:
+        stop.set()
+
+def job_progress(job_id: str):
+    """
+    Сводка по заданию: число единиц в каждом состоянии, записанные строки и суммарное время.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.execute(text("""
+            SELECT status, count(*), coalesce(sum(rows), 0), coalesce(sum(duration), 0)
+            FROM ingest_units WHERE job_id = :job_id GROUP BY status
+        """), {"job_id": job_id}).all()
+    finally:
+        db.close()
+    progress = {"pending": 0, "running": 0, "done": 0, "failed": 0, "rows": 0, "duration": 0.0}
+    for status, count, row_count, duration in rows:
+        progress[status] = count
+        progress["rows"] += row_count
+        progress["duration"] += duration
+    progress["total"] = progress["pending"] + progress["running"] + progress["done"] + progress["failed"]
+    return progress
+
+def queue_depth(job_ids=None):
+    """
+    Глубина очереди по классам приоритета: {"fresh": {"pending": n, "running": n, "failed": n}, ...}.
+    failed – упавшие единицы, которые еще будут повторены. job_ids=None – по всем заданиям.
+    """
+    job_filter = "" if job_ids is None else "AND job_id = ANY(:job_ids)"
+    db = SessionLocal()
+    try:
+        rows = db.execute(text(f"""
+            SELECT priority, status, count(*) FROM ingest_units
+            WHERE (status IN ('pending', 'running') OR (status = 'failed' AND attempts < :max_attempts))
+              {job_filter}
+            GROUP BY priority, status
+        """), {"job_ids": list(job_ids or []), "max_attempts": MAX_ATTEMPTS}).all()
+    finally:
+        db.close()
+    depth = {name: {"pending": 0, "running": 0, "failed": 0} for name in PRIORITY_NAMES.values()}
+    for priority, status, count in rows:
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        depth.setdefault(name, {"pending": 0, "running": 0, "failed": 0})[status] = count
+    return depth
+
+def run_ledger_job(job_id: str, dataset: str, units, process_range, process_batch=None,
+                   workers: int = MAX_WORKERS, progress=None, desc: str = None, deferred: list = None,
+                   attached=None, classify=None):
+    """
+    Регистрирует units в журнале и выполняет все невыполненные единицы задания в пуле потоков.
+    process_range(domain, start_date, end_date) -> число записанных строк;
+    process_batch(pairs) -> {(domain, date): число строк или исключение} – для однодневных единиц
+    (пакетный HTTP-запрос). progress(unit, rows, error) вызывается после каждой единицы.
+    Если передан список deferred, успешные единицы не отмечаются выполненными, а добавляются в него
+    (unit_id, rows, duration): вызывающий код отмечает их через finish_units после фиксации данных
+    (например, после merge в режиме --bulk), иначе после падения они будут взяты заново как брошенные;
+    до этого они остаются арендованными, и весь вызов вместе с фиксацией оборачивается в hold_units(job_id).
+    Единицы, пересекающиеся с выполняемыми единицами других заданий, ждут их завершения
+    (attached(holder, progress) сообщает о прогрессе владельца) и загружаются, только если те
+    не загрузили все их дни.
+    Возвращает job_progress(job_id).
+    """
+    job = LedgerJob(job_id, dataset, units, process_range, process_batch, progress, classify, deferred)
+    return run_ledger_jobs([job], workers=workers, desc=desc, attached=attached)[job_id]
+
+def run_ledger_jobs(jobs, workers: int = MAX_WORKERS, desc: str = None, attached=None):
+    """
+    Выполняет несколько заданий (LedgerJob) одним пулом потоков с общей очередью: каждый поток забирает
+    следующую единицу любого из заданий по классу приоритета и весу домена, поэтому свежие дни всех
+    доменов не ждут глубокой истории одного. Однодневные единицы задания с process_batch дополняются
+    до пакета единицами того же задания и класса. Пока оставшиеся единицы заняты арендами других
+    заданий, потоки ждут их (attached – как в run_ledger_job). Возвращает {job_id: job_progress}.
+    """
+    jobs_by_id = {job.job_id: job for job in jobs}
+    since = job_start()
+    todo = 0
+    for job in jobs:
+        added = enqueue_units(job.job_id, job.dataset, job.units, job.classify)
+        before = job_progress(job.job_id)
+        job_todo = before["pending"] + before["running"] + before["failed"]
+        todo += job_todo
+        if before["done"]:
+            logger.info(f"Job {job.job_id}: resuming, {before['done']} of {before['total']} units already done")
+        logger.info(f"Job {job.job_id}: {added} new units, {job_todo} to process")
+    logger.info(f"Queue depth: {queue_depth(list(jobs_by_id))}")
+
+    bar = tqdm(total=todo, desc=desc or ", ".join(jobs_by_id), unit="unit")
+    bar_lock = threading.Lock()
+
+    def record(unit, rows, error, duration):
+        job = jobs_by_id[unit.job_id]
+        if error is None and job.deferred is not None:
+            job.deferred.append((unit.id, rows, duration))
+        else:
+            finish_unit(unit.id, rows, duration, error)
+        if error is not None:
+            logger.error(f"Job {unit.job_id}: error processing {unit.domain} ({unit.start_date} - {unit.end_date}): {error}")
+        if job.progress:
+            job.progress(unit, rows, error)
+        with bar_lock:
+            bar.update(1)
+
+    def record_covered(covered):
+        for unit in covered:
+            job = jobs_by_id[unit.job_id]
+            if job.progress:
+                job.progress(unit, 0, None)
+            with bar_lock:
+                bar.update(1)
+
+    notify = _holder_notifier(list(jobs_by_id), attached)
+
+    def run_batch(job, claimed):
+        started = time.time()
+        try:
+            results = job.process_batch([(unit.domain, unit.start_date) for unit in claimed])
+        except Exception as e:
+            results = {(unit.domain, unit.start_date): e for unit in claimed}
+        duration = time.time() - started
+        for unit in claimed:
+            result = results.get((unit.domain, unit.start_date), 0)
+            if isinstance(result, Exception):
+                record(unit, 0, result, duration)
+            else:
+                record(unit, result, None, duration)
+
+    def run_range(job, unit):
+        started = time.time()
+        try:
+            rows = job.process_range(unit.domain, unit.start_date, unit.end_date)
+            record(unit, rows, None, time.time() - started)
+        except Exception as e:
+            record(unit, 0, e, time.time() - started)
+
+    def worker():
+        while True:
+            # Слот берется до claim: единица не числится running, пока ждет свободного слота
+            with _global_slots:
+                covered = []
+                claimed = claim_units(list(jobs_by_id), 1, since=since, covered=covered)
+                if claimed:
+                    unit = claimed[0]
+                    job = jobs_by_id[unit.job_id]
+                    if job.process_batch and unit.start_date == unit.end_date:
+                        batch = [unit] + claim_units(unit.job_id, BATCH_SIZE - 1, single_day=True, priority=unit.priority,
+                                                     since=since, covered=covered)
+                        run_batch(job, batch)
+                    else:
+                        run_range(job, unit)
+                record_covered(covered)
+                if claimed or covered:
+                    continue
+            # Забрать нечего: либо все выполнено, либо оставшиеся единицы заняты чужими арендами – ждем вне слота
+            remaining, holders = waiting_units(list(jobs_by_id))
+            if not remaining:
+                return
+            notify(holders)
+            time.sleep(LEASE_POLL_SECONDS)
+
+    heartbeats = [_start_heartbeat(job_id) for job_id in jobs_by_id]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(worker) for _ in range(workers)]:
+                future.result()
+    finally:
+        for heartbeat in heartbeats:
+            heartbeat.set()
+        bar.close()
+
+    results = {}
+    for job_id in jobs_by_id:
+        results[job_id] = job_progress(job_id)
+        logger.info(f"Job {job_id}: {results[job_id]['done']} done, {results[job_id]['failed']} failed, {results[job_id]['rows']} rows")
+    return results
+
+def run_ledger_job_async(job_id: str, dataset: str, units, save, fetch_dataset: str = None, progress=None,
+                         desc: str = None, deferred: list = None, attached=None, classify=None):
+    """
+    Вариант run_ledger_job для асинхронного клиента: невыполненные единицы задания забираются порциями
+    по ASYNC_CLAIM_CHUNK и загружаются gsc_async_client.run_ingest_units (запросом fetch_dataset: "domain" или "country",
+    по умолчанию – dataset). save(domain, start_date, end_date, result) -> число строк.
+    deferred, attached и classify – как в run_ledger_job; задачи передаются клиенту в порядке приоритета.
+    """
+    from gsc_async_client import run_ingest_units
+
+    since = job_start()
+    enqueue_units(job_id, dataset, units, classify)
+    notify = _holder_notifier([job_id], attached)
+    heartbeat = _start_heartbeat(job_id)
+    try:
+        while True:
+            covered = []
+            claimed = claim_units(job_id, limit=ASYNC_CLAIM_CHUNK, since=since, covered=covered)
+            for unit in covered if progress else ():
+                progress(unit, 0, None)
+            if claimed:
+                _run_async_chunk(run_ingest_units, claimed, save, fetch_dataset or dataset, progress, desc or job_id, deferred)
+            if claimed or covered:
+                continue
+            remaining, holders = waiting_units([job_id])
+            if not remaining:
+                break
+            notify(holders)
+            time.sleep(LEASE_POLL_SECONDS)
+    finally:
+        heartbeat.set()
+
+    result = job_progress(job_id)
+    logger.info(f"Job {job_id}: {result['done']} done, {result['failed']} failed, {result['rows']} rows")
+    return result
+
+def _run_async_chunk(run_ingest_units, claimed, save, fetch_dataset, progress, desc, deferred):
+    """Загружает одну порцию забранных единиц; время единицы считается от начала ее запроса к GSC."""
+    by_unit = {(unit.domain, unit.start_date, unit.end_date): unit for unit in claimed}
+    started = {}
+
+    def start(domain, start_date, end_date):
+        started[(domain, start_date, end_date)] = time.time()
+
+    def save_and_finish(domain, start_date, end_date, result):
+        key = (domain, start_date, end_date)
+        unit = by_unit[key]
+        rows = save(domain, start_date, end_date, result)
+        duration = time.time() - started[key]
+        if deferred is not None:
+            deferred.append((unit.id, rows, duration))
+        else:
+            finish_unit(unit.id, rows, duration)
+        if progress:
+            progress(unit, rows, None)
+
+    _, failures = run_ingest_units(list(by_unit), fetch_dataset, save_and_finish, desc=desc, started=start)
+    for key, error in failures:
+        unit = by_unit[key]
+        finish_unit(unit.id, 0, time.time() - started[key] if key in started else None, error)
+        if progress:
+            progress(unit, 0, error)
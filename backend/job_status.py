@@ -0,0 +1,143 @@
+# job_status.py
+"""
+Общее хранилище статуса заданий загрузки: Redis, если server_cache.REDIS_AVAILABLE, иначе таблица
+job_statuses в основной БД. Статус виден всем процессам uvicorn, а не только тому, который ведет загрузку.
+status_delta вычисляет изменения между двумя статусами для потока /api/update_status/stream,
+StatusFeed – один опрос хранилища на процесс для всех клиентов этого потока.
+"""
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+import logging
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal
+from models import JobStatus
+from server_cache import REDIS_AVAILABLE, redis_client
+
+logger = logging.getLogger("gsc_stats")
+
+STATUS_KEY_PREFIX = "job_status:"
+# Статус в Redis хранится неделю после последнего обновления
+STATUS_TTL = 7 * 86400
+
+def save_status(name: str, status: dict):
+    """Сохраняет статус задания name. Ошибки хранилища логируются и не прерывают загрузку."""
+    data = json.dumps(status, default=str)
+    if REDIS_AVAILABLE:
+        try:
+            redis_client.setex(STATUS_KEY_PREFIX + name, STATUS_TTL, data)
+            return
+        except Exception as e:
+            logger.error(f"Error saving job status {name} to Redis: {e}")
+    db = SessionLocal()
+    try:
+        stmt = insert(JobStatus.__table__).values(name=name, data=data, updated_at=datetime.utcnow())
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["name"],
+            set_={"data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at}
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error saving job status {name}: {e}")
+    finally:
+        db.close()
+
+def load_status(name: str):
+    """Статус задания name или None, если он еще не сохранялся."""
+    if REDIS_AVAILABLE:
+        try:
+            data = redis_client.get(STATUS_KEY_PREFIX + name)
+            if data:
+                return json.loads(data)
+        except Exception as e:
+            logger.error(f"Error loading job status {name} from Redis: {e}")
+    db = SessionLocal()
+    try:
+        row = db.query(JobStatus).filter(JobStatus.name == name).first()
+        return json.loads(row.data) if row else None
+    except Exception as e:
+        logger.error(f"Error loading job status {name}: {e}")
+        return None
+    finally:
+        db.close()
+
+def status_delta(previous: dict, current: dict):
+    """
+    Изменившиеся поля current относительно previous; для списка errors – только новые ошибки.
+    None – изменения нельзя выразить дельтой (первое событие или новый запуск), нужно отправить статус целиком.
+    """
+    if previous is None:
+        return None
+    previous_errors = previous.get("errors", [])
+    current_errors = current.get("errors", [])
+    if current_errors[:len(previous_errors)] != previous_errors:
+        return None
+    delta = {key: value for key, value in current.items() if key != "errors" and previous.get(key) != value}
+    if len(current_errors) > len(previous_errors):
+        delta["errors"] = current_errors[len(previous_errors):]
+    return delta
+
+class StatusFeed:
+    """
+    Общий опрос статуса для подписчиков потока: пока есть хотя бы один подписчик, фоновая задача раз
+    в interval секунд читает статус через load() (в потоке) и будит подписчиков, если он изменился.
+    Хранилище опрашивается один раз на процесс, а не на каждого клиента; без подписчиков задача завершается.
+    """
+
+    def __init__(self, load, interval: float):
+        self.load = load
+        self.interval = interval
+        self.current = None
+        self.version = 0
+        self.subscribers = 0
+        self.task = None
+        self.changed = asyncio.Condition()
+
+    async def _poll(self):
+        while self.subscribers:
+            try:
+                current = await asyncio.to_thread(self.load)
+            except Exception as e:
+                logger.error(f"Error polling job status: {e}")
+            else:
+                if current != self.current:
+                    async with self.changed:
+                        self.current = current
+                        self.version += 1
+                        self.changed.notify_all()
+            await asyncio.sleep(self.interval)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        """Подписка на время блока: next(timeout) – следующий статус или None, если за timeout он не изменился."""
+        self.subscribers += 1
+        if self.task is None or self.task.done():
+            # Статус, сохраненный до остановки опроса, мог устареть: подписчики ждут первого опроса
+            self.current = None
+            self.task = asyncio.create_task(self._poll())
+        try:
+            yield _StatusSubscription(self)
+        finally:
+            self.subscribers -= 1
+
+class _StatusSubscription:
+    def __init__(self, feed: StatusFeed):
+        self.feed = feed
+        self.seen = 0
+
+    async def next(self, timeout: float):
+        feed = self.feed
+        async with feed.changed:
+            try:
+                await asyncio.wait_for(
+                    feed.changed.wait_for(lambda: feed.current is not None and feed.version != self.seen), timeout
+                )
+            except asyncio.TimeoutError:
+                return None
+            self.seen = feed.version
+            return feed.current
@@ -1,20 +1,23 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.gzip import GZipMiddleware
 
-from database import engine, Base, SessionLocal
+from config import DOMAINS
+from database import engine, Base
 from models import DomainSummary, DomainError
 from schemas import DomainSummaryBase, DomainErrorBase, CountrySummaryBase
 from auth import get_current_username
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import date, timedelta
+import asyncio
 import json
 import logging
 import sys
 
 # Импорт для работы с серверным кэшированием
-from server_cache import cache_response, invalidate_cache, compress_response, decompress_response
+from server_cache import cache_response, invalidate_cache, compress_response
 
 # Настройка логирования
 logging.basicConfig(
@@ -28,18 +31,31 @@ logging.basicConfig(
 logger = logging.getLogger("gsc_stats")
 
 # Импорт для работы с базой данных стран
-from country_database import SessionLocal as CountrySessionLocal
 from country_models import CountrySummary
+from dimensions import domain_filter, country_filter
+from watermarks import read_watermarks, async_data_version
+from async_database import AsyncSessionLocal, CountryAsyncSessionLocal
+from connections import pool_metrics
 
 # Импортируем функции для получения данных из GSC
-from gsc_client import fetch_gsc_data_for_domain, fetch_country_data_for_domain
-from config import DOMAINS
+from gsc_client import get_retry_stats
+from migrations import run_migrations
+import update_worker
+from job_ledger import queue_depth
+from job_status import status_delta, StatusFeed
+from rollups import range_rows
 
 # Создаем таблицы в основной БД, если их ещё нет
 Base.metadata.create_all(bind=engine)
+# Ключи, индексы и колонки, добавленные после создания таблиц (версионные миграции)
+run_migrations()
 
 app = FastAPI(title="GSC Stats API")
 
+# Гранулярность ответа range-эндпоинтов: day (по умолчанию) – дневные строки для прежних клиентов;
+# auto – недельные и месячные сводки (rollups.py): их запрашивает фронтенд (services/api.js разворачивает их по дням)
+RANGE_GRANULARITY = Query("day", pattern="^(auto|day)$")
+
 # Настройка CORS - улучшенные настройки для решения проблем с запросами
 app.add_middleware(
     CORSMiddleware,
@@ -53,25 +69,20 @@ app.add_middleware(
 # Добавляем промежуточное ПО для сжатия ответов
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Эндпоинты чтения работают через асинхронные сессии (async_database.py): запросы не занимают потоки Starlette
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def country_get_db():
-    db = CountrySessionLocal()
-    try:
+async def country_get_db():
+    async with CountryAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @app.get("/api/summary", response_model=list[DomainSummaryBase])
-def get_summary(target_date: date, db: Session = Depends(get_db), username: str = Depends(get_current_username)):
+async def get_summary(target_date: date, db: AsyncSession = Depends(get_db), username: str = Depends(get_current_username)):
     """Получить сводку по всем доменам на указанную дату"""
     try:
-        summaries = db.query(DomainSummary).filter(DomainSummary.date == target_date).all()
+        summaries = (await db.scalars(select(DomainSummary).where(DomainSummary.date == target_date))).all()
         return summaries
     except Exception as e:
         # Логирование ошибки
@@ -79,13 +90,13 @@ def get_summary(target_date: date, db: Session = Depends(get_db), username: str
         return []
 
 @app.get("/api/domain/{domain_name}/summary")
-def get_domain_summary(domain_name: str, target_date: date, db: Session = Depends(get_db), username: str = Depends(get_current_username)):
+async def get_domain_summary(domain_name: str, target_date: date, db: AsyncSession = Depends(get_db), username: str = Depends(get_current_username)):
     """Получить сводку по указанному домену на указанную дату"""
     try:
-        summary = db.query(DomainSummary).filter(
-            DomainSummary.domain == domain_name,
+        summary = (await db.scalars(select(DomainSummary).where(
+            domain_filter(DomainSummary, domain_name),
             DomainSummary.date == target_date
-        ).first()
+        ).limit(1))).first()
         if not summary:
             # Вместо возврата ошибки возвращаем пустой объект с нулевыми значениями
             return {
@@ -115,13 +126,13 @@ def get_domain_summary(domain_name: str, target_date: date, db: Session = Depend
         }
 
 @app.get("/api/domain/{domain_name}/errors", response_model=list[DomainErrorBase])
-def get_domain_errors(domain_name: str, target_date: date, db: Session = Depends(get_db), username: str = Depends(get_current_username)):
+async def get_domain_errors(domain_name: str, target_date: date, db: AsyncSession = Depends(get_db), username: str = Depends(get_current_username)):
     """Получить ошибки для указанного домена на указанную дату"""
     try:
-        errors = db.query(DomainError).filter(
+        errors = (await db.scalars(select(DomainError).where(
             DomainError.domain == domain_name,
             DomainError.date == target_date
-        ).all()
+        ))).all()
         return errors
     except Exception as e:
         # Логирование ошибки
@@ -129,10 +140,10 @@ def get_domain_errors(domain_name: str, target_date: date, db: Session = Depends
         return []
 
 @app.get("/api/country_summary", response_model=list[CountrySummaryBase])
-def get_country_summary(target_date: date, db: Session = Depends(country_get_db), username: str = Depends(get_current_username)):
+async def get_country_summary(target_date: date, db: AsyncSession = Depends(country_get_db), username: str = Depends(get_current_username)):
     """Получить сводку по всем странам на указанную дату"""
     try:
-        summaries = db.query(CountrySummary).filter(CountrySummary.date == target_date).all()
+        summaries = (await db.scalars(select(CountrySummary).where(CountrySummary.date == target_date))).all()
         return summaries
     except Exception as e:
         # Логирование ошибки
@@ -140,13 +151,13 @@ def get_country_summary(target_date: date, db: Session = Depends(country_get_db)
         return []
 
 @app.get("/api/country/{country}/summary", response_model=list[CountrySummaryBase])
-def get_country_domain_summary(country: str, target_date: date, db: Session = Depends(country_get_db), username: str = Depends(get_current_username)):
+async def get_country_domain_summary(country: str, target_date: date, db: AsyncSession = Depends(country_get_db), username: str = Depends(get_current_username)):
     """Получить сводку по всем доменам для указанной страны на указанную дату"""
     try:
-        summaries = db.query(CountrySummary).filter(
-            CountrySummary.country == country,
+        summaries = (await db.scalars(select(CountrySummary).where(
+            country_filter(CountrySummary, country),
             CountrySummary.date == target_date
-        ).all()
+        ))).all()
         return summaries
     except Exception as e:
         # Логирование ошибки
@@ -154,40 +165,29 @@ def get_country_domain_summary(country: str, target_date: date, db: Session = De
         return []
 
 @app.get("/api/domain/{domain_name}/last_dates")
-def get_domain_last_dates(domain_name: str, db: Session = Depends(get_db), username: str = Depends(get_current_username)):
+async def get_domain_last_dates(domain_name: str, db: AsyncSession = Depends(get_db), username: str = Depends(get_current_username)):
     """Получает две последние даты, для которых есть данные для указанного домена"""
     try:
-        # Находим две последние даты с данными для домена
-        last_dates = db.query(DomainSummary.date)\
-            .filter(DomainSummary.domain == domain_name)\
-            .order_by(DomainSummary.date.desc())\
-            .limit(2)\
-            .all()
-        
-        if not last_dates:
-            return {"last_date": None, "second_last_date": None}
-        
-        result = {
-            "last_date": last_dates[0][0].isoformat() if last_dates and len(last_dates) > 0 else None,
-            "second_last_date": last_dates[1][0].isoformat() if last_dates and len(last_dates) > 1 else None
+        # Две последние даты домена хранятся в ingest_watermarks (watermarks.py)
+        last_date, second_last_date = (await db.run_sync(read_watermarks)).get(domain_name, (None, None))
+        return {
+            "last_date": last_date.isoformat() if last_date else None,
+            "second_last_date": second_last_date.isoformat() if second_last_date else None
         }
-        return result
     except Exception as e:
         logger.error(f"Error in get_domain_last_dates for {domain_name}: {e}")
         return {"last_date": None, "second_last_date": None}
 
 @app.get("/api/all_domains_last_dates")
-def get_all_domains_last_dates(db: Session = Depends(get_db), username: str = Depends(get_current_username)):
+async def get_all_domains_last_dates(db: AsyncSession = Depends(get_db), username: str = Depends(get_current_username)):
     """Получает последние даты с данными для всех доменов"""
     try:
-        # Для каждого домена находим последнюю дату
+        # Последние даты всех доменов – одним запросом к ingest_watermarks
+        watermarks = await db.run_sync(read_watermarks)
         result = {}
         for domain in DOMAINS:
-            last_date = db.query(DomainSummary.date)\
-                .filter(DomainSummary.domain == domain)\
-                .order_by(DomainSummary.date.desc())\
-                .first()
-            result[domain] = last_date[0].isoformat() if last_date else None
+            last_date = watermarks.get(domain, (None, None))[0]
+            result[domain] = last_date.isoformat() if last_date else None
         
         # Определяем общую последнюю дату (минимальную из всех последних)
         all_dates = [date for date in result.values() if date]
@@ -208,13 +208,19 @@ def get_all_domains_last_dates(db: Session = Depends(get_db), username: str = De
         return {"error": str(e)}
 
 @app.get("/api/summary_range")
-def get_summary_range(start_date: date, end_date: date, db: Session = Depends(get_db), username: str = Depends(get_current_username)):
-    """Получить сводку по всем доменам за указанный диапазон дат с помощью одного запроса"""
+async def get_summary_range(start_date: date, end_date: date, granularity: str = RANGE_GRANULARITY, db: AsyncSession = Depends(get_db), username: str = Depends(get_current_username)):
+    """
+    Получить сводку по всем доменам за указанный диапазон дат с помощью одного запроса.
+    По умолчанию (granularity=day) – дневные строки. С granularity=auto полные месяцы и недели диапазона отдаются
+    одной строкой сводки (date – начало периода, end_date – конец, granularity), остальные дни – дневными строками.
+    """
     try:
-        summaries = db.query(DomainSummary).filter(
+        if granularity == "auto":
+            return await db.run_sync(range_rows, DomainSummary.__tablename__, start_date, end_date)
+        summaries = (await db.scalars(select(DomainSummary).where(
             DomainSummary.date >= start_date,
             DomainSummary.date <= end_date
-        ).all()
+        ))).all()
         return summaries
     except Exception as e:
         logger.error(f"Error in get_summary_range from {start_date} to {end_date}: {e}")
@@ -222,14 +228,16 @@ def get_summary_range(start_date: date, end_date: date, db: Session = Depends(ge
 
 # Новые маршруты для оптимизации запросов - ИСПОЛЬЗУЙТЕ ИХ ВМЕСТО ПОШТУЧНЫХ ЗАПРОСОВ!
 @app.get("/api/domain_range_summary")
-def get_domain_range_summary(domain_name: str, start_date: date, end_date: date, db: Session = Depends(get_db), username: str = Depends(get_current_username)):
-    """Получить сводку по указанному домену за диапазон дат в одном запросе"""
+async def get_domain_range_summary(domain_name: str, start_date: date, end_date: date, granularity: str = RANGE_GRANULARITY, db: AsyncSession = Depends(get_db), username: str = Depends(get_current_username)):
+    """Получить сводку по указанному домену за диапазон дат в одном запросе (granularity – как в /api/summary_range)"""
     try:
-        summaries = db.query(DomainSummary).filter(
-            DomainSummary.domain == domain_name,
+        if granularity == "auto":
+            return await db.run_sync(range_rows, DomainSummary.__tablename__, start_date, end_date, domain=domain_name)
+        summaries = (await db.scalars(select(DomainSummary).where(
+            domain_filter(DomainSummary, domain_name),
             DomainSummary.date >= start_date,
             DomainSummary.date <= end_date
-        ).all()
+        ))).all()
         return summaries
     except Exception as e:
         # Логирование ошибки
@@ -238,14 +246,18 @@ def get_domain_range_summary(domain_name: str, start_date: date, end_date: date,
 
 # Обновлённый маршрут получения данных по странам с кэшированием и сжатием ответа
 @app.get("/api/country_range_summary")
-@cache_response(prefix="country_range", ttl=86400)  # кэшируем на 24 часа
-async def get_country_range_summary(start_date: date, end_date: date, db: Session = Depends(country_get_db), username: str = Depends(get_current_username)):
-    """Получить сводку по всем странам за диапазон дат в одном запросе с кэшированием"""
+# кэшируем на 24 часа; ключ включает версию данных стран – после загрузки ответ строится заново
+@cache_response(prefix="country_range", ttl=86400, version=lambda: async_data_version(CountryAsyncSessionLocal, "country"))
+async def get_country_range_summary(start_date: date, end_date: date, granularity: str = RANGE_GRANULARITY, db: AsyncSession = Depends(country_get_db), username: str = Depends(get_current_username)):
+    """Получить сводку по всем странам за диапазон дат в одном запросе с кэшированием (granularity – как в /api/summary_range)"""
     try:
-        summaries = db.query(CountrySummary).filter(
+        if granularity == "auto":
+            # Строки-словари отдаются списком: compress_response превратил бы их в {keys, values}
+            return await db.run_sync(range_rows, CountrySummary.__tablename__, start_date, end_date)
+        summaries = (await db.scalars(select(CountrySummary).where(
             CountrySummary.date >= start_date,
             CountrySummary.date <= end_date
-        ).all()
+        ))).all()
         
         # Сжимаем ответ для уменьшения объема данных
         return compress_response(summaries)
@@ -254,312 +266,81 @@ async def get_country_range_summary(start_date: date, end_date: date, db: Sessio
         logger.error(f"Error in get_country_range_summary from {start_date} to {end_date}: {e}")
         return []
 
-# Глобальный объект для хранения статуса обновления
-update_status = {
-    "domains_total": len(DOMAINS),
-    "domains_processed": 0,
-    "current_domain": "",
-    "current_date": "",
-    "status": "idle",
-    "errors": [],
-    "progress": 0
-}
-
 # Обновлённый маршрут для обновления данных с инвалидированием кэша
 @app.post("/api/update_data")
-async def update_database_data(request: Request, background_tasks: BackgroundTasks, username: str = Depends(get_current_username)):
-    """Эндпоинт для обновления данных в базе данных."""
-    global update_status
+async def update_database_data(request: Request, username: str = Depends(get_current_username)):
+    """
+    Эндпоинт для обновления данных в базе данных. Загрузка выполняется исполнителем update_worker
+    вне event loop; эндпоинт только ставит ее в очередь.
+    """
+    started, status = update_worker.start_update()
 
     # Если уже идет обновление, возвращаем текущий статус
-    if update_status["status"] == "running" or update_status["status"] == "updating_countries":
+    if not started:
         return {
-            "status": update_status["status"],
-            "progress": update_status["progress"],
-            "message": f"Update already in progress. Processing {update_status['current_domain']}"
+            "status": status["status"],
+            "progress": status["progress"],
+            "message": f"Update already in progress. Processing {status['current_domain']}"
         }
 
-    # Сбрасываем статус
-    update_status = {
-        "domains_total": len(DOMAINS),
-        "domains_processed": 0,
-        "current_domain": "",
-        "current_date": "",
-        "status": "running",
-        "errors": [],
-        "progress": 0
-    }
-    
     # Инвалидация кэша при обновлении данных
     invalidate_cache("country_range:*")
     invalidate_cache("api:get_country_range_summary:*")
 
-    # Функция для обновления данных в фоне
-    async def update_data_background():
-        global update_status
-        try:
-            # Получаем максимальную доступную дату (вчера)
-            yesterday = date.today() - timedelta(days=2)  # Берем позавчерашний день для гарантии наличия данных
-            logger.info(f"Starting update from earliest missing date up to {yesterday}")
-
-            for i, domain in enumerate(DOMAINS):
-                try:
-                    update_status["current_domain"] = domain
-
-                    # Получаем последнюю дату с данными для домена
-                    db_local = SessionLocal()
-                    try:
-                        last_dates = db_local.query(DomainSummary.date)\
-                            .filter(DomainSummary.domain == domain)\
-                            .order_by(DomainSummary.date.desc())\
-                            .first()
-                    finally:
-                        db_local.close()
-
-                    # Определяем начальную дату для обновления
-                    start_date_update = None
-                    if last_dates and last_dates[0]:
-                        # Начинаем со следующего дня после последней даты
-                        last_date = last_dates[0]
-                        start_date_update = last_date + timedelta(days=1)
-                        logger.info(f"For domain {domain}, last date in DB is {last_date}, starting from {start_date_update}")
-                    else:
-                        # Если нет данных, начинаем с 1 января 2024
-                        start_date_update = date(2024, 1, 1)
-                        logger.info(f"No data found for domain {domain}, starting from 2024-01-01")
-
-                    # Если начальная дата больше вчера, то нечего обновлять
-                    if start_date_update > yesterday:
-                        logger.info(f"Domain {domain} is up to date (last date: {start_date_update - timedelta(days=1)})")
-                        update_status["domains_processed"] += 1
-                        update_status["progress"] = round((update_status["domains_processed"] / update_status["domains_total"]) * 100)
-                        continue
-
-                    # Запрашиваем данные для дат от start_date_update до вчера
-                    for current_date in daterange(start_date_update, yesterday):
-                        update_status["current_date"] = current_date.isoformat()
-                        logger.info(f"Processing {domain} for date {current_date}")
-
-                        try:
-                            # Получаем данные из GSC
-                            data = fetch_gsc_data_for_domain(domain, current_date)
-
-                            # Если данных нет, пропускаем эту дату
-                            if data is None:
-                                logger.info(f"Skipping {domain} on {current_date} - no data available")
-                                continue
-
-                            # Проверяем, есть ли в данных ненулевые значения
-                            has_data = (
-                                data.get("traffic_clicks", 0) > 0 or 
-                                data.get("impressions", 0) > 0 or 
-                                data.get("ctr", 0.0) > 0 or 
-                                data.get("avg_position", 0.0) > 0
-                            )
-
-                            if not has_data:
-                                logger.info(f"Skipping {domain} on {current_date} - all metrics are zero")
-                                continue
-
-                            # Сохраняем данные в БД
-                            db_local = SessionLocal()
-                            try:
-                                # Проверяем, есть ли уже запись для этой даты и домена
-                                existing = db_local.query(DomainSummary).filter(
-                                    DomainSummary.domain == domain,
-                                    DomainSummary.date == current_date
-                                ).first()
-
-                                if existing:
-                                    # Обновляем существующую запись
-                                    existing.traffic_clicks = data.get("traffic_clicks", 0)
-                                    existing.impressions = data.get("impressions", 0)
-                                    existing.ctr = data.get("ctr", 0.0)
-                                    existing.avg_position = data.get("avg_position", 0.0)
-                                    existing.pages_indexed = data.get("pages_indexed", 0)
-                                    existing.pages_not_indexed = data.get("pages_not_indexed", 0)
-                                    logger.info(f"Updated existing data for {domain} on {current_date}")
-                                else:
-                                    # Создаем новую запись
-                                    summary = DomainSummary(
-                                        domain=domain,
-                                        date=current_date,
-                                        traffic_clicks=data.get("traffic_clicks", 0),
-                                        impressions=data.get("impressions", 0),
-                                        ctr=data.get("ctr", 0.0),
-                                        avg_position=data.get("avg_position", 0.0),
-                                        pages_indexed=data.get("pages_indexed", 0),
-                                        pages_not_indexed=data.get("pages_not_indexed", 0)
-                                    )
-                                    db_local.add(summary)
-                                    logger.info(f"Created new record for {domain} on {current_date}")
-
-                                # Сохраняем ошибки, если они есть
-                                errors = data.get("errors", {})
-                                for error_type, count in errors.items():
-                                    # Проверяем, есть ли уже запись для этой ошибки
-                                    existing_error = db_local.query(DomainError).filter(
-                                        DomainError.domain == domain,
-                                        DomainError.date == current_date,
-                                        DomainError.error_type == error_type
-                                    ).first()
-
-                                    if existing_error:
-                                        existing_error.count = count
-                                    else:
-                                        domain_error = DomainError(
-                                            domain=domain,
-                                            date=current_date,
-                                            error_type=error_type,
-                                            count=count
-                                        )
-                                        db_local.add(domain_error)
-
-                                db_local.commit()
-                                logger.info(f"Data saved for {domain} on {current_date}")
-                            except Exception as e:
-                                db_local.rollback()
-                                update_status["errors"].append(f"Error processing {domain} on {current_date}: {str(e)}")
-                                logger.error(f"Error processing {domain} on {current_date}: {e}")
-                            finally:
-                                db_local.close()
-                        except Exception as e:
-                            update_status["errors"].append(f"Error fetching data for {domain} on {current_date}: {str(e)}")
-                            logger.error(f"Error fetching data for {domain} on {current_date}: {e}")
-
-                    update_status["domains_processed"] += 1
-                    update_status["progress"] = round((update_status["domains_processed"] / update_status["domains_total"]) * 100)
-                    logger.info(f"Completed processing domain {domain}, progress: {update_status['progress']}%")
-                except Exception as e:
-                    update_status["errors"].append(f"Error processing domain {domain}: {str(e)}")
-                    logger.error(f"Error processing domain {domain}: {e}")
-                    update_status["domains_processed"] += 1
-                    update_status["progress"] = round((update_status["domains_processed"] / update_status["domains_total"]) * 100)
-
-            # Обновляем данные по странам
-            update_status["status"] = "updating_countries"
-            update_status["current_domain"] = "Countries"
-            update_status["domains_processed"] = 0
-            update_status["progress"] = 0
-            logger.info("Starting to update country data")
-
-            for i, domain in enumerate(DOMAINS):
-                try:
-                    update_status["current_domain"] = f"Country data for {domain}"
-
-                    # Получаем последние даты для домена
-                    db_local = CountrySessionLocal()
-                    try:
-                        last_dates = db_local.query(CountrySummary.date)\
-                            .filter(CountrySummary.domain == domain)\
-                            .order_by(CountrySummary.date.desc())\
-                            .limit(1)\
-                            .all()
-                    finally:
-                        db_local.close()
-
-                    # Определяем начальную дату для обновления
-                    start_date_update = None
-                    if last_dates and len(last_dates) > 0:
-                        # Начинаем со следующего дня после последней даты
-                        start_date_update = last_dates[0][0] + timedelta(days=1)
-                        logger.info(f"For country data, domain {domain}, last date in DB is {last_dates[0][0]}, starting from {start_date_update}")
-                    else:
-                        # Если нет данных, начинаем с 1 января 2024
-                        start_date_update = date(2024, 1, 1)
-                        logger.info(f"No country data found for domain {domain}, starting from 2024-01-01")
-
-                    # Если начальная дата больше вчера, то нечего обновлять
-                    if start_date_update > yesterday:
-                        logger.info(f"Country data for domain {domain} is up to date")
-                        update_status["domains_processed"] += 1
-                        update_status["progress"] = round((update_status["domains_processed"] / update_status["domains_total"]) * 100)
-                        continue
-
-                    # Запрашиваем данные для дат от start_date_update до вчера
-                    for current_date in daterange(start_date_update, yesterday):
-                        update_status["current_date"] = current_date.isoformat()
-                        logger.info(f"Processing country data for {domain} on date {current_date}")
-
-                        try:
-                            # Получаем данные по странам из GSC
-                            records = fetch_country_data_for_domain(domain, current_date)
-
-                            if not records or len(records) == 0:
-                                logger.info(f"No country data available for {domain} on {current_date}")
-                                continue
-
-                            logger.info(f"Received {len(records)} country records for {domain} on {current_date}")
-
-                            # Сохраняем данные в БД
-                            db_local = CountrySessionLocal()
-                            try:
-                                for record in records:
-                                    # Проверяем, есть ли уже запись для этой даты, домена и страны
-                                    existing = db_local.query(CountrySummary).filter(
-                                        CountrySummary.domain == record["domain"],
-                                        CountrySummary.date == record["date"],
-                                        CountrySummary.country == record["country"]
-                                    ).first()
-
-                                    if existing:
-                                        # Обновляем существующую запись
-                                        existing.traffic_clicks = record["traffic_clicks"]
-                                        existing.impressions = record["impressions"]
-                                        existing.ctr = record["ctr"]
-                                        existing.avg_position = record["avg_position"]
-                                    else:
-                                        # Создаем новую запись
-                                        summary = CountrySummary(
-                                            domain=record["domain"],
-                                            date=record["date"],
-                                            country=record["country"],
-                                            traffic_clicks=record["traffic_clicks"],
-                                            impressions=record["impressions"],
-                                            ctr=record["ctr"],
-                                            avg_position=record["avg_position"]
-                                        )
-                                        db_local.add(summary)
-
-                                db_local.commit()
-                                logger.info(f"Saved country data for {domain} on {current_date}")
-                            except Exception as e:
-                                db_local.rollback()
-                                update_status["errors"].append(f"Error saving country data for {domain} on {current_date}: {str(e)}")
-                                logger.error(f"Error saving country data for {domain} on {current_date}: {e}")
-                            finally:
-                                db_local.close()
-                        except Exception as e:
-                            update_status["errors"].append(f"Error fetching country data for {domain} on {current_date}: {str(e)}")
-                            logger.error(f"Error fetching country data for {domain} on {current_date}: {e}")
-
-                    update_status["domains_processed"] += 1
-                    update_status["progress"] = round((update_status["domains_processed"] / update_status["domains_total"]) * 100)
-                    logger.info(f"Completed processing country data for domain {domain}, progress: {update_status['progress']}%")
-                except Exception as e:
-                    update_status["errors"].append(f"Error processing country data for domain {domain}: {str(e)}")
-                    logger.error(f"Error processing country data for domain {domain}: {e}")
-                    update_status["domains_processed"] += 1
-                    update_status["progress"] = round((update_status["domains_processed"] / update_status["domains_total"]) * 100)
-
-            update_status["status"] = "completed"
-            logger.info("Data update process completed successfully")
-        except Exception as e:
-            update_status["status"] = "error"
-            update_status["errors"].append(f"Global error: {str(e)}")
-            logger.error(f"Global error during update: {e}")
-
-    # Запускаем задачу в фоне
-    background_tasks.add_task(update_data_background)
-
     # Возвращаем начальный статус
     return {"status": "started", "message": "Update process started in background"}
 
 @app.get("/api/update_status")
 async def get_update_status(username: str = Depends(get_current_username)):
     """Получить текущий статус обновления данных"""
-    global update_status
-    return update_status
+    return await asyncio.to_thread(update_worker.get_update_status)
+
+# Как часто поток статуса проверяет общее хранилище и как часто шлет keepalive без изменений (сек.)
+STATUS_STREAM_INTERVAL = 1
+STATUS_STREAM_KEEPALIVE = 15
+# Один опрос хранилища в процессе на всех клиентов потока
+status_feed = StatusFeed(update_worker.get_update_status, STATUS_STREAM_INTERVAL)
+
+@app.get("/api/update_status/stream")
+async def stream_update_status(request: Request, username: str = Depends(get_current_username)):
+    """
+    Поток server-sent events со статусом обновления: первое событие "status" – статус целиком,
+    далее события "delta" только с изменившимися полями (новые ошибки – списком errors).
+    Клиенту не нужно опрашивать /api/update_status; статус читается общим опросом status_feed.
+    """
+    async def events():
+        previous = None
+        async with status_feed.subscribe() as subscription:
+            while not await request.is_disconnected():
+                current = await subscription.next(STATUS_STREAM_KEEPALIVE)
+                if current is None:
+                    yield ": keepalive\n\n"
+                    continue
+                delta = status_delta(previous, current)
+                event, payload = ("status", current) if delta is None else ("delta", delta)
+                yield f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+                previous = current
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Отключает буферизацию ответа в nginx
+        "X-Accel-Buffering": "no"
+    })
+
+@app.get("/api/ingest_queue")
+def get_ingest_queue(username: str = Depends(get_current_username)):
+    """Глубина очереди загрузки по классам приоритета (fresh / repair / history) для всех заданий"""
+    return queue_depth()
+
+@app.get("/api/gsc_client_stats")
+async def get_gsc_client_stats(username: str = Depends(get_current_username)):
+    """Счетчики запросов к GSC по классам ошибок и текущая общая пауза после ошибок квот"""
+    return get_retry_stats()
+
+@app.get("/api/pool_stats")
+async def get_pool_stats(username: str = Depends(get_current_username)):
+    """Пулы соединений с БД этого процесса: занятые соединения, overflow, среднее и максимальное ожидание"""
+    return pool_metrics()
 
 # Новый маршрут для принудительной очистки кэша
 @app.post("/api/clear_cache")
@@ -0,0 +1,335 @@
+# migrations.py
+"""
+Версионные миграции схемы основной БД и БД стран. create_all создает только отсутствующие таблицы и не меняет
+существующие, поэтому колонки, индексы и ключи, появившиеся позже, добавляются здесь – по одному разу:
+примененные версии записываются в таблицу schema_migrations (отдельно для каждой БД), а параллельные
+запуски (API, cron, backfill-скрипты) ждут друг друга на advisory-блокировке.
+Индексы строятся CONCURRENTLY, не блокируя запись в таблицы; недостроенный (INVALID) индекс пересоздается.
+Запуск: run_migrations() при старте процесса, после create_all.
+"""
+
+import logging
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import inspect, text
+
+from models import DomainSummary, DomainError, DomainRollup, IngestUnit, IngestWatermark
+from country_models import CountrySummary, CountryRollup, CountryIngestWatermark
+from ingest_lease import advisory_key
+from rollups import ROLLUPS, rebuild_rollups
+from watermarks import rebuild_watermarks
+from dimensions import DIMENSIONS, table_sizes, format_sizes
+from gap_planner import HISTORY_START
+from partitions import (
+    PARTITION_MONTHS_AHEAD, is_partitioned, create_partitions, ensure_partitions, month_start, add_months
+)
+
+logger = logging.getLogger("gsc_stats")
+
+# apply(engine) выполняет миграцию; version растет монотонно внутри своей БД
+Migration = namedtuple("Migration", ["version", "name", "apply"])
+
+def _has_table(engine, table: str):
+    return inspect(engine).has_table(table)
+
+def _legacy_layout(engine, model):
+    """
+    Таблица дневных сводок в прежней схеме – с domain и country строками, без ключей справочников.
+    Миграции, написанные для этой схемы, на таблице, созданной уже по текущей модели, ничего не делают.
+    """
+    return "domain_id" not in {column["name"] for column in inspect(engine).get_columns(model.__tablename__)}
+
+def create_index(engine, name: str, table: str, definition: str, unique: bool = False):
+    """
+    CREATE INDEX CONCURRENTLY, если индекса name еще нет. Индекс, который остался INVALID
+    после прерванного построения, удаляется и строится заново.
+    """
+    with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+        valid = conn.execute(text("""
+            SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :name AND pg_table_is_visible(c.oid)
+        """), {"name": name}).scalar()
+        if valid:
+            return
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+        logger.info(f"Created index {name} on {table} {definition}")
+
+def drop_index(engine, name: str):
+    with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+# --- Миграции ---
+def unique_key(engine, model, key_columns: tuple):
+    """
+    Уникальный индекс uq_<таблица> по key_columns, на который опирается upsert в db_writer. Перед созданием
+    удаляет дубликаты, оставляя строку с наибольшим id – она была записана последней.
+    """
+    table = model.__tablename__
+    if not _has_table(engine, table) or (table in DIMENSIONS and not _legacy_layout(engine, model)):
+        # Таблица будет создана (или уже создана) create_all с ключом из модели
+        return
+    index_name = f"uq_{table}"
+    columns = ", ".join(key_columns)
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM pg_indexes WHERE tablename = :table AND indexname = :index"),
+            {"table": table, "index": index_name}
+        ).first()
+        if exists:
+            return
+        join_condition = " AND ".join(f"a.{column} = b.{column}" for column in key_columns)
+        deleted = conn.execute(text(f"DELETE FROM {table} a USING {table} b WHERE {join_condition} AND a.id < b.id")).rowcount
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})"))
+        logger.info(f"Created unique index {index_name} ({columns}), removed {deleted} duplicate rows")
+
+def unique_constraint(engine, model):
+    """Превращает уникальный индекс uq_<таблица> в ограничение UNIQUE (видно в information_schema)."""
+    table = model.__tablename__
+    if not _has_table(engine, table) or (table in DIMENSIONS and not _legacy_layout(engine, model)):
+        return
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM pg_constraint WHERE conname = :name AND contype = 'u'"), {"name": f"uq_{table}"}
+        ).first()
+        if not exists:
+            conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT uq_{table} UNIQUE USING INDEX uq_{table}"))
+
+def ingest_ledger(engine):
+    """Журнал заданий ingest_units (job_ledger.py) и колонки планировщика с приоритетами."""
+    IngestUnit.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE ingest_units ADD COLUMN IF NOT EXISTS priority integer DEFAULT 1"))
+        conn.execute(text("ALTER TABLE ingest_units ADD COLUMN IF NOT EXISTS weight double precision DEFAULT 0"))
+
+def provisional_rows(engine, model):
+    """Колонка is_final и частичный индекс по неокончательным строкам (fresh_ingest.py)."""
+    table = model.__tablename__
+    if not _has_table(engine, table):
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS is_final boolean NOT NULL DEFAULT true"))
+    create_index(engine, f"ix_{table}_provisional", table, "(date, domain) WHERE NOT is_final")
+
+def query_indexes(engine, model, indexes: dict, redundant: tuple):
+    """
+    Составные индексы под запросы main.py (indexes: имя -> определение) и удаление одноколоночных индексов,
+    которые стали префиксом составных (redundant): они только замедляют запись.
+    """
+    table = model.__tablename__
+    if not _has_table(engine, table):
+        return
+    for name, definition in indexes.items():
+        create_index(engine, name, table, definition)
+    for name in redundant:
+        drop_index(engine, name)
+
+def rollup_table(engine, model, rollup_model):
+    """Таблица недельных и месячных сводок (rollups.py), заполненная из существующих дневных строк."""
+    if not _has_table(engine, model.__tablename__):
+        return
+    rollup_model.__table__.create(bind=engine, checkfirst=True)
+    if _legacy_layout(engine, model):
+        # Сводки собирает rewrite_summaries после перевода дневной таблицы на ключи справочников
+        return
+    with engine.begin() as conn:
+        rebuild_rollups(conn.exec_driver_sql, model.__tablename__)
+
+def watermark_table(engine, model, watermark_model):
+    """Таблица последних дат доменов (watermarks.py), заполненная из существующих дневных строк."""
+    watermark_model.__table__.create(bind=engine, checkfirst=True)
+    if not _has_table(engine, model.__tablename__):
+        return
+    with engine.begin() as conn:
+        rebuild_watermarks(conn.exec_driver_sql, model.__tablename__)
+
+def _rename_table(conn, table: str, old: str):
+    """
+    Переименовывает table (и ее секции) в old, освобождая имена таблицы, секций, индексов и ограничений
+    для новой таблицы.
+    """
+    partitions = conn.execute(text("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = :table AND pg_table_is_visible(parent.oid)
+    """), {"table": table}).scalars().all()
+    for relation in [table] + partitions:
+        for index in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :relation"), {"relation": relation}).scalars().all():
+            conn.execute(text(f"ALTER INDEX {index} RENAME TO {index}_old"))
+    for partition in partitions:
+        conn.execute(text(f"ALTER TABLE {partition} RENAME TO {old}{partition[len(table):]}"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+
+def rewrite_summaries(engine, model, legacy_only: bool = False):
+    """
+    Миграция: переписывает существующую таблицу дневных сводок model в схему модели – ключи справочников
+    domains / countries вместо строк (dimensions.py) и, для секционированной модели, помесячные секции
+    (partitions.py). Справочники заполняются из существующих строк, новая таблица создается по модели
+    с ключами и индексами, данные копируются в одной транзакции – на время копирования таблица заблокирована.
+    Строки без даты, домена или страны (в ключ они не входят) не копируются. Затем пересобираются сводки
+    rollups.py. Размеры таблицы и индексов до и после пишутся в лог и возвращаются.
+    legacy_only – переписывать, только если в таблице еще строки вместо ключей справочников.
+    """
+    table = model.__tablename__
+    if not _has_table(engine, table):
+        # Таблица будет создана create_all уже по модели
+        return None
+    partitioned = bool(model.__table__.dialect_options["postgresql"]["partition_by"])
+    legacy = _legacy_layout(engine, model)
+    with engine.begin() as conn:
+        if not legacy and (legacy_only or not partitioned or is_partitioned(conn, table)):
+            return None
+        before = table_sizes(conn, table)
+        old = f"{table}_old"
+        _rename_table(conn, table, old)
+
+        dimensions = DIMENSIONS[table]
+        for name_column, (_, dimension) in dimensions.items():
+            dimension.__table__.create(bind=conn, checkfirst=True)
+            if legacy:
+                conn.execute(text(
+                    f"INSERT INTO {dimension.__tablename__} (name) SELECT DISTINCT {name_column} FROM {old} "
+                    f"WHERE {name_column} IS NOT NULL ORDER BY 1 ON CONFLICT (name) DO NOTHING"
+                ))
+        model.__table__.create(bind=conn)
+        first_date, last_date = conn.execute(text(f"SELECT min(date), max(date) FROM {old}")).first()
+        if partitioned:
+            last_month = add_months(month_start(date.today()), PARTITION_MONTHS_AHEAD)
+            create_partitions(conn, table, month_start(min(first_date or HISTORY_START, HISTORY_START)),
+                              max(last_month, month_start(last_date or last_month)))
+
+        # Колонки новой таблицы; ключи справочников – через соединение со справочником по прежней строке
+        columns, select_columns, joins, conditions = [], [], [], ["o.date IS NOT NULL"]
+        key_columns = {key_column: (name_column, dimension) for name_column, (key_column, dimension) in dimensions.items()}
+        for column in model.__table__.columns:
+            columns.append(column.name)
+            if legacy and column.name in key_columns:
+                name_column, dimension = key_columns[column.name]
+                select_columns.append(f"{name_column}_dim.id")
+                joins.append(f" JOIN {dimension.__tablename__} {name_column}_dim ON {name_column}_dim.name = o.{name_column}")
+                conditions.append(f"o.{name_column} IS NOT NULL")
+            else:
+                select_columns.append(f"o.{column.name}")
+        rows = conn.execute(text(f"SELECT count(*) FROM {old} o WHERE {' AND '.join(conditions)}")).scalar()
+        copied = conn.execute(text(
+            f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(select_columns)} FROM {old} o{''.join(joins)} "
+            f"WHERE o.date IS NOT NULL"
+        )).rowcount
+        if copied != rows:
+            raise RuntimeError(f"Rewriting {table}: copied {copied} of {rows} rows")
+        conn.execute(text(f"DROP TABLE {old}"))
+        if table in ROLLUPS and inspect(conn).has_table(ROLLUPS[table].table):
+            rebuild_rollups(conn.exec_driver_sql, table)
+    # Размеры после VACUUM ANALYZE: без мертвых строк, с актуальной статистикой для планировщика
+    with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+        conn.execute(text(f"VACUUM ANALYZE {table}"))
+        after = table_sizes(conn, table)
+    logger.info(f"Rewrote {table} ({copied} rows): before {format_sizes(before)}; after {format_sizes(after)}")
+    return before, after
+
+# Индексы прежней схемы со строками domain и country; в текущей схеме те же индексы по domain_id / country_id
+# описаны в моделях и создаются rewrite_summaries.
+# Запросы по дате и диапазону дат (/api/summary, /api/summary_range) – index-only scan по покрывающему индексу;
+# запросы по домену (/api/domain/..., last_dates) идут по уникальному ключу (domain, date)
+DOMAIN_SUMMARY_INDEXES = {
+    "ix_domain_summaries_date_domain":
+        "(date, domain) INCLUDE (id, traffic_clicks, impressions, ctr, avg_position, pages_indexed, pages_not_indexed, is_final)",
+}
+# /api/country_summary и /api/country_range_summary – по дате; /api/country/{country}/summary – страна и дата
+COUNTRY_SUMMARY_INDEXES = {
+    "ix_country_summaries_date_domain_country":
+        "(date, domain, country) INCLUDE (id, traffic_clicks, impressions, ctr, avg_position, is_final)",
+    "ix_country_summaries_country_date":
+        "(country, date) INCLUDE (id, domain, traffic_clicks, impressions, ctr, avg_position, is_final)",
+}
+
+MAIN_MIGRATIONS = [
+    Migration(1, "unique_keys", lambda engine: (
+        unique_key(engine, DomainSummary, ("domain", "date")), unique_key(engine, DomainError, ("domain", "date", "error_type"))
+    )),
+    Migration(2, "ingest_ledger", ingest_ledger),
+    Migration(3, "provisional_rows", lambda engine: provisional_rows(engine, DomainSummary)),
+    Migration(4, "query_indexes", lambda engine: (
+        query_indexes(engine, DomainSummary, DOMAIN_SUMMARY_INDEXES,
+                      ("ix_domain_summaries_domain", "ix_domain_summaries_date")),
+        query_indexes(engine, DomainError, {}, ("ix_domain_errors_domain",))
+    )),
+    Migration(5, "unique_constraints", lambda engine: (
+        unique_constraint(engine, DomainSummary), unique_constraint(engine, DomainError)
+    )),
+    Migration(6, "rollups", lambda engine: rollup_table(engine, DomainSummary, DomainRollup)),
+    Migration(7, "dimension_keys", lambda engine: rewrite_summaries(engine, DomainSummary)),
+    Migration(8, "ingest_watermarks", lambda engine: watermark_table(engine, DomainSummary, IngestWatermark)),
+    Migration(9, "unit_leases", lambda engine: query_indexes(
+        engine, IngestUnit, {"ix_ingest_units_domain_status": "(domain, status, finished_at)"}, ()
+    )),
+]
+
+COUNTRY_MIGRATIONS = [
+    Migration(1, "unique_keys", lambda engine: unique_key(engine, CountrySummary, ("domain", "date", "country"))),
+    Migration(2, "provisional_rows", lambda engine: provisional_rows(engine, CountrySummary)),
+    Migration(3, "query_indexes", lambda engine: query_indexes(
+        engine, CountrySummary, COUNTRY_SUMMARY_INDEXES,
+        ("ix_country_summaries_domain", "ix_country_summaries_date", "ix_country_summaries_country")
+    )),
+    Migration(4, "unique_constraints", lambda engine: unique_constraint(engine, CountrySummary)),
+    Migration(5, "rollups", lambda engine: rollup_table(engine, CountrySummary, CountryRollup)),
+    # v6 сразу переписывает таблицу в итоговую схему (секции и ключи справочников) – одна копия данных;
+    # v7 копирует таблицу, только если v6 была применена раньше, когда переписывала лишь секции
+    Migration(6, "monthly_partitions", lambda engine: rewrite_summaries(engine, CountrySummary)),
+    Migration(7, "dimension_keys", lambda engine: rewrite_summaries(engine, CountrySummary, legacy_only=True)),
+    Migration(8, "ingest_watermarks", lambda engine: watermark_table(engine, CountrySummary, CountryIngestWatermark)),
+]
+
+# --- Применение ---
+def migrate(engine, database: str, migrations):
+    """
+    Применяет к БД еще не примененные миграции по порядку версий. database – имя набора миграций
+    ("main", "country"): обе БД могут быть одной физической базой. Возвращает список примененных версий.
+    """
+    applied_now = []
+    with engine.connect() as lock_conn:
+        # Одна блокировка на все наборы: CREATE TABLE IF NOT EXISTS не защищен от гонки двух процессов
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": advisory_key("schema_migrations")})
+        lock_conn.commit()
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        database varchar NOT NULL,
+                        version integer NOT NULL,
+                        name varchar NOT NULL,
+                        applied_at timestamp NOT NULL DEFAULT now(),
+                        PRIMARY KEY (database, version)
+                    )
+                """))
+                applied = set(conn.execute(
+                    text("SELECT version FROM schema_migrations WHERE database = :database"), {"database": database}
+                ).scalars())
+            for migration in sorted(migrations, key=lambda migration: migration.version):
+                if migration.version in applied:
+                    continue
+                logger.info(f"Applying migration {database}:{migration.version} {migration.name}")
+                migration.apply(engine)
+                with engine.begin() as conn:
+                    conn.execute(
+                        text("INSERT INTO schema_migrations (database, version, name) VALUES (:database, :version, :name)"),
+                        {"database": database, "version": migration.version, "name": migration.name}
+                    )
+                applied_now.append(migration.version)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": advisory_key("schema_migrations")})
+            lock_conn.commit()
+    return applied_now
+
+def run_migrations():
+    """Миграции основной БД и БД стран."""
+    from database import engine
+    from country_database import engine as country_engine
+    migrate(engine, "main", MAIN_MIGRATIONS)
+    migrate(country_engine, "country", COUNTRY_MIGRATIONS)
+    # Секции country_summaries на ближайшие месяцы (ежедневно это же делает cron_job.py)
+    ensure_partitions(country_engine)
@@ -1,29 +1,114 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Date, Float
+from sqlalchemy import (
+    Column, Integer, SmallInteger, String, Date, DateTime, Float, Text, Boolean, Index, UniqueConstraint, ForeignKey,
+    select, text
+)
+from sqlalchemy.orm import column_property
 from database import Base
 
+class Domain(Base):
+    """Справочник доменов: дневные сводки хранят короткий domain_id вместо строки (dimensions.py)."""
+    __tablename__ = "domains"
+    id = Column(SmallInteger, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
 class DomainSummary(Base):
     __tablename__ = "domain_summaries"
-    id = Column(Integer, primary_key=True, index=True)
-    domain = Column(String, index=True)
-    date = Column(Date, index=True)
+    # Одна строка на домен и дату – первичный ключ, он же ключ для upsert в db_writer; индексы под запросы main.py – migrations.py
+    __table_args__ = (
+        Index("ix_domain_summaries_date_domain", "date", "domain_id", postgresql_include=[
+            "traffic_clicks", "impressions", "ctr", "avg_position", "pages_indexed", "pages_not_indexed", "is_final"
+        ]),
+        # Неокончательные строки (fresh_ingest.py) – небольшой набор последних дней для сверки
+        Index("ix_domain_summaries_provisional", "date", "domain_id", postgresql_where=text("NOT is_final")),
+    )
+    domain_id = Column(SmallInteger, ForeignKey("domains.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
     traffic_clicks = Column(Integer)      # клики
     impressions = Column(Integer)         # показы
     ctr = Column(Float)                   # CTR
     avg_position = Column(Float)          # средняя позиция
     pages_indexed = Column(Integer)       # количество страниц в индексе
     pages_not_indexed = Column(Integer)   # количество страниц вне индекса
+    is_final = Column(Boolean, nullable=False, default=True, server_default=text("true"))  # False – данные dataState=all
+    # Имя домена для чтения и JSON-ответов API; фильтровать по домену – через domain_id (dimensions.domain_filter)
+    domain = column_property(select(Domain.name).where(Domain.id == domain_id).scalar_subquery())
 
 class DomainError(Base):
     __tablename__ = "domain_errors"
+    __table_args__ = (UniqueConstraint("domain", "date", "error_type", name="uq_domain_errors"),)
     id = Column(Integer, primary_key=True, index=True)
-    domain = Column(String, index=True)
+    domain = Column(String)
     date = Column(Date, index=True)
     error_type = Column(String)           # тип ошибки
     count = Column(Integer)
 
+class DomainRollup(Base):
+    """Сводка домена за неделю или месяц (rollups.py) – поддерживается вместе с domain_summaries."""
+    __tablename__ = "domain_rollups"
+    __table_args__ = (
+        UniqueConstraint("domain", "granularity", "period_start", name="uq_domain_rollups"),
+        Index("ix_domain_rollups_period", "granularity", "period_start"),
+    )
+    id = Column(Integer, primary_key=True)
+    domain = Column(String)
+    granularity = Column(String)          # week / month
+    period_start = Column(Date)           # понедельник недели или первое число месяца
+    period_end = Column(Date)
+    days = Column(Integer)                # дней с данными в периоде
+    traffic_clicks = Column(Integer)
+    impressions = Column(Integer)
+    position_sum = Column(Float)          # сумма avg_position * impressions – для средней позиции, взвешенной по показам
+    pages_indexed = Column(Integer)       # значения последнего дня периода
+    pages_not_indexed = Column(Integer)
+    is_final = Column(Boolean)            # все дни периода окончательные
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
+
+class IngestWatermark(Base):
+    """
+    Две последние загруженные даты домена в наборе данных (watermarks.py) – обновляются при каждой записи
+    в дневные сводки; updated_at – версия данных для кэша API.
+    """
+    __tablename__ = "ingest_watermarks"
+    dataset = Column(String, primary_key=True)   # domain / country
+    domain = Column(String, primary_key=True)
+    last_date = Column(Date)
+    second_last_date = Column(Date)
+    updated_at = Column(DateTime)
+
+class IngestUnit(Base):
+    """Единица работы загрузки (домен и диапазон дат) в журнале заданий (job_ledger.py)."""
+    __tablename__ = "ingest_units"
+    __table_args__ = (
+        Index("uq_ingest_units", "job_id", "domain", "start_date", "end_date", unique=True),
+        # Аренды единиц (ingest_lease.py): выполняемые и выполненные единицы домена других заданий
+        Index("ix_ingest_units_domain_status", "domain", "status", "finished_at"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, index=True)   # идентификатор задания, например "backfill-domain-2024-01-01-2025-02-25"
+    dataset = Column(String)              # domain / country / derived
+    domain = Column(String)
+    start_date = Column(Date)
+    end_date = Column(Date)
+    status = Column(String, index=True, default="pending")   # pending / running / done / failed
+    priority = Column(Integer, default=1)  # 0 – свежие дни, 1 – пропуски, 2 – глубокая история (gap_planner.py)
+    weight = Column(Float, default=0.0)    # вес домена (трафик) – порядок внутри класса приоритета
+    attempts = Column(Integer, default=0)
+    rows = Column(Integer, default=0)     # записано строк
+    worker = Column(String)               # кто взял задачу (хост:pid)
+    claimed_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    duration = Column(Float)              # время выполнения последней попытки, сек.
+    last_error = Column(Text)
+
+class JobStatus(Base):
+    """Статус задания загрузки для всех процессов (job_status.py), если Redis недоступен."""
+    __tablename__ = "job_statuses"
+    name = Column(String, primary_key=True)
+    data = Column(Text)                   # статус в JSON
+    updated_at = Column(DateTime)
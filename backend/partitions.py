@@ -0,0 +1,157 @@
+# partitions.py
+"""
+Помесячное секционирование country_summaries (PARTITION BY RANGE (date)): запросы с условием по дате
+читают только секции своих месяцев (partition pruning), а VACUUM и перестроение индексов работают
+с одной секцией, а не со всей историей.
+Секции country_summaries_pYYYY_MM создаются заранее – на PARTITION_MONTHS_AHEAD месяцев вперед
+(при старте и ежедневно из cron_job.py); строки за месяц без секции попадают в секцию по умолчанию
+и переносятся в секцию месяца при ее создании, поэтому запись никогда не падает из-за отсутствующей секции.
+Закрытые месяцы можно заморозить (VACUUM FREEZE – после этого таблица не требует обслуживания)
+или отсоединить в схему archive: недельные и месячные сводки (rollups.py) за эти месяцы остаются.
+domain_summaries не секционируется: ~52 строки в день, индексов по (domain_id, date) достаточно.
+Перевод существующей таблицы в секционированную – миграция rewrite_summaries (migrations.py).
+
+Запуск: python partitions.py [--ensure] [--freeze-before 2025-01-01] [--archive-before 2024-06-01]
+"""
+
+import argparse
+import logging
+import re
+from datetime import date
+
+from sqlalchemy import text
+
+from gap_planner import HISTORY_START
+
+logger = logging.getLogger("gsc_stats")
+
+# На сколько месяцев вперед от текущего создавать секции
+PARTITION_MONTHS_AHEAD = 2
+# Схема для отсоединенных секций
+ARCHIVE_SCHEMA = "archive"
+
+def month_start(single_date: date):
+    return single_date.replace(day=1)
+
+def next_month(month: date):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def add_months(month: date, months: int):
+    for _ in range(months):
+        month = next_month(month)
+    return month
+
+def partition_name(table: str, month: date):
+    return f"{table}_p{month:%Y_%m}"
+
+def is_partitioned(conn, table: str):
+    return conn.execute(text("""
+        SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = :table AND pg_table_is_visible(c.oid)
+    """), {"table": table}).first() is not None
+
+def month_partitions(conn, table: str):
+    """{начало месяца: имя секции} для присоединенных помесячных секций table."""
+    names = conn.execute(text("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = :table AND pg_table_is_visible(parent.oid)
+    """), {"table": table}).scalars()
+    partitions = {}
+    for name in names:
+        match = re.fullmatch(rf"{table}_p(\d{{4}})_(\d{{2}})", name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+def create_month_partition(conn, table: str, month: date):
+    """
+    Создает секцию месяца. Строки этого месяца из секции по умолчанию переносятся в нее в той же транзакции:
+    PostgreSQL не дает создать секцию, пока такие строки лежат в секции по умолчанию.
+    """
+    name = partition_name(table, month)
+    bounds = {"start_date": month, "end_date": next_month(month)}
+    in_month = "date >= :start_date AND date < :end_date"
+    moved = conn.execute(text(f"SELECT count(*) FROM {table}_default WHERE {in_month}"), bounds).scalar()
+    if moved:
+        conn.execute(text(f"CREATE TEMP TABLE moved_rows (LIKE {table}) ON COMMIT DROP"))
+        conn.execute(text(f"WITH moved AS (DELETE FROM {table}_default WHERE {in_month} RETURNING *) "
+                          f"INSERT INTO moved_rows SELECT * FROM moved"), bounds)
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+    ))
+    if moved:
+        conn.execute(text(f"INSERT INTO {table} SELECT * FROM moved_rows"))
+        conn.execute(text("DROP TABLE moved_rows"))
+    logger.info(f"Created partition {name}, moved {moved} rows from {table}_default")
+
+def create_partitions(conn, table: str, first_month: date, last_month: date):
+    """Секция по умолчанию и недостающие помесячные секции с first_month по last_month. Возвращает имена созданных."""
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+    existing = month_partitions(conn, table)
+    created = []
+    month = first_month
+    while month <= last_month:
+        if month not in existing:
+            create_month_partition(conn, table, month)
+            created.append(partition_name(table, month))
+        month = next_month(month)
+    return created
+
+def ensure_partitions(engine, table: str = "country_summaries", start_date: date = None, end_date: date = None):
+    """
+    Секция по умолчанию и помесячные секции с start_date (по умолчанию HISTORY_START) до end_date
+    (по умолчанию PARTITION_MONTHS_AHEAD месяцев вперед). Возвращает имена созданных секций.
+    """
+    first_month = month_start(start_date or HISTORY_START)
+    last_month = month_start(end_date) if end_date else add_months(month_start(date.today()), PARTITION_MONTHS_AHEAD)
+    with engine.begin() as conn:
+        if not is_partitioned(conn, table):
+            return []
+        return create_partitions(conn, table, first_month, last_month)
+
+def closed_partitions(conn, table: str, before: date):
+    """Секции месяцев, целиком лежащих раньше before."""
+    return {month: name for month, name in month_partitions(conn, table).items() if next_month(month) <= before}
+
+def freeze_partitions(engine, before: date, table: str = "country_summaries"):
+    """VACUUM (FREEZE, ANALYZE) закрытых месяцев: после этого секции не требуют обслуживания autovacuum."""
+    with engine.connect() as conn:
+        partitions = closed_partitions(conn, table, before)
+    with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+        for name in partitions.values():
+            conn.execute(text(f"VACUUM (FREEZE, ANALYZE) {name}"))
+    return sorted(partitions.values())
+
+def archive_partitions(engine, before: date, table: str = "country_summaries"):
+    """
+    Отсоединяет секции месяцев раньше before и переносит их в схему ARCHIVE_SCHEMA: операции только над
+    метаданными, данные остаются доступны для выгрузки (pg_dump -t) или удаления целиком (DROP TABLE).
+    """
+    with engine.begin() as conn:
+        partitions = closed_partitions(conn, table, before)
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+        for name in partitions.values():
+            conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+            logger.info(f"Archived partition {name} to {ARCHIVE_SCHEMA}")
+    return sorted(partitions.values())
+
+def main():
+    from country_database import engine
+    parser = argparse.ArgumentParser(description="Обслуживание помесячных секций country_summaries")
+    parser.add_argument("--ensure", action="store_true", help="создать недостающие секции")
+    parser.add_argument("--freeze-before", type=date.fromisoformat, default=None)
+    parser.add_argument("--archive-before", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    if args.ensure:
+        print(f"Created: {ensure_partitions(engine)}")
+    if args.freeze_before:
+        print(f"Frozen: {freeze_partitions(engine, args.freeze_before)}")
+    if args.archive_before:
+        print(f"Archived: {archive_partitions(engine, args.archive_before)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# replay_archive.py
+"""
+Пересборка domain_summaries и country_summaries из локального архива ответов GSC (gsc_archive.py)
+без обращения к API. Для каждого запроса берется самый свежий ответ, строки преобразуются теми же
+функциями, что и при обычной загрузке (_performance_row_to_result, _country_row_to_record), а данные
+каждого домена за даты из архива замещаются в одной транзакции вместе с недельными и месячными сводками.
+Ответы свежей загрузки (dataState=all) пишутся неокончательными (is_final=False), как в fresh_ingest.py:
+сверка заменит их окончательными данными; за даты с окончательным ответом они не применяются.
+
+Запуск: python replay_archive.py [--archive-dir DIR] [--domains-only | --countries-only]
+"""
+
+import argparse
+import time
+import logging
+from datetime import date
+
+from config import DOMAINS
+from database import SessionLocal, engine, Base
+from models import Domain, DomainSummary, DomainError
+from country_database import SessionLocal as CountrySessionLocal, engine as country_engine, Base as CountryBase
+from country_models import CountrySummary
+from gsc_client import _performance_row_to_result, _country_row_to_record, DATA_STATE_ALL
+from gsc_archive import latest_responses
+from rollups import refresh_rollups, date_ranges
+from watermarks import advance_watermarks
+from db_writer import country_summary_rows
+from dimensions import domain_filter, dimension_ids, encode_rows
+from tqdm import tqdm
+
+# Создаем таблицы в базах, если их еще нет (например, при восстановлении потерянной БД)
+Base.metadata.create_all(bind=engine)
+CountryBase.metadata.create_all(bind=country_engine)
+
+# Удаление старых строк выполняется порциями дат
+DELETE_CHUNK = 500
+
+def collect_archive_data(archive_dir: str = None):
+    """
+    Разбирает архив в {domain: {дата: данные домена}} и {domain: {(дата, страна): запись}};
+    у данных и записей есть поле is_final (False – ответ с dataState=all).
+    Ответы применяются в порядке получения, поэтому более поздняя загрузка той же даты побеждает,
+    но неокончательный ответ не замещает окончательные данные даты.
+    """
+    domain_data = {}
+    country_data = {}
+    # {domain: даты, за которые есть окончательный ответ по странам}
+    final_country_dates = {}
+    entries = sorted(latest_responses(archive_dir).values(), key=lambda entry: entry["fetched_at"])
+    for entry in entries:
+        site_url = entry["site_url"]
+        domain = site_url.replace("https://", "").rstrip("/")
+        dimensions = entry["body"].get("dimensions", [])
+        is_final = entry["body"].get("dataState") != DATA_STATE_ALL
+        for row in entry["response"].get("rows", []):
+            if dimensions == ["date"]:
+                date_str = row["keys"][0]
+                single_date = date.fromisoformat(date_str)
+                previous = domain_data.setdefault(domain, {}).get(single_date)
+                if is_final or previous is None or not previous["is_final"]:
+                    domain_data[domain][single_date] = dict(_performance_row_to_result(site_url, row, date_str), is_final=is_final)
+            elif dimensions == ["date", "country"]:
+                record = dict(_country_row_to_record(domain, row), is_final=is_final)
+                previous = country_data.setdefault(domain, {}).get((record["date"], record["country"]))
+                if is_final or previous is None or not previous["is_final"]:
+                    country_data[domain][(record["date"], record["country"])] = record
+                if is_final:
+                    final_country_dates.setdefault(domain, set()).add(record["date"])
+    # Неокончательные страны дат с окончательным ответом не пишутся: их нет в окончательных данных
+    for domain, records in country_data.items():
+        final_dates = final_country_dates.get(domain, set())
+        country_data[domain] = {
+            key: record for key, record in records.items() if record["is_final"] or record["date"] not in final_dates
+        }
+    return domain_data, country_data
+
+def _delete_dates(db, model, domain: str, dates: list):
+    for chunk_start in range(0, len(dates), DELETE_CHUNK):
+        chunk = dates[chunk_start:chunk_start + DELETE_CHUNK]
+        db.query(model).filter(domain_filter(model, domain), model.date.in_(chunk)).delete(synchronize_session=False)
+
+def replay_domain_data(domain: str, data_by_date: dict):
+    db = SessionLocal()
+    try:
+        dates = sorted(data_by_date)
+        _delete_dates(db, DomainError, domain, dates)
+        _delete_dates(db, DomainSummary, domain, dates)
+        domain_id = dimension_ids(engine, Domain, [domain])[domain]
+        for single_date in dates:
+            data = data_by_date[single_date]
+            db.add(DomainSummary(
+                domain_id=domain_id,
+                date=single_date,
+                traffic_clicks=data.get("traffic_clicks", 0),
+                impressions=data.get("impressions", 0),
+                ctr=data.get("ctr", 0.0),
+                avg_position=data.get("avg_position", 0.0),
+                pages_indexed=data.get("pages_indexed", 0),
+                pages_not_indexed=data.get("pages_not_indexed", 0),
+                is_final=data.get("is_final", True)
+            ))
+            for error_type, count in data.get("errors", {}).items():
+                db.add(DomainError(domain=domain, date=single_date, error_type=error_type, count=count))
+        if dates:
+            db.flush()
+            refresh_rollups(db.connection().exec_driver_sql, DomainSummary.__tablename__, [(domain, dates[0], dates[-1])])
+            advance_watermarks(db.connection().exec_driver_sql, DomainSummary.__tablename__, {domain: dates})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+    return len(data_by_date)
+
+def replay_country_data(domain: str, records: dict):
+    db = CountrySessionLocal()
+    try:
+        _delete_dates(db, CountrySummary, domain, sorted({single_date for single_date, _ in records}))
+        rows = country_summary_rows([record for record in records.values() if record["is_final"]]) + \
+            country_summary_rows([record for record in records.values() if not record["is_final"]], is_final=False)
+        for row in encode_rows(country_engine, CountrySummary.__tablename__, rows):
+            db.add(CountrySummary(**row))
+        db.flush()
+        refresh_rollups(db.connection().exec_driver_sql, CountrySummary.__tablename__, date_ranges(records.values()))
+        advance_watermarks(db.connection().exec_driver_sql, CountrySummary.__tablename__, {domain: [single_date for single_date, _ in records]})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+    return len(records)
+
+def replay_archive(archive_dir: str = None, domains: bool = True, countries: bool = True):
+    start_time = time.time()
+    domain_data, country_data = collect_archive_data(archive_dir)
+    print(f"Архив разобран за {time.time() - start_time:.2f} сек.: доменов с данными {len(domain_data)}, по странам {len(country_data)}")
+
+    unknown = (set(domain_data) | set(country_data)) - set(DOMAINS)
+    if unknown:
+        logging.warning(f"В архиве есть домены не из DOMAINS: {', '.join(sorted(unknown))}")
+
+    jobs = []
+    if domains:
+        jobs += [(replay_domain_data, domain, data) for domain, data in sorted(domain_data.items())]
+    if countries:
+        jobs += [(replay_country_data, domain, records) for domain, records in sorted(country_data.items())]
+
+    total_rows = 0
+    errors = 0
+    for replay, domain, data in tqdm(jobs, desc="Восстановление из архива", unit="domain"):
+        try:
+            total_rows += replay(domain, data)
+        except Exception as e:
+            errors += 1
+            logging.error(f"Ошибка при восстановлении {domain} ({replay.__name__}): {e}")
+    total_time = time.time() - start_time
+    print(f"\nЗаписано строк: {total_rows}, ошибок: {errors}. Общее время: {total_time:.2f} сек.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пересборка таблиц из архива ответов GSC без запросов к API")
+    parser.add_argument("--archive-dir", default=None, help="каталог архива (по умолчанию GSC_ARCHIVE_DIR)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--domains-only", action="store_true", help="только domain_summaries/domain_errors")
+    group.add_argument("--countries-only", action="store_true", help="только country_summaries")
+    args = parser.parse_args()
+
+    replay_archive(args.archive_dir, domains=not args.countries_only, countries=not args.domains_only)
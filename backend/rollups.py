@@ -0,0 +1,215 @@
+# rollups.py
+"""
+Сводки за неделю и месяц (domain_rollups, country_rollups) для запросов за диапазон дат.
+Сводки поддерживаются инкрементально: каждая запись в дневные таблицы (db_writer, bulk_loader, сверка
+свежих данных, replay_archive) в той же транзакции пересчитывает затронутые недели и месяцы этого домена
+из дневных строк – повторная загрузка, замена неокончательных строк и удаление не оставляют устаревших сумм.
+range_rows отвечает на запрос за диапазон самыми крупными периодами, которые целиком в него входят:
+полные месяцы, затем полные недели (с понедельника) на краях, затем отдельные дни –
+годовой запрос возвращает 12 строк на домен вместо 365.
+"""
+
+from collections import namedtuple
+from datetime import date, timedelta
+
+from sqlalchemy import or_, and_
+
+from models import DomainSummary, DomainRollup
+from country_models import CountrySummary, CountryRollup
+from dimensions import DIMENSIONS, domain_filter
+
+GRANULARITIES = ("week", "month")
+
+# Сводка дневной таблицы: группировка по keys, latest – значения последнего дня периода.
+# Сводки хранят имена доменов и стран: дневные ключи справочников (dimensions.py) раскрываются при пересчете
+RollupSpec = namedtuple("RollupSpec", ["table", "keys", "latest"])
+
+ROLLUPS = {
+    "domain_summaries": RollupSpec("domain_rollups", ("domain",), ("pages_indexed", "pages_not_indexed")),
+    "country_summaries": RollupSpec("country_rollups", ("domain", "country"), ()),
+}
+
+def _refresh_sql(source: str, spec: RollupSpec, where: str):
+    """
+    INSERT ... SELECT пересчета сводок одной гранулярности из дневных строк source (параметры в стиле pyformat).
+    where – условие на дневные строки s.
+    """
+    keys = ", ".join(spec.keys)
+    names = "".join(f", {column}_dim.name AS {column}" for column in DIMENSIONS[source])
+    joins = "".join(
+        f" JOIN {dimension.__tablename__} {column}_dim ON {column}_dim.id = s.{key_column}"
+        for column, (key_column, dimension) in DIMENSIONS[source].items()
+    )
+    latest = "".join(f", (array_agg({column} ORDER BY date DESC))[1]" for column in spec.latest)
+    columns = f"{keys}, granularity, period_start, period_end, days, traffic_clicks, impressions, position_sum" + \
+        "".join(f", {column}" for column in spec.latest) + ", is_final"
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}"
+        for column in ("period_end", "days", "traffic_clicks", "impressions", "position_sum") + spec.latest + ("is_final",)
+    )
+    return f"""
+        INSERT INTO {spec.table} ({columns})
+        SELECT {keys}, %(granularity)s, period_start,
+               (period_start + CAST('1 ' || %(granularity)s AS interval) - interval '1 day')::date,
+               count(*), sum(traffic_clicks), sum(impressions), sum(avg_position * impressions){latest}, bool_and(is_final)
+        FROM (
+            SELECT s.*{names}, date_trunc(%(granularity)s, s.date::timestamp)::date AS period_start
+            FROM {source} s{joins} WHERE {where}
+        ) daily
+        GROUP BY {keys}, period_start
+        ON CONFLICT ({keys}, granularity, period_start) DO UPDATE SET {updates}
+    """
+
+def period_start(granularity: str, single_date: date):
+    """Начало недели (понедельник) или месяца, в который входит single_date."""
+    if granularity == "week":
+        return single_date - timedelta(days=single_date.weekday())
+    return single_date.replace(day=1)
+
+def refresh_rollups(execute, source: str, ranges):
+    """
+    Пересчитывает недельные и месячные сводки дневной таблицы source для диапазонов ranges – [(домен, начало, конец)]:
+    затронутые периоды удаляются и собираются заново из дневных строк. execute(sql, params) выполняет SQL
+    в транзакции записи (exec_driver_sql соединения сессии или cursor.execute), поэтому сводки фиксируются
+    вместе с дневными данными.
+    Пересчет домена идет под транзакционной advisory-блокировкой (source, домен): параллельная запись соседнего
+    окна того же домена ждет фиксации этой транзакции, и ее пересчет уже видит наши дневные строки – общая
+    неделя или месяц не перезаписывается частичной суммой. Домены блокируются по порядку имен (без взаимоблокировок).
+    """
+    spec = ROLLUPS[source]
+    for domain, start_date, end_date in sorted(ranges):
+        execute("SELECT pg_advisory_xact_lock(hashtext(%(lock)s))", {"lock": f"rollups:{source}:{domain}"})
+        for granularity in GRANULARITIES:
+            first_period = period_start(granularity, start_date)
+            last_period = period_start(granularity, end_date)
+            params = {"domain": domain, "granularity": granularity, "first_period": first_period, "last_period": last_period}
+            execute(
+                f"DELETE FROM {spec.table} WHERE domain = %(domain)s AND granularity = %(granularity)s "
+                f"AND period_start BETWEEN %(first_period)s AND %(last_period)s",
+                params
+            )
+            execute(
+                _refresh_sql(source, spec, "s.domain_id = (SELECT id FROM domains WHERE name = %(domain)s) "
+                                           "AND s.date >= %(first_period)s "
+                                           "AND s.date < %(last_period)s::date + CAST('1 ' || %(granularity)s AS interval)"),
+                params
+            )
+
+def rebuild_rollups(execute, source: str):
+    """Собирает все сводки дневной таблицы source заново (миграция, восстановление)."""
+    spec = ROLLUPS[source]
+    execute(f"DELETE FROM {spec.table}", {})
+    for granularity in GRANULARITIES:
+        execute(_refresh_sql(source, spec, "TRUE"), {"granularity": granularity})
+
+def date_ranges(rows):
+    """Диапазоны дат по доменам для refresh_rollups из строк (словарей) с domain и date."""
+    bounds = {}
+    for row in rows:
+        start_date, end_date = bounds.get(row["domain"], (row["date"], row["date"]))
+        bounds[row["domain"]] = (min(start_date, row["date"]), max(end_date, row["date"]))
+    return [(domain, start_date, end_date) for domain, (start_date, end_date) in bounds.items()]
+
+# --- Чтение ---
+def plan_segments(start_date: date, end_date: date):
+    """
+    Разбивает [start_date, end_date] на полные месяцы, полные недели на краях и оставшиеся дни:
+    [(гранулярность, начало, конец)] в порядке дат; "day"-сегменты – непрерывные отрезки дней.
+    """
+    first_month = start_date if start_date.day == 1 else (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+    months = []
+    month = first_month
+    while True:
+        month_end = (month.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        if month_end > end_date:
+            break
+        months.append(("month", month, month_end))
+        month = month_end + timedelta(days=1)
+    if not months:
+        return _plan_edge(start_date, end_date)
+    return _plan_edge(start_date, months[0][1] - timedelta(days=1)) + months + \
+        _plan_edge(months[-1][2] + timedelta(days=1), end_date)
+
+def _plan_edge(start_date: date, end_date: date):
+    """Полные недели внутри отрезка и дни до и после них."""
+    if start_date > end_date:
+        return []
+    first_week = start_date + timedelta(days=(7 - start_date.weekday()) % 7)
+    weeks = []
+    week = first_week
+    while week + timedelta(days=6) <= end_date:
+        weeks.append(("week", week, week + timedelta(days=6)))
+        week += timedelta(days=7)
+    if not weeks:
+        return [("day", start_date, end_date)]
+    segments = []
+    if start_date < weeks[0][1]:
+        segments.append(("day", start_date, weeks[0][1] - timedelta(days=1)))
+    segments.extend(weeks)
+    if weeks[-1][2] < end_date:
+        segments.append(("day", weeks[-1][2] + timedelta(days=1), end_date))
+    return segments
+
+def _rollup_row(rollup, keys):
+    impressions = rollup.impressions or 0
+    row = {key: getattr(rollup, key) for key in keys}
+    row.update({
+        "date": rollup.period_start,
+        "end_date": rollup.period_end,
+        "granularity": rollup.granularity,
+        "traffic_clicks": rollup.traffic_clicks or 0,
+        "impressions": impressions,
+        "ctr": (rollup.traffic_clicks or 0) / impressions if impressions else 0.0,
+        "avg_position": (rollup.position_sum or 0.0) / impressions if impressions else 0.0,
+        "is_final": rollup.is_final
+    })
+    return row
+
+def _daily_row(summary, keys):
+    row = {key: getattr(summary, key) for key in keys}
+    row.update({
+        "date": summary.date,
+        "end_date": summary.date,
+        "granularity": "day",
+        "traffic_clicks": summary.traffic_clicks,
+        "impressions": summary.impressions,
+        "ctr": summary.ctr,
+        "avg_position": summary.avg_position,
+        "is_final": summary.is_final
+    })
+    return row
+
+def range_rows(db, source: str, start_date: date, end_date: date, domain: str = None):
+    """
+    Строки за диапазон из сводок самых крупных подходящих периодов (plan_segments) и дневной таблицы:
+    словари с полями дневной строки, где date – начало периода, плюс end_date и granularity.
+    Суммы за весь диапазон совпадают с суммами дневных строк.
+    """
+    daily_model, rollup_model = (DomainSummary, DomainRollup) if source == "domain_summaries" else (CountrySummary, CountryRollup)
+    keys = ROLLUPS[source].keys + ROLLUPS[source].latest
+    segments = plan_segments(start_date, end_date)
+    rows = []
+    period_starts = {
+        granularity: [segment_start for kind, segment_start, _ in segments if kind == granularity]
+        for granularity in GRANULARITIES
+    }
+    conditions = [
+        and_(rollup_model.granularity == granularity, rollup_model.period_start.in_(starts))
+        for granularity, starts in period_starts.items() if starts
+    ]
+    if conditions:
+        query = db.query(rollup_model).filter(or_(*conditions))
+        if domain is not None:
+            query = query.filter(rollup_model.domain == domain)
+        rows.extend(_rollup_row(rollup, keys) for rollup in query.all())
+    day_conditions = [
+        daily_model.date.between(segment_start, segment_end)
+        for kind, segment_start, segment_end in segments if kind == "day"
+    ]
+    if day_conditions:
+        query = db.query(daily_model).filter(or_(*day_conditions))
+        if domain is not None:
+            query = query.filter(domain_filter(daily_model, domain))
+        rows.extend(_daily_row(summary, keys) for summary in query.all())
+    rows.sort(key=lambda row: row["date"])
+    return rows
@@ -11,6 +11,8 @@ class DomainSummaryBase(BaseModel):
     avg_position: float
     pages_indexed: int
     pages_not_indexed: int
+    # False – неокончательные данные (dataState=all), будут заменены окончательными
+    is_final: bool = True
 
     class Config:
         orm_mode = True
@@ -32,6 +34,7 @@ class CountrySummaryBase(BaseModel):
     impressions: int
     ctr: float
     avg_position: float
+    is_final: bool = True
 
     class Config:
         orm_mode = True
@@ -1,6 +1,8 @@
 # server_cache.py
 import json
+import inspect
 import logging
+import time
 from datetime import timedelta
 from functools import wraps
 
@@ -30,16 +32,29 @@ local_cache = {}
 
 # Время жизни кэша по умолчанию - 24 часа
 DEFAULT_CACHE_TTL = 86400
+# Аргументы эндпоинта, не входящие в ключ кэша: сессия БД своя у каждого запроса
+CACHE_KEY_EXCLUDE = ("db",)
 
-def cache_response(prefix="api", ttl=DEFAULT_CACHE_TTL):
+def cache_response(prefix="api", ttl=DEFAULT_CACHE_TTL, version=None):
     """
-    Декоратор для кэширования ответов API в Redis или в памяти
+    Декоратор для кэширования ответов API в Redis или в памяти.
+    version – функция без аргументов (обычная или async), возвращающая версию данных (watermarks.py): она входит в ключ,
+    поэтому после записи новых данных ответ строится заново, не дожидаясь ttl или инвалидации.
     """
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            # Создаем ключ кэша из префикса и аргументов
-            cache_key = f"{prefix}:{func.__name__}:{str(args)}:{str(kwargs)}"
+            # Создаем ключ кэша из префикса, версии данных и аргументов
+            key_kwargs = {name: value for name, value in kwargs.items() if name not in CACHE_KEY_EXCLUDE}
+            cache_key = f"{prefix}:{func.__name__}:{str(args)}:{str(key_kwargs)}"
+            if version is not None:
+                try:
+                    data_version = version()
+                    if inspect.isawaitable(data_version):
+                        data_version = await data_version
+                    cache_key = f"{prefix}:{func.__name__}:v={data_version}:{str(args)}:{str(key_kwargs)}"
+                except Exception as e:
+                    logger.error(f"Ошибка при получении версии данных для кэша: {e}")
             
             # Пытаемся получить данные из кэша
             cached_data = None
@@ -0,0 +1,208 @@
+# update_worker.py
+"""
+Исполнитель обновления данных для /api/update_data. Загрузка выполняется в отдельном пуле потоков,
+а не в event loop uvicorn, поэтому запросы дашборда во время обновления не ждут ее завершения.
+API только ставит обновление в очередь (start_update) и читает прогресс (get_update_status).
+Доменные данные и данные по странам загружаются параллельно, каждая фаза – своим заданием в журнале
+(job_ledger.py), оба задания – одним планировщиком с приоритетами (ingest.run_dataset_jobs). Статус остается на уровне доменов, как его показывает UpdateData.jsx, и после каждого
+изменения сохраняется в общее хранилище (job_status.py), откуда его читают все процессы API.
+"""
+
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from config import DOMAINS, DERIVE_DOMAIN_FROM_COUNTRY
+from database import SessionLocal
+from models import DomainSummary
+from country_database import SessionLocal as CountrySessionLocal
+from country_models import CountrySummary
+from gap_planner import HISTORY_START, find_missing_dates, plan_units, unit_classifier, domain_weights
+from ingest import run_dataset_jobs
+from job_ledger import MAX_WORKERS, STALE_CLAIM_MINUTES
+from job_status import save_status, load_status
+
+logger = logging.getLogger("gsc_stats")
+
+# Имя статуса в общем хранилище
+STATUS_NAME = "update_data"
+
+# Одно обновление за раз
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="update-worker")
+
+_status_lock = threading.Lock()
+# Прогресс фаз: число обработанных доменов и признак завершения
+_phases = {}
+
+def _new_status(status: str):
+    return {
+        "domains_total": len(DOMAINS),
+        "domains_processed": 0,
+        "current_domain": "",
+        "current_date": "",
+        "status": status,
+        "errors": [],
+        "progress": 0,
+        "rows_written": 0,
+        "updated_at": datetime.utcnow().isoformat()
+    }
+
+_status = _new_status("idle")
+
+def is_running(status: dict):
+    """
+    Идет ли обновление. Статус running, который давно не обновлялся, считается брошенным
+    (процесс, который вел загрузку, упал) и новому запуску не мешает.
+    """
+    if status["status"] not in ("running", "updating_countries"):
+        return False
+    updated_at = datetime.fromisoformat(status.get("updated_at") or datetime.min.isoformat())
+    return datetime.utcnow() - updated_at < timedelta(minutes=STALE_CLAIM_MINUTES)
+
+def _publish():
+    """Сохраняет текущий статус в общее хранилище (вызывается под _status_lock)."""
+    _status["updated_at"] = datetime.utcnow().isoformat()
+    save_status(STATUS_NAME, _status)
+
+def get_update_status():
+    """Текущий статус обновления из общего хранилища (его видят все процессы API)."""
+    return load_status(STATUS_NAME) or copy.deepcopy(_status)
+
+def _refresh_totals():
+    """
+    Сводит прогресс фаз в поля статуса и публикует его: домен обработан, когда он загружен в обеих фазах;
+    'updating_countries' – доменные данные загружены, данные по странам еще нет.
+    """
+    total = _status["domains_total"]
+    _status["domains_processed"] = min(phase["processed"] for phase in _phases.values())
+    _status["progress"] = round(sum(phase["processed"] for phase in _phases.values()) / (total * len(_phases)) * 100)
+    if _phases["domain"]["done"] and not _phases["country"]["done"]:
+        _status["status"] = "updating_countries"
+    _publish()
+
+def _track_progress(phase: str, units, domain_label):
+    """
+    Колбэк журнала заданий для фазы: домен считается обработанным, когда выполнены все его диапазоны дат.
+    Домены без пропусков считаются обработанными сразу.
+    """
+    remaining = {}
+    for domain, _, _ in units:
+        remaining[domain] = remaining.get(domain, 0) + 1
+    with _status_lock:
+        _phases[phase]["processed"] = len(DOMAINS) - len(remaining)
+        _phases[phase]["done"] = not remaining
+        _refresh_totals()
+
+    def progress(unit, rows, error):
+        with _status_lock:
+            _status["current_domain"] = domain_label(unit.domain)
+            _status["current_date"] = unit.start_date.isoformat()
+            _status["rows_written"] += rows or 0
+            if error is not None:
+                _status["errors"].append(
+                    f"Error processing {domain_label(unit.domain)} from {unit.start_date} to {unit.end_date}: {str(error)}"
+                )
+            completed = False
+            if unit.domain in remaining:
+                remaining[unit.domain] -= 1
+                if remaining[unit.domain] == 0:
+                    _phases[phase]["processed"] += 1
+                    _phases[phase]["done"] = _phases[phase]["processed"] >= len(DOMAINS)
+                    completed = True
+            _refresh_totals()
+            if completed:
+                logger.info(f"Completed processing {domain_label(unit.domain)}, progress: {_status['progress']}%")
+    return progress
+
+def _attached(holder: dict, progress: dict):
+    """Те же таблицы загружает другое задание (cron, backfill, другой процесс API): показываем его прогресс."""
+    with _status_lock:
+        _status["current_domain"] = f"{holder['job_id']}: {progress['done']}/{progress['total']} units"
+        _publish()
+
+def _phase_job(phase: str, dataset: str, units, available_date: date, domain_label, classify):
+    """Задание фазы для ingest.run_dataset_jobs."""
+    return (f"api-{dataset}-{available_date.isoformat()}", dataset, units,
+            _track_progress(phase, units, domain_label), classify)
+
+def _finish_phase(phase: str):
+    with _status_lock:
+        _phases[phase] = {"processed": len(DOMAINS), "done": True}
+        _refresh_totals()
+
+def run_update():
+    """
+    Загружает все пропущенные (домен, дата) за период хранения: доменные данные и данные по странам
+    параллельно. При DERIVE_DOMAIN_FROM_COUNTRY обе таблицы заполняются одним запросом по странам.
+    """
+    try:
+        # Берем позавчерашний день для гарантии наличия данных
+        available_date = date.today() - timedelta(days=2)
+        logger.info(f"Starting update from earliest missing date up to {available_date}")
+
+        # Все пропущенные (домен, дата) – одним запросом к каждой таблице, включая "дыры" в середине истории
+        missing_domain_dates = find_missing_dates(SessionLocal, DomainSummary, HISTORY_START, available_date)
+        missing_country_dates = find_missing_dates(CountrySessionLocal, CountrySummary, HISTORY_START, available_date)
+
+        country_label = lambda domain: f"Country data for {domain}"
+        weights = domain_weights(SessionLocal, available_date)
+        country_classify = unit_classifier(CountrySessionLocal, CountrySummary, available_date, weights)
+        domain_dates = None
+        if DERIVE_DOMAIN_FROM_COUNTRY:
+            # Данные домена вычисляются из того же запроса по странам
+            _finish_phase("domain")
+            missing = {
+                domain: sorted(set(missing_domain_dates.get(domain, [])) | set(missing_country_dates.get(domain, [])))
+                for domain in set(missing_domain_dates) | set(missing_country_dates)
+            }
+            domain_dates = {domain: set(dates) for domain, dates in missing_domain_dates.items()}
+            jobs = [_phase_job("country", "derived", plan_units(missing), available_date, country_label, country_classify)]
+        else:
+            domain_classify = unit_classifier(SessionLocal, DomainSummary, available_date, weights)
+            jobs = [
+                _phase_job("domain", "domain", plan_units(missing_domain_dates), available_date, lambda domain: domain, domain_classify),
+                _phase_job("country", "country", plan_units(missing_country_dates), available_date, country_label, country_classify)
+            ]
+
+        try:
+            # Единицы обеих фаз разбираются общим пулом: сначала свежие дни всех доменов
+            results = run_dataset_jobs(jobs, domain_dates=domain_dates, workers=MAX_WORKERS, attached=_attached)
+        finally:
+            # Единицы, выполненные прошлым запуском того же задания, колбэк не вызывают
+            _finish_phase("domain")
+            _finish_phase("country")
+        for job_id, result in results.items():
+            logger.info(f"Job {job_id}: {result['done']} units done, {result['failed']} failed, {result['rows']} rows")
+
+        with _status_lock:
+            _status["status"] = "completed"
+            _publish()
+        logger.info("Data update process completed successfully")
+    except Exception as e:
+        with _status_lock:
+            _status["status"] = "error"
+            _status["errors"].append(f"Global error: {str(e)}")
+            _publish()
+        logger.error(f"Global error during update: {e}")
+
+def start_update():
+    """
+    Ставит обновление в очередь исполнителя, если оно еще не идет.
+    Возвращает (True, статус) для нового обновления или (False, статус) для уже идущего.
+    """
+    global _status
+    with _status_lock:
+        # Обновление может вести и другой процесс API
+        current = load_status(STATUS_NAME) or _status
+        if is_running(current):
+            return False, current
+        _status = _new_status("running")
+        _phases.clear()
+        _phases["domain"] = {"processed": 0, "done": False}
+        _phases["country"] = {"processed": 0, "done": False}
+        _publish()
+        snapshot = copy.deepcopy(_status)
+    _executor.submit(run_update)
+    return True, snapshot
@@ -0,0 +1,82 @@
+# verify_derived_totals.py
+"""
+Проверка режима DERIVE_DOMAIN_FROM_COUNTRY: для выборки доменов и окна дат сравнивает сводные данные,
+вычисленные из запроса по странам, с прямым запросом с измерением ["date"] и выводит расхождения.
+GSC может скрывать часть редких запросов в разбивке по странам, поэтому небольшое расхождение ожидаемо.
+
+Запуск: python verify_derived_totals.py [--sample 5] [--days 7] [--seed 0]
+"""
+
+import argparse
+import random
+from datetime import date, timedelta
+
+from config import DOMAINS
+from gsc_client import fetch_gsc_data_for_range, fetch_country_data_for_range, derive_domain_data_by_date
+
+def _relative_drift(derived, direct):
+    if not direct:
+        return 0.0 if not derived else float("inf")
+    return (derived - direct) / direct
+
+def compare_domain(domain: str, start_date: date, end_date: date):
+    """
+    Возвращает сводку расхождений по домену за окно: суммарные клики/показы и максимальные
+    по дням отклонения CTR и средней позиции.
+    """
+    direct = fetch_gsc_data_for_range(domain, start_date, end_date)
+    derived = derive_domain_data_by_date(domain, fetch_country_data_for_range(domain, start_date, end_date))
+
+    totals = {"direct_clicks": 0, "derived_clicks": 0, "direct_impressions": 0, "derived_impressions": 0}
+    max_ctr_diff = 0.0
+    max_position_diff = 0.0
+    missing_dates = []
+    for single_date, direct_data in direct.items():
+        derived_data = derived.get(single_date)
+        if derived_data is None:
+            missing_dates.append(single_date)
+            continue
+        totals["direct_clicks"] += direct_data["traffic_clicks"]
+        totals["derived_clicks"] += derived_data["traffic_clicks"]
+        totals["direct_impressions"] += direct_data["impressions"]
+        totals["derived_impressions"] += derived_data["impressions"]
+        max_ctr_diff = max(max_ctr_diff, abs(derived_data["ctr"] - direct_data["ctr"]))
+        max_position_diff = max(max_position_diff, abs(derived_data["avg_position"] - direct_data["avg_position"]))
+
+    return dict(
+        totals,
+        clicks_drift=_relative_drift(totals["derived_clicks"], totals["direct_clicks"]),
+        impressions_drift=_relative_drift(totals["derived_impressions"], totals["direct_impressions"]),
+        max_ctr_diff=max_ctr_diff,
+        max_position_diff=max_position_diff,
+        missing_dates=missing_dates
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение доменных данных, вычисленных из данных по странам, с прямым запросом")
+    parser.add_argument("--sample", type=int, default=5, help="число доменов в выборке")
+    parser.add_argument("--days", type=int, default=7, help="длина окна дат")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    end_date = date.today() - timedelta(days=2)
+    start_date = end_date - timedelta(days=args.days - 1)
+    domains = random.Random(args.seed).sample(DOMAINS, min(args.sample, len(DOMAINS)))
+    print(f"Окно: {start_date} - {end_date}, доменов: {len(domains)}")
+
+    for domain in domains:
+        try:
+            report = compare_domain(domain, start_date, end_date)
+        except Exception as e:
+            print(f"{domain}: ошибка запроса: {e}")
+            continue
+        print(
+            f"{domain}: клики {report['derived_clicks']}/{report['direct_clicks']} ({report['clicks_drift']:+.2%}), "
+            f"показы {report['derived_impressions']}/{report['direct_impressions']} ({report['impressions_drift']:+.2%}), "
+            f"max ΔCTR {report['max_ctr_diff']:.4f}, max Δпозиции {report['max_position_diff']:.2f}"
+        )
+        if report["missing_dates"]:
+            print(f"  нет данных по странам за: {', '.join(d.isoformat() for d in report['missing_dates'])}")
+
+if __name__ == "__main__":
+    main()
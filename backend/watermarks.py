@@ -0,0 +1,100 @@
+# watermarks.py
+"""
+Водяные знаки загрузки (ingest_watermarks): последняя и предпоследняя даты каждого домена в domain_summaries
+и country_summaries. Вместо запроса "ORDER BY date DESC LIMIT 1" на каждый домен эндпоинты читают
+все домены одним запросом к маленькой таблице.
+Знаки обновляются в той же транзакции, что и запись (db_writer, bulk_loader, replay_archive): advance_watermarks
+сдвигает их по датам только что записанных строк, не читая дневную таблицу. Полный пересчет из дневных строк
+(refresh_watermarks) нужен только после удаления строк (сверка свежих данных) и при миграции.
+updated_at меняется при каждой записи: max(updated_at) набора – версия данных для ключей кэша API.
+"""
+
+from sqlalchemy import func, select
+
+from models import IngestWatermark
+
+# Набор данных водяных знаков по дневной таблице
+DATASETS = {"domain_summaries": "domain", "country_summaries": "country"}
+
+def _watermark_sql(source: str, where: str):
+    """INSERT ... SELECT водяных знаков доменов domains (условие where) из дневной таблицы source (pyformat)."""
+    return f"""
+        INSERT INTO ingest_watermarks (dataset, domain, last_date, second_last_date, updated_at)
+        SELECT %(dataset)s, d.name, w.dates[1], w.dates[2], now()
+        FROM domains d
+        CROSS JOIN LATERAL (
+            SELECT ARRAY(SELECT DISTINCT t.date FROM {source} t WHERE t.domain_id = d.id ORDER BY t.date DESC LIMIT 2) AS dates
+        ) w
+        WHERE {where}
+        ON CONFLICT (dataset, domain) DO UPDATE SET last_date = EXCLUDED.last_date,
+            second_last_date = EXCLUDED.second_last_date, updated_at = EXCLUDED.updated_at
+    """
+
+_ADVANCE_SQL = """
+    INSERT INTO ingest_watermarks (dataset, domain, last_date, second_last_date, updated_at)
+    SELECT %(dataset)s, w.domain, w.last_date, w.second_last_date, now()
+    FROM unnest(CAST(%(domains)s AS text[]), CAST(%(last_dates)s AS date[]), CAST(%(second_last_dates)s AS date[]))
+        AS w(domain, last_date, second_last_date)
+    ON CONFLICT (dataset, domain) DO UPDATE SET
+        last_date = GREATEST(ingest_watermarks.last_date, EXCLUDED.last_date),
+        second_last_date = (
+            SELECT max(c.date) FROM unnest(ARRAY[ingest_watermarks.last_date, ingest_watermarks.second_last_date,
+                                                 EXCLUDED.last_date, EXCLUDED.second_last_date]) AS c(date)
+            WHERE c.date < GREATEST(ingest_watermarks.last_date, EXCLUDED.last_date)
+        ),
+        updated_at = EXCLUDED.updated_at
+"""
+
+def advance_watermarks(execute, source: str, written: dict):
+    """
+    Сдвигает водяные знаки после записи в дневную таблицу source: written – {домен: записанные даты}.
+    Знак – две последние даты из прежнего знака и записанных дат; дневная таблица не читается.
+    execute(sql, params) – как в rollups.refresh_rollups: SQL выполняется в транзакции записи.
+    """
+    latest = {domain: sorted(set(dates), reverse=True)[:2] for domain, dates in written.items() if dates}
+    if not latest:
+        return
+    domains = sorted(latest)
+    execute(_ADVANCE_SQL, {
+        "dataset": DATASETS[source],
+        "domains": domains,
+        "last_dates": [latest[domain][0] for domain in domains],
+        "second_last_dates": [latest[domain][1] if len(latest[domain]) > 1 else None for domain in domains]
+    })
+
+def refresh_watermarks(execute, source: str, domains):
+    """
+    Пересчитывает водяные знаки доменов domains из дневной таблицы source – после удаления строк.
+    execute(sql, params) – как в advance_watermarks.
+    """
+    domains = sorted(set(domains))
+    if domains:
+        execute(_watermark_sql(source, "d.name = ANY(%(domains)s)"), {"dataset": DATASETS[source], "domains": domains})
+
+def rebuild_watermarks(execute, source: str):
+    """Заполняет водяные знаки набора данных source заново (миграция, восстановление)."""
+    execute("DELETE FROM ingest_watermarks WHERE dataset = %(dataset)s", {"dataset": DATASETS[source]})
+    execute(_watermark_sql(source, "cardinality(w.dates) > 0"), {"dataset": DATASETS[source]})
+
+def read_watermarks(db, dataset: str = "domain"):
+    """{домен: (последняя дата, предпоследняя дата)} набора данных одним запросом."""
+    rows = db.query(IngestWatermark).filter(IngestWatermark.dataset == dataset).all()
+    return {row.domain: (row.last_date, row.second_last_date) for row in rows}
+
+def _version_query(dataset: str):
+    return select(func.max(IngestWatermark.updated_at)).where(IngestWatermark.dataset == dataset)
+
+def data_version(session_factory, dataset: str):
+    """Версия данных набора – время последней записи в него (строка для ключа кэша) или None."""
+    db = session_factory()
+    try:
+        updated_at = db.execute(_version_query(dataset)).scalar()
+    finally:
+        db.close()
+    return updated_at.isoformat() if updated_at else None
+
+async def async_data_version(session_factory, dataset: str):
+    """data_version для асинхронной фабрики сессий (async_database.py)."""
+    async with session_factory() as db:
+        updated_at = (await db.execute(_version_query(dataset))).scalar()
+    return updated_at.isoformat() if updated_at else None
@@ -102,9 +102,11 @@ function CountryChart({ data, country, metrics }) {
           ctr: 0,
           avg_position: 0,
           domains: 0,
+          estimated: false,
         };
       }
 
+      acc[dateStr].estimated = acc[dateStr].estimated || !!item.estimated;
       acc[dateStr].traffic_clicks += item.traffic_clicks || 0;
       acc[dateStr].impressions += item.impressions || 0;
 
@@ -244,9 +246,12 @@ function CountryChart({ data, country, metrics }) {
         padding: 10,
         callbacks: {
           title: (tooltipItems) => {
-            return format(new Date(chartData[tooltipItems[0].dataIndex].date), 'd MMMM yyyy', {
+            const item = chartData[tooltipItems[0].dataIndex];
+            const title = format(new Date(item.date), 'd MMMM yyyy', {
               locale: ru,
             });
+            // Дни из недельной или месячной сводки – среднее за период
+            return item.estimated ? `${title} (среднее за период)` : title;
           },
           label: (tooltipItem) => {
             const dataset = tooltipItem.dataset;
@@ -117,10 +117,12 @@ function SummaryChart({ data, metrics }) {
           impressions: 0,
           ctr: 0,
           avg_position: 0,
-          domains: 0
+          domains: 0,
+          estimated: false
         };
       }
       
+      acc[dateStr].estimated = acc[dateStr].estimated || !!item.estimated;
       acc[dateStr].traffic_clicks += item.traffic_clicks || 0;
       acc[dateStr].impressions += item.impressions || 0;
       
@@ -556,7 +558,10 @@ function SummaryChart({ data, metrics }) {
         padding: 10,
         callbacks: {
           title: (tooltipItems) => {
-            return format(new Date(summaryData[tooltipItems[0].dataIndex].date), 'd MMMM yyyy', { locale: ru });
+            const item = summaryData[tooltipItems[0].dataIndex];
+            const title = format(new Date(item.date), 'd MMMM yyyy', { locale: ru });
+            // Дни из недельной или месячной сводки – среднее за период
+            return item.estimated ? `${title} (среднее за период)` : title;
           },
           label: (tooltipItem) => {
             const dataset = tooltipItem.dataset;
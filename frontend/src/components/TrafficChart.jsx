@@ -441,7 +441,10 @@ function TrafficChart({ data, metrics, compareMode = false }) {
         padding: 10,
         callbacks: {
           title: (tooltipItems) => {
-            return format(new Date(sortedData[tooltipItems[0].dataIndex].date), 'd MMMM yyyy', { locale: ru });
+            const item = sortedData[tooltipItems[0].dataIndex];
+            const title = format(new Date(item.date), 'd MMMM yyyy', { locale: ru });
+            // Дни из недельной или месячной сводки – среднее за период
+            return item.estimated ? `${title} (среднее за период)` : title;
           },
           label: (tooltipItem) => {
             const dataset = tooltipItem.dataset;
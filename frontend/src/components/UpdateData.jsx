@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useContext, useCallback } from 'react';
+import React, { useState, useEffect, useContext, useCallback, useRef } from 'react';
 import {
   Button,
   Dialog,
@@ -27,7 +27,7 @@ import ErrorIcon from '@mui/icons-material/Error';
 import InfoIcon from '@mui/icons-material/Info';
 import CheckCircleOutlineIcon from '@mui/icons-material/CheckCircleOutline';
 import { LoadingContext } from '../App';
-import { updateDatabaseData, getUpdateStatus } from '../services/api';
+import { updateDatabaseData, getUpdateStatus, subscribeUpdateStatus } from '../services/api';
 
 /**
  * Компонент для обновления данных в базе данных
@@ -52,7 +52,20 @@ function UpdateData({
   const [updating, setUpdating] = useState(false);
   const [status, setStatus] = useState(null);
   const [error, setError] = useState(null);
-  const [pollingInterval, setPollingInterval] = useState(null);
+  // Отмена подписки на поток статуса и интервал опроса (если поток недоступен)
+  const statusStream = useRef(null);
+  const pollingInterval = useRef(null);
+
+  const stopStatusUpdates = () => {
+    if (statusStream.current) {
+      statusStream.current();
+      statusStream.current = null;
+    }
+    if (pollingInterval.current) {
+      clearInterval(pollingInterval.current);
+      pollingInterval.current = null;
+    }
+  };
 
   // Открытие диалога
   const handleClickOpen = () => {
@@ -70,11 +83,8 @@ function UpdateData({
         if (onComplete) onComplete();
       }
 
-      // Очищаем интервал при закрытии
-      if (pollingInterval) {
-        clearInterval(pollingInterval);
-        setPollingInterval(null);
-      }
+      // Отписываемся от статуса при закрытии
+      stopStatusUpdates();
 
       // Сбрасываем состояния
       setStatus(null);
@@ -91,10 +101,13 @@ function UpdateData({
       // Вызываем API для начала обновления данных
       const response = await updateDatabaseData();
 
-      if (response.status === 'started') {
-        // Запускаем периодический опрос статуса
-        const interval = setInterval(fetchUpdateStatus, 2000); // Каждые 2 секунды
-        setPollingInterval(interval);
+      // 'running' / 'updating_countries' – обновление уже идет (возможно, в другом процессе): следим за ним
+      if (['started', 'running', 'updating_countries'].includes(response.status)) {
+        // Подписываемся на поток статуса; если он недоступен (например, прокси буферизует ответ) – опрашиваем
+        statusStream.current = subscribeUpdateStatus(handleStatus, () => {
+          statusStream.current = null;
+          pollingInterval.current = setInterval(fetchUpdateStatus, 2000); // Каждые 2 секунды
+        });
       } else {
         setError('Не удалось запустить обновление данных');
         setUpdating(false);
@@ -106,27 +119,26 @@ function UpdateData({
     }
   };
 
-  // Получить текущий статус обновления
+  // Обработать очередной статус обновления
+  const handleStatus = (response) => {
+    setStatus(response);
+
+    // Если обновление завершено или произошла ошибка - отписываемся
+    if (response.status === 'completed' || response.status === 'error') {
+      stopStatusUpdates();
+      setUpdating(false);
+    }
+  };
+
+  // Получить текущий статус обновления (опрос, если поток статуса недоступен)
   const fetchUpdateStatus = async () => {
     try {
       const response = await getUpdateStatus();
-      setStatus(response);
-
-      // Если обновление завершено или произошла ошибка - останавливаем опрос
-      if (response.status === 'completed' || response.status === 'error') {
-        if (pollingInterval) {
-          clearInterval(pollingInterval);
-          setPollingInterval(null);
-        }
-        setUpdating(false);
-      }
+      handleStatus(response);
     } catch (error) {
       console.error('Error fetching update status:', error);
       // Если не удалось получить статус, останавливаем опрос
-      if (pollingInterval) {
-        clearInterval(pollingInterval);
-        setPollingInterval(null);
-      }
+      stopStatusUpdates();
       setError('Ошибка при получении статуса обновления');
       setUpdating(false);
     }
@@ -199,12 +211,8 @@ function UpdateData({
 
   // Очистка при размонтировании компонента
   useEffect(() => {
-    return () => {
-      if (pollingInterval) {
-        clearInterval(pollingInterval);
-      }
-    };
-  }, [pollingInterval]);
+    return () => stopStatusUpdates();
+  }, []); // eslint-disable-line react-hooks/exhaustive-deps
 
   // Автоматическое открытие диалога и запуск обновления
   useEffect(() => {
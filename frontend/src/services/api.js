@@ -44,6 +44,49 @@ api.interceptors.response.use(
   }
 );
 
+// Запросы за диапазон получают полные недели и месяцы одной строкой сводки (granularity=auto на сервере):
+// годовой запрос – десятки строк на домен вместо сотен дневных
+const RANGE_GRANULARITY = 'granularity=auto';
+
+// Сдвиг даты 'YYYY-MM-DD' на days дней
+const addDays = (dateStr, days) => {
+  const dt = new Date(`${dateStr}T00:00:00Z`);
+  dt.setUTCDate(dt.getUTCDate() + days);
+  return dt.toISOString().split('T')[0];
+};
+
+// Строки сводок за неделю или месяц (date – начало периода, end_date – конец, granularity) разворачиваются
+// в дневные строки, которые ожидают графики и карточки: клики и показы делятся поровну по дням периода
+// (целыми, сумма за период сохраняется), CTR, позиция и индексация берутся из сводки. Такие дни помечены estimated.
+const expandPeriodRows = (rows) => {
+  if (!Array.isArray(rows)) return rows;
+  const expanded = [];
+  rows.forEach(row => {
+    if (!row.granularity || row.granularity === 'day') {
+      expanded.push(row);
+      return;
+    }
+    const days = Math.round((new Date(row.end_date) - new Date(row.date)) / 86400000) + 1;
+    const spread = (total, index) => {
+      const value = Math.round(total || 0);
+      return Math.floor(value / days) + (index < value % days ? 1 : 0);
+    };
+    for (let i = 0; i < days; i++) {
+      expanded.push({
+        ...row,
+        date: addDays(row.date, i),
+        end_date: addDays(row.date, i),
+        traffic_clicks: spread(row.traffic_clicks, i),
+        impressions: spread(row.impressions, i),
+        period_start: row.date,
+        period_end: row.end_date,
+        estimated: true,
+      });
+    }
+  });
+  return expanded;
+};
+
 // Увеличиваем время жизни кэша
 const CACHE_TTL = 24 * 60 * 60 * 1000; // 24 часа
 
@@ -194,10 +237,10 @@ export const getSummaryRange = async (startDate, endDate, progressCallback = nul
       console.log(`Загрузка сводных данных за период ${startDate} - ${endDate}`);
       if (progressMonitor) progressMonitor(10, 0); // Начальный прогресс
       
-      const response = await api.get(`/summary_range?start_date=${startDate}&end_date=${endDate}`);
+      const response = await api.get(`/summary_range?start_date=${startDate}&end_date=${endDate}&${RANGE_GRANULARITY}`);
       
       if (progressMonitor) progressMonitor(100, 0); // Завершено
-      return response.data || [];
+      return expandPeriodRows(response.data || []);
     } catch (error) {
       console.error(`Error fetching summary range:`, error);
       
@@ -261,11 +304,11 @@ export const getDomainSummaryRange = async (domain, startDate, endDate, progress
       console.log(`Загрузка данных для ${domain} за период ${startDate} - ${endDate}`);
       if (progressMonitor) progressMonitor(10, 0); // Начальный прогресс
       
-      const response = await api.get(`/domain_range_summary?domain_name=${domain}&start_date=${startDate}&end_date=${endDate}`);
+      const response = await api.get(`/domain_range_summary?domain_name=${domain}&start_date=${startDate}&end_date=${endDate}&${RANGE_GRANULARITY}`);
       
       // Сортируем данные по дате
       const sortedData = response.data ? 
-        response.data.sort((a, b) => new Date(a.date) - new Date(b.date)) : 
+        expandPeriodRows(response.data).sort((a, b) => new Date(a.date) - new Date(b.date)) : 
         [];
       
       if (progressMonitor) progressMonitor(100, 0); // Завершено
@@ -339,10 +382,10 @@ export const getCountrySummaryRange = async (startDate, endDate, progressCallbac
       if (progressMonitor) progressMonitor(10, 0); // Начальный прогресс
       
       // Пробуем запросить все данные сразу
-      const response = await api.get(`/country_range_summary?start_date=${startDate}&end_date=${endDate}`);
+      const response = await api.get(`/country_range_summary?start_date=${startDate}&end_date=${endDate}&${RANGE_GRANULARITY}`);
       
       if (progressMonitor) progressMonitor(100, 0); // Завершено
-      return response.data || [];
+      return expandPeriodRows(response.data || []);
     } catch (error) {
       console.error(`Error fetching complete country range data:`, error);
       
@@ -384,9 +427,9 @@ export const getCountrySummaryRange = async (startDate, endDate, progressCallbac
           }
           
           try {
-            const response = await api.get(`/country_range_summary?start_date=${startStr}&end_date=${endStr}`);
+            const response = await api.get(`/country_range_summary?start_date=${startStr}&end_date=${endStr}&${RANGE_GRANULARITY}`);
             if (response.data && response.data.length > 0) {
-              allData = [...allData, ...response.data];
+              allData = [...allData, ...expandPeriodRows(response.data)];
             }
           } catch (e) {
             console.log(`Ошибка загрузки данных за месяц ${month.toISOString().slice(0, 7)}, загружаем по дням`);
@@ -505,6 +548,68 @@ export const getUpdateStatus = async () => {
   }
 };
 
+// Подписка на поток статуса обновления (server-sent events) вместо периодического опроса.
+// EventSource не передает заголовок авторизации, поэтому поток читается через fetch.
+// onStatus получает статус целиком после каждого события; возвращает функцию для отмены подписки.
+export const subscribeUpdateStatus = (onStatus, onError) => {
+  const controller = new AbortController();
+  const username = localStorage.getItem('username') || 'admin';
+  const password = localStorage.getItem('password') || 'admin_password';
+  let status = null;
+
+  const handleEvent = (rawEvent) => {
+    let event = 'message';
+    let data = '';
+    rawEvent.split('\n').forEach(line => {
+      if (line.startsWith('event:')) event = line.slice(6).trim();
+      else if (line.startsWith('data:')) data += line.slice(5).trim();
+    });
+    if (!data) return;
+    const payload = JSON.parse(data);
+    if (event === 'delta' && status) {
+      // В дельте только изменившиеся поля, в errors – только новые ошибки
+      status = {
+        ...status,
+        ...payload,
+        errors: [...(status.errors || []), ...(payload.errors || [])],
+      };
+    } else {
+      status = payload;
+    }
+    onStatus(status);
+  };
+
+  (async () => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/update_status/stream`, {
+        headers: { Authorization: `Basic ${btoa(`${username}:${password}`)}` },
+        signal: controller.signal,
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        events.forEach(handleEvent);
+      }
+    } catch (error) {
+      if (error.name !== 'AbortError') {
+        console.error('Error streaming update status:', error);
+        if (onError) onError(error);
+      }
+    }
+  })();
+
+  return () => controller.abort();
+};
+
 // Функция для предварительной загрузки данных
 export const preloadAllData = async (startDate, endDate, setLoading, setMessage) => {
   if (setLoading) setLoading(true);